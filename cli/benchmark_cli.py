@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+
+from lib.benchmarks import (
+    BENCHMARK_ENCODER_DIM,
+    postings_benchmark_command,
+    pruning_benchmark_command,
+    scheduler_benchmark_command,
+    shards_benchmark_command,
+    startup_benchmark_command,
+    suite_benchmark_command
+)
+from lib.profiling import add_profile_argument, enable_profiling
+from lib.search_utils import ENCODE_MAX_BATCH
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark CLI")
+    subparsers = parser.add_subparsers(dest="command", help="Available commands")
+
+    startup_parser = subparsers.add_parser("startup", help="Time CLI commands end to end in fresh interpreters")
+    startup_parser.add_argument("--runs", type=int, default=5, help="Runs per command (Optional)")
+    startup_parser.add_argument("--with-model", action="store_true", help="Also time a command that loads the embedding model (Optional)")
+
+    scheduler_parser = subparsers.add_parser("scheduler", help="Compare query encoding throughput and latency across micro-batching windows")
+    scheduler_parser.add_argument("--concurrency", type=int, default=16, help="Concurrent callers (Optional)")
+    scheduler_parser.add_argument("--queries", type=int, default=512, help="Queries encoded per window (Optional)")
+    scheduler_parser.add_argument("--max-batch", type=int, default=ENCODE_MAX_BATCH, help="Largest batch the scheduler builds (Optional)")
+    scheduler_parser.add_argument("--wait-ms", type=float, nargs="+", default=[0, 1, 2, 5, 10], help="Max wait windows to compare (Optional)")
+
+    suite_parser = subparsers.add_parser("suite", help="Build, size, load and query every index on synthetic corpora, printing JSON")
+    suite_parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="Corpus sizes in documents (Optional)")
+    suite_parser.add_argument("--queries", type=int, default=200, help="Queries timed per search (Optional)")
+    suite_parser.add_argument("--limit", type=int, default=10, help="Results per query (Optional)")
+    suite_parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus and queries (Optional)")
+    suite_parser.add_argument("--dim", type=int, default=BENCHMARK_ENCODER_DIM, help="Dimensions of the stand-in encoder (Optional)")
+    suite_parser.add_argument("--load-runs", type=int, default=3, help="Loads timed per index (Optional)")
+    suite_parser.add_argument("--work-dir", type=str, help="Keep the built indexes in this directory instead of a temporary one (Optional)")
+    suite_parser.add_argument("--output", type=str, help="Write the JSON to this file instead of stdout (Optional)")
+
+    corpus_parser = subparsers.add_parser("corpus", help="Write a synthetic corpus in the movies.json schema")
+    corpus_parser.add_argument("docs", type=int, help="Number of documents")
+    corpus_parser.add_argument("output", type=str, help="Path of the JSON file to write")
+    corpus_parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus (Optional)")
+
+    pruning_parser = subparsers.add_parser("pruning", help="Compare postings visited and latency of exhaustive and pruned BM25 by query length")
+    pruning_parser.add_argument("--docs", type=int, default=100000, help="Synthetic corpus size (Optional)")
+    pruning_parser.add_argument("--queries", type=int, default=200, help="Queries per query length (Optional)")
+    pruning_parser.add_argument("--words", type=int, nargs="+", default=[2, 4, 8, 16, 32], help="Query lengths in words to compare (Optional)")
+    pruning_parser.add_argument("--limit", type=int, default=10, help="Results per query (Optional)")
+    pruning_parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus and queries (Optional)")
+
+    postings_parser = subparsers.add_parser("postings", help="Measure the compression ratio and decode throughput of compressed posting lists")
+    postings_parser.add_argument("--docs", type=int, default=100000, help="Synthetic corpus size (Optional)")
+    postings_parser.add_argument("--queries", type=int, default=200, help="Queries whose posting lists are decoded and searched (Optional)")
+    postings_parser.add_argument("--limit", type=int, default=10, help="Results per query (Optional)")
+    postings_parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus and queries (Optional)")
+
+    shards_parser = subparsers.add_parser("shards", help="Compare the latency of sharded and unsharded searches")
+    shards_parser.add_argument("--docs", type=int, default=100000, help="Synthetic corpus size (Optional)")
+    shards_parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4], help="Shard counts to compare (Optional)")
+    shards_parser.add_argument("--queries", type=int, default=200, help="Number of queries (Optional)")
+    shards_parser.add_argument("--limit", type=int, default=10, help="Results per query (Optional)")
+    shards_parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus and queries (Optional)")
+
+    add_profile_argument(subparsers)
+    args = parser.parse_args()
+    if getattr(args, "profile", None):
+        enable_profiling(args.profile)
+
+    match args.command:
+        case "startup":
+            rows = startup_benchmark_command(args.runs, args.with_model)
+
+            print(f"{'command':<26} {'median ms':>10} {'min ms':>9} {'max ms':>9}")
+            for row in rows:
+                status = "" if row["ok"] else "  (failed)"
+                print(f"{row['command']:<26} {row['median_ms']:>10.1f} {row['min_ms']:>9.1f} {row['max_ms']:>9.1f}{status}")
+        case "scheduler":
+            rows = scheduler_benchmark_command(args.concurrency, args.queries, args.max_batch, args.wait_ms)
+
+            print(f"{args.queries} queries from {args.concurrency} concurrent callers, batches of up to {args.max_batch}")
+            print(f"{'window':<10} {'queries/s':>10} {'batch':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+            for row in rows:
+                print(f"{row['window']:<10} {row['queries_per_sec']:>10.1f} {row['mean_batch_size']:>7.1f} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f}")
+        case "suite":
+            results = suite_benchmark_command(args.sizes, args.queries, args.limit, args.seed, args.dim, args.load_runs, args.work_dir)
+
+            output = json.dumps(results, indent=2, sort_keys=True)
+            if args.output:
+                with open(args.output, "w") as f:
+                    f.write(output + "\n")
+                print(f"Wrote results for {len(args.sizes)} corpus sizes to {args.output}")
+            else:
+                print(output)
+        case "pruning":
+            rows = pruning_benchmark_command(args.docs, args.queries, args.words, args.limit, args.seed)
+
+            print(f"BM25 top-{args.limit} over {args.docs} synthetic movies, {args.queries} queries per length")
+            print(f"{'words':>6} {'exhaustive':>11} {'pruned':>9} {'saved':>7} {'exh. ms':>8} {'pruned ms':>10} {'identical':>10}")
+            for row in rows:
+                print(f"{row['words']:>6} {row['exhaustive_postings']:>11.0f} {row['pruned_postings']:>9.0f} {row['reduction']:>7.1%} {row['exhaustive_p50_ms']:>8.2f} {row['pruned_p50_ms']:>10.2f} {str(row['identical']):>10}")
+        case "postings":
+            stats = postings_benchmark_command(args.docs, args.queries, args.limit, args.seed)
+
+            print(f"{stats['postings']} postings over {stats['docs']} synthetic movies")
+            print(f"Plain: {stats['plain_mb']:.1f} MB rows and tfs, {stats['plain_with_impacts_mb']:.1f} MB with impacts")
+            print(f"Compressed: {stats['compressed_mb']:.1f} MB ({stats['bytes_per_posting']:.2f} bytes/posting), {stats['ratio']:.1f}x smaller, {stats['ratio_with_impacts']:.1f}x with impacts")
+            print(f"Encode: {stats['encode_postings_per_sec'] / 1e6:.1f}M postings/sec")
+            print(f"Decode: {stats['decode_postings_per_sec'] / 1e6:.1f}M postings/sec whole index, {stats['term_decode_postings_per_sec'] / 1e6:.1f}M postings/sec per query term")
+            for name in ("plain", "compressed"):
+                latency = stats[f"{name}_latency"]
+                print(f"BM25 {name}: p50 {latency['p50_ms']:.2f} ms, p95 {latency['p95_ms']:.2f} ms")
+            print(f"Identical results: {stats['identical']}")
+        case "shards":
+            rows = shards_benchmark_command(args.docs, args.shards, args.queries, args.limit, args.seed)
+
+            print(f"Top-{args.limit} over {args.docs} synthetic movies, {os.cpu_count()} CPUs")
+            print(f"{'shards':>8} {'bm25 p50':>9} {'bm25 p95':>9} {'sem. p50':>9} {'sem. p95':>9} {'identical':>10}")
+            for row in rows:
+                name = row["shards"] or "none"
+                identical = str(row["identical"]) if "identical" in row else "-"
+                print(f"{name:>8} {row['bm25']['p50_ms']:>9.2f} {row['bm25']['p95_ms']:>9.2f} {row['semantic']['p50_ms']:>9.2f} {row['semantic']['p95_ms']:>9.2f} {identical:>10}")
+        case "corpus":
+            from lib.synthetic_corpus import write_corpus
+
+            write_corpus(args.output, args.docs, args.seed)
+            print(f"Wrote {args.docs} synthetic movies to {args.output}")
+        case _:
+            parser.print_help()
+
+if __name__ == "__main__":
+    main()
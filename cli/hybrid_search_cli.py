@@ -1,17 +1,73 @@
 import argparse
 
+from lib.profiling import add_profile_argument, enable_profiling
+from lib.search_utils import DEFAULT_SEARCH_LIMIT, HYBRID_ALPHA, HYBRID_CANDIDATE_MULTIPLIER, RRF_K
+
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Hybrid Search CLI")
-    parser.add_subparsers(dest="command", help="Available commands")
+    subparsers = parser.add_subparsers(dest="command", help="Available commands")
+
+    normalize_parser = subparsers.add_parser("normalize", help="Min-max normalize a list of scores")
+    normalize_parser.add_argument("scores", type=float, nargs="*", help="Scores to normalize")
+
+    weighted_parser = subparsers.add_parser("weighted_search", help="Blend normalized BM25 and semantic scores")
+    weighted_parser.add_argument("query", type=str, help="Search query")
+    weighted_parser.add_argument("--alpha", type=float, default=HYBRID_ALPHA, help="Weight of the BM25 score, 1 - alpha weights the semantic score (Optional)")
+    weighted_parser.add_argument("--limit", type=int, default=DEFAULT_SEARCH_LIMIT, help="Search results limit (Optional)")
+    weighted_parser.add_argument("--candidates", type=int, default=HYBRID_CANDIDATE_MULTIPLIER, help="Candidates per result retrieved by each leg, more can improve fusion but slow both legs (Optional)")
+    weighted_parser.add_argument("--timings", action="store_true", help="Print the time spent by each retrieval leg (Optional)")
 
+    rrf_parser = subparsers.add_parser("rrf_search", help="Fuse BM25 and semantic rankings with reciprocal rank fusion")
+    rrf_parser.add_argument("query", type=str, help="Search query")
+    rrf_parser.add_argument("--k", type=int, default=RRF_K, help="RRF constant, higher values flatten the rank weights (Optional)")
+    rrf_parser.add_argument("--limit", type=int, default=DEFAULT_SEARCH_LIMIT, help="Search results limit (Optional)")
+    rrf_parser.add_argument("--candidates", type=int, default=HYBRID_CANDIDATE_MULTIPLIER, help="Candidates per result retrieved by each leg, more can improve fusion but slow both legs (Optional)")
+    rrf_parser.add_argument("--timings", action="store_true", help="Print the time spent by each retrieval leg (Optional)")
+
+    add_profile_argument(subparsers)
     args = parser.parse_args()
+    if getattr(args, "profile", None):
+        enable_profiling(args.profile)
 
     match args.command:
+        case "normalize":
+            from lib.hybrid_search import normalize_command
+
+            for score in normalize_command(args.scores):
+                print(f"* {score:.4f}")
+
+        case "weighted_search":
+            from lib.hybrid_search import weighted_search_command
+
+            results, timings = weighted_search_command(args.query, args.alpha, args.limit, args.candidates)
+            for i, result in enumerate(results, start=1):
+                print(f"{i}. {result['title']}")
+                print(f"   Hybrid Score: {result['score']:.4f}")
+                print(f"   BM25: {result['bm25_score']:.4f}, Semantic: {result['semantic_score']:.4f}")
+                print(f"   {result['description']}...")
+            if args.timings:
+                print_timings(timings)
+
+        case "rrf_search":
+            from lib.hybrid_search import rrf_search_command
+
+            results, timings = rrf_search_command(args.query, args.k, args.limit, args.candidates)
+            for i, result in enumerate(results, start=1):
+                print(f"{i}. {result['title']}")
+                print(f"   RRF Score: {result['score']:.4f}")
+                print(f"   BM25 Rank: {result['bm25_rank'] or '-'}, Semantic Rank: {result['semantic_rank'] or '-'}")
+                print(f"   {result['description']}...")
+            if args.timings:
+                print_timings(timings)
+
         case _:
             parser.print_help()
 
 
+def print_timings(timings: dict) -> None:
+    print(f"\nBM25: {timings['bm25_ms']:.1f} ms, Semantic: {timings['semantic_ms']:.1f} ms, Hybrid (concurrent): {timings['total_ms']:.1f} ms")
+
+
 if __name__ == "__main__":
     main()
-    
\ No newline at end of file
@@ -1,24 +1,34 @@
 #!/usr/bin/env python3
 
 import argparse
-
-from lib.keyword_search import (
-    bm25idf_command,
-    bm25_tf_command,
-    bm25search_command,
-    build_command,
-    idf_command,
-    search_command,
-    tf_command,
-    tfidf_command
+import sys
+
+from lib.profiling import add_profile_argument, enable_profiling
+from lib.search_utils import (
+    BM25_B,
+    BM25_K1,
+    COMPRESS_POSTINGS,
+    DATA_PATH,
+    DEFAULT_BUILD_BATCH_SIZE,
+    DEFAULT_QUERY_BATCH_SIZE,
+    DEFAULT_SEARCH_LIMIT
 )
-from lib.search_utils import BM25_B, BM25_K1, DEFAULT_SEARCH_LIMIT
+
+# Commands import the index inside their case, so --help starts without NumPy and
+# searches answered by a running search server never load the index
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Keyword Search CLI")
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
-    subparsers.add_parser("build", help="Build the inverted index")
+    build_parser = subparsers.add_parser("build", help="Build the inverted index")
+    build_parser.add_argument("--parallel", action="store_true", help="Stream documents and tokenize them across a process pool (Optional)")
+    build_parser.add_argument("--input", type=str, default=DATA_PATH, help="JSON or JSONL documents file to index (Optional)")
+    build_parser.add_argument("--workers", type=int, default=None, help="Number of worker processes for --parallel, defaults to the CPU count (Optional)")
+    build_parser.add_argument("--batch-size", type=int, default=DEFAULT_BUILD_BATCH_SIZE, help="Documents per worker task for --parallel (Optional)")
+    build_parser.add_argument("--compress", action=argparse.BooleanOptionalAction, default=COMPRESS_POSTINGS, help="Store compressed posting lists, a fraction of the size of the plain arrays; --no-compress stores plain arrays (Optional)")
+
+    subparsers.add_parser("migrate", help="Convert a pickled index from an older version into the binary index format")
 
     search_parser = subparsers.add_parser("search", help="Search movies using BM25")
     search_parser.add_argument("query", type=str, help="Search query")
@@ -47,42 +57,100 @@ def main() -> None:
     bm25search_parser.add_argument("query", type=str, help="Search query")
     bm25search_parser.add_argument("--limit", type=int, default=DEFAULT_SEARCH_LIMIT, help="Search results limit (Optional)")
     
+    batch_parser = subparsers.add_parser("batch", help="Search every query of a file against one loaded index, writing JSONL results")
+    batch_parser.add_argument("queries", type=str, help='File with one query per line (text or JSON with a "query" key), - for stdin')
+    batch_parser.add_argument("--limit", type=int, default=DEFAULT_SEARCH_LIMIT, help="Search results limit per query (Optional)")
+    batch_parser.add_argument("--mode", type=str, choices=["bm25", "keyword"], default="bm25", help="BM25 ranking or plain keyword matching (Optional)")
+    batch_parser.add_argument("--output", type=str, default="-", help="JSONL output file, - for stdout (Optional)")
+    batch_parser.add_argument("--batch-size", type=int, default=DEFAULT_QUERY_BATCH_SIZE, help="Queries read and written at a time (Optional)")
+
+    add_profile_argument(subparsers)
     args = parser.parse_args()
+    if getattr(args, "profile", None):
+        enable_profiling(args.profile)
 
     match args.command:
         case "build":
+            from lib.keyword_search import build_command
+            from lib.search_client import reload_server
+
             print("Building inverted index...")
-            build_command()
-            print("Inverted index built successfully.")
+            stats = build_command(args.parallel, args.input, args.workers, args.batch_size, args.compress)
+            print(f"Inverted index built successfully ({stats['index_mb']:.1f} MB{', compressed' if args.compress else ''}).")
+            print(f"Indexed {stats['docs']} documents in {stats['seconds']:.2f}s ({stats['docs_per_sec']:.0f} docs/sec, {stats['workers']} workers)")
+            print(f"Peak RSS: {stats['peak_rss_mb']['main']:.1f} MB main process, {stats['peak_rss_mb']['workers']:.1f} MB largest worker")
+            if reload_server() is not None:
+                print("Search server reloaded.")
+
+        case "batch":
+            from lib.keyword_search import batch_command
+
+            stats = batch_command(args.queries, args.limit, args.mode == "bm25", args.output, args.batch_size)
+            # Results go to stdout, so the summary goes to stderr
+            print(f"Answered {stats['queries']} queries in {stats['seconds']:.2f}s ({stats['queries_per_sec']:.0f} queries/sec)", file=sys.stderr)
 
         case "bm25idf":
+            from lib.keyword_search import bm25idf_command
+
             bm25idf = bm25idf_command(args.term)
             print(f"BM25 IDF score of '{args.term}': {bm25idf:.2f}")
 
         case "bm25tf":
+            from lib.keyword_search import bm25_tf_command
+
             bm25tf = bm25_tf_command(args.doc_id, args.term, args.k1, args.b)
             print(f"BM25 TF score of '{args.term}' in document '{args.doc_id}': {bm25tf:.2f}")
 
         case "bm25search":
-            search_results = bm25search_command(args.query, args.limit)
+            from lib.search_client import forward_search
+
+            search_results = forward_search("bm25", args.query, args.limit)
+            if search_results is None:
+                from lib.keyword_search import bm25search_command
+
+                search_results = bm25search_command(args.query, args.limit)
             for i, (doc_id, data) in enumerate(search_results.items()):
                 print(f"{i}. ({doc_id}) {data['title']} - Score: {data['score']:.2f}")
 
         case "idf":
+            from lib.keyword_search import idf_command
+
             score = idf_command(args.term)
             print(f"Inverse document frequency of '{args.term}': {score:.2f}")
             
+        case "migrate":
+            from lib.keyword_search import migrate_command
+            from lib.search_client import reload_server
+
+            print("Migrating pickled index...")
+            removed, remaining = migrate_command()
+            print(f"Index migrated successfully. Removed {', '.join(removed)}.")
+            if remaining:
+                print(f"The old {', '.join(remaining)} files can be deleted.")
+            if reload_server() is not None:
+                print("Search server reloaded.")
+
         case "search":
             print("Searching for:", args.query)
-            results = search_command(args.query)
+            from lib.search_client import forward_search
+
+            results = forward_search("keyword", args.query, DEFAULT_SEARCH_LIMIT)
+            if results is None:
+                from lib.keyword_search import search_command
+
+                results = search_command(args.query)
             for i, res in enumerate(results, 1):
                 print(f"{i}. {res['title']}")
 
         case "tf":
+            from lib.keyword_search import tf_command
+
             freq = tf_command(args.doc_id, args.term)
             print(f"'{args.term}' appears {freq} times in doc_id={args.doc_id}")
 
         case "tfidf":
+            from lib.keyword_search import tfidf_command
+
             tfidf = tfidf_command(args.doc_id, args.term)
             print(f"TF-IDF score of '{args.term}' in document '{args.doc_id}': {tfidf:.2f}")
 
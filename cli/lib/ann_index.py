@@ -0,0 +1,168 @@
+import os
+import time
+from typing import Callable, Optional
+
+import numpy as np
+
+from .search_utils import (
+    ANN_KMEANS_ITERATIONS,
+    ANN_TRAINING_POINTS_PER_LIST,
+    SCORE_BLOCK_SIZE
+)
+
+
+class IVFIndex:
+    """Inverted file index over L2-normalized embeddings.
+
+    Spherical k-means centroids partition the rows into lists. A query only scans
+    the rows of the `nprobe` lists whose centroids are closest to it, plus any
+    rows appended to the embedding matrix after the index was built, so
+    incremental updates never make results disappear.
+    """
+
+    def __init__(self, centroids: np.ndarray, indptr: np.ndarray, rows: np.ndarray) -> None:
+        # Rows of list i are rows[indptr[i]:indptr[i + 1]]
+        self.centroids = centroids
+        self.indptr = indptr
+        self.rows = rows
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def num_rows(self) -> int:
+        """Number of embedding rows covered by the lists."""
+        return len(self.rows)
+
+    @classmethod
+    def build(
+        cls,
+        embeddings: np.ndarray,
+        n_lists: Optional[int] = None,
+        iterations: int = ANN_KMEANS_ITERATIONS,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        """Train centroids on a sample of the embeddings and assign every row to its closest centroid."""
+        n_lists = n_lists or default_n_lists(len(embeddings))
+        n_lists = max(1, min(n_lists, len(embeddings)))
+        centroids = train_centroids(embeddings, n_lists, iterations, seed)
+
+        assignments = assign_to_centroids(embeddings, centroids)
+        rows = np.argsort(assignments, kind="stable").astype(np.int64)
+        indptr = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_lists), out=indptr[1:])
+
+        return cls(centroids, indptr, rows)
+
+    def candidates(self, query_embedding: np.ndarray, nprobe: int, total_rows: int) -> np.ndarray:
+        """Sorted rows to score for a normalized query: the probed lists plus rows added since the build."""
+        centroid_scores = self.centroids @ np.asarray(query_embedding, dtype=np.float32)
+        if nprobe < self.n_lists:
+            probed = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probed = np.arange(self.n_lists)
+
+        parts = [self.rows[self.indptr[i]:self.indptr[i + 1]] for i in probed.tolist()]
+        parts.append(np.arange(self.num_rows, total_rows, dtype=np.int64))
+
+        # Sorted rows read the memory-mapped matrix front to back
+        return np.sort(np.concatenate(parts))
+
+    def is_valid_for(self, total_rows: int) -> bool:
+        return self.num_rows <= total_rows
+
+    def save(self, path: str) -> None:
+        # A single file swapped in atomically, so readers never mix two builds
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, centroids=self.centroids, indptr=self.indptr, rows=self.rows)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["IVFIndex"]:
+        """Load an index, or None if there is none."""
+        if not os.path.exists(path):
+            return None
+
+        with np.load(path) as data:
+            return cls(data["centroids"], data["indptr"], data["rows"])
+
+
+def default_n_lists(num_rows: int) -> int:
+    # About sqrt(n) lists keeps both the centroid scan and the probed lists small
+    return max(1, int(np.sqrt(num_rows)))
+
+
+def assign_to_centroids(embeddings: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the closest (highest dot product) centroid of every row, computed a block at a time."""
+    assignments = np.empty(len(embeddings), dtype=np.int64)
+    for start in range(0, len(embeddings), SCORE_BLOCK_SIZE):
+        block = np.asarray(embeddings[start:start + SCORE_BLOCK_SIZE], dtype=np.float32)
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(embeddings: np.ndarray, n_lists: int, iterations: int, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on a random sample of the rows."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(embeddings), n_lists * ANN_TRAINING_POINTS_PER_LIST)
+    sample_rows = np.sort(rng.choice(len(embeddings), size=sample_size, replace=False))
+    sample = np.asarray(embeddings[sample_rows], dtype=np.float32)
+
+    centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign_to_centroids(sample, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=n_lists)
+
+        # Sum the members of every non-empty list, empty lists keep their centroid
+        nonempty = np.flatnonzero(counts)
+        starts = np.cumsum(counts) - counts
+        sums = np.add.reduceat(sample[order], starts[nonempty], axis=0)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids[nonempty] = sums / np.where(norms == 0, 1, norms)
+
+    return centroids
+
+
+def recall_at_k(approximate: list, exact: list) -> float:
+    """Fraction of the exact top-k results that the approximate search also returned."""
+    if not exact:
+        return 1.0
+    return len(set(approximate) & set(exact)) / len(exact)
+
+
+def measure_recall(
+    search: Callable[[int, Optional[int]], list],
+    num_queries: int,
+    nprobes: list[int],
+) -> list[dict]:
+    """Recall and latency of search(query_idx, nprobe) for every nprobe, against search(query_idx, None) (exact)."""
+
+    def run(nprobe: Optional[int]) -> tuple[list[list], np.ndarray]:
+        results = []
+        latencies = np.empty(num_queries)
+        for i in range(num_queries):
+            start = time.perf_counter()
+            results.append(search(i, nprobe))
+            latencies[i] = (time.perf_counter() - start) * 1000
+        return results, latencies
+
+    exact_results, exact_latencies = run(None)
+    rows = [{
+        "nprobe": "exact",
+        "recall": 1.0,
+        "mean_ms": float(exact_latencies.mean()),
+        "p95_ms": float(np.percentile(exact_latencies, 95)),
+    }]
+
+    for nprobe in nprobes:
+        results, latencies = run(nprobe)
+        rows.append({
+            "nprobe": nprobe,
+            "recall": float(np.mean([recall_at_k(a, e) for a, e in zip(results, exact_results)])),
+            "mean_ms": float(latencies.mean()),
+            "p95_ms": float(np.percentile(latencies, 95)),
+        })
+
+    return rows
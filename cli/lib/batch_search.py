@@ -0,0 +1,73 @@
+import json
+import sys
+import time
+from itertools import batched
+from typing import Callable, Iterator
+
+from .search_utils import DEFAULT_QUERY_BATCH_SIZE
+
+
+def read_queries(path: str) -> Iterator[dict]:
+    """Stream queries from a file, or from stdin for "-", one per line.
+
+    A line is either the plain query text or a JSON object with a "query" key;
+    its other keys (e.g. an "id") are copied to the output record. A line that
+    starts with "{" but is not valid JSON is plain query text. Blank lines are
+    skipped.
+    """
+    f = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+
+            if not line.startswith("{"):
+                yield {"query": line}
+                continue
+
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                yield {"query": line}
+                continue
+            if not isinstance(record.get("query"), str) or not record["query"].strip():
+                raise ValueError(f"Line {line_number} has no query")
+            yield record
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def stream_batch_results(
+    search_batch: Callable[[list[str]], list],
+    queries_path: str,
+    output_path: str = "-",
+    batch_size: int = DEFAULT_QUERY_BATCH_SIZE,
+) -> dict:
+    """Answer the queries of a file a batch at a time, writing one JSON line per query as each batch finishes.
+
+    "-" reads from stdin and writes to stdout. Only one batch of queries and
+    results is held in memory. Returns throughput statistics.
+    """
+    start_time = time.perf_counter()
+    num_queries = 0
+
+    output = sys.stdout if output_path == "-" else open(output_path, "w", encoding="utf-8")
+    try:
+        for batch in batched(read_queries(queries_path), batch_size):
+            results = search_batch([record["query"] for record in batch])
+            for record, query_results in zip(batch, results):
+                output.write(json.dumps({**record, "results": query_results}) + "\n")
+            output.flush()
+            num_queries += len(batch)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    seconds = time.perf_counter() - start_time
+    return {
+        "queries": num_queries,
+        "seconds": seconds,
+        "queries_per_sec": num_queries / seconds if seconds else 0.0,
+    }
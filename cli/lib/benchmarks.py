@@ -0,0 +1,534 @@
+import glob
+import hashlib
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+from .encode_scheduler import EncodeScheduler
+from .search_utils import ENCODE_MAX_BATCH, load_movies
+
+# Dimensions of the stand-in encoder used by the benchmark suite
+BENCHMARK_ENCODER_DIM = 64
+
+# Directory of the CLI scripts, benchmarks run them the way a user would
+CLI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SAMPLE_TEXT = "A lone astronaut wakes up on a derelict ship. The crew is gone! Who sent the signal?"
+
+# (name, script, arguments); None as script runs a bare interpreter as the baseline
+STARTUP_COMMANDS = [
+    ("python (baseline)", None, ["-c", "pass"]),
+    ("semantic --help", "semantic_search_cli.py", ["--help"]),
+    ("semantic chunk", "semantic_search_cli.py", ["chunk", SAMPLE_TEXT, "--chunk-size", "5"]),
+    ("semantic semantic_chunk", "semantic_search_cli.py", ["semantic_chunk", SAMPLE_TEXT]),
+    ("keyword --help", "keyword_search_cli.py", ["--help"]),
+    ("keyword tf", "keyword_search_cli.py", ["tf", "1", "space"]),
+    ("keyword idf", "keyword_search_cli.py", ["idf", "space"]),
+    ("keyword search", "keyword_search_cli.py", ["search", "space adventure"]),
+]
+
+# Commands that load the model, only run on request since they dominate the total time
+MODEL_COMMANDS = [
+    ("semantic embed_query", "semantic_search_cli.py", ["embed_query", "space adventure"]),
+]
+
+
+def time_command(script, arguments: list[str], runs: int) -> dict:
+    """Wall-clock time of running a CLI command in a fresh interpreter, `runs` times."""
+    command = [sys.executable] + ([os.path.join(CLI_DIR, script)] if script else []) + arguments
+
+    timings = []
+    ok = True
+    for _ in range(runs):
+        start = time.perf_counter()
+        completed = subprocess.run(command, cwd=CLI_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+        ok = ok and completed.returncode == 0
+
+    return {
+        "median_ms": statistics.median(timings),
+        "min_ms": min(timings),
+        "max_ms": max(timings),
+        "ok": ok,
+    }
+
+
+def startup_benchmark_command(runs: int = 5, include_model: bool = False) -> list[dict]:
+    commands = STARTUP_COMMANDS + (MODEL_COMMANDS if include_model else [])
+    return [{"command": name, **time_command(script, arguments, runs)} for name, script, arguments in commands]
+
+
+def latency_stats(latencies_ms: np.ndarray) -> dict:
+    return {
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+    }
+
+
+def run_concurrently(encode: Callable[[str], np.ndarray], queries: list[str], concurrency: int) -> dict:
+    """Throughput and per-query latency of encoding every query from `concurrency` threads."""
+    latencies = np.empty(len(queries))
+
+    def timed(i: int) -> None:
+        start = time.perf_counter()
+        encode(queries[i])
+        latencies[i] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed, range(len(queries))))
+    elapsed = time.perf_counter() - start
+
+    return {"queries_per_sec": len(queries) / elapsed, **latency_stats(latencies)}
+
+
+def scheduler_benchmark_command(
+    concurrency: int = 16,
+    num_queries: int = 512,
+    max_batch: int = ENCODE_MAX_BATCH,
+    waits_ms: list[float] = [0, 1, 2, 5, 10],
+) -> list[dict]:
+    """Query encoding throughput and latency without batching and with the scheduler at each max wait.
+
+    Queries are movie titles encoded straight through the model, bypassing the query cache.
+    """
+    from .semantic_search import SemanticSearch
+
+    model = SemanticSearch().load_model()
+    titles = [doc["title"] for doc in load_movies()] or ["query"]
+    queries = [titles[i % len(titles)] for i in range(num_queries)]
+
+    # Warm up, the first calls pay for lazy initialization inside the model
+    model.encode(queries[:max_batch])
+
+    rows = [{"window": "unbatched", "mean_batch_size": 1.0, **run_concurrently(lambda query: model.encode([query])[0], queries, concurrency)}]
+    for wait_ms in waits_ms:
+        scheduler = EncodeScheduler(lambda: model, max_batch, wait_ms)
+        result = run_concurrently(scheduler.encode, queries, concurrency)
+        rows.append({"window": f"{wait_ms:g} ms", "mean_batch_size": scheduler.stats()["mean_batch_size"], **result})
+
+    return rows
+
+
+class HashingEncoder:
+    """Deterministic stand-in for the sentence transformer, so benchmarks run offline.
+
+    A text is the sum of fixed random vectors of its lowercased words, seeded by
+    a hash of each word, which keeps texts sharing words close to each other.
+    """
+
+    def __init__(self, dim: int = BENCHMARK_ENCODER_DIM) -> None:
+        self.dim = dim
+        self.max_seq_length = 256
+        self._word_rows: dict[str, int] = {}
+        self._word_vectors = np.empty((0, dim), dtype=np.float32)
+        self._lock = threading.Lock()
+
+    def __rows(self, words: list[str]) -> list[int]:
+        with self._lock:
+            new_words = [word for word in dict.fromkeys(words) if word not in self._word_rows]
+            if new_words:
+                vectors = [
+                    np.random.default_rng(int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little"))
+                    .standard_normal(self.dim, dtype=np.float32)
+                    for word in new_words
+                ]
+                for word in new_words:
+                    self._word_rows[word] = len(self._word_rows)
+                self._word_vectors = np.concatenate([self._word_vectors, np.stack(vectors)])
+            return [self._word_rows[word] for word in words]
+
+    def encode(self, texts: list[str], show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        text_words = [text.lower().split() for text in texts]
+        lengths = np.array([len(words) for words in text_words], dtype=np.int64)
+        rows = np.array(self.__rows([word for words in text_words for word in words]), dtype=np.int64)
+
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        nonempty = lengths > 0
+        if nonempty.any():
+            starts = (np.cumsum(lengths) - lengths)[nonempty]
+            embeddings[nonempty] = np.add.reduceat(self._word_vectors[rows], starts, axis=0)
+        return embeddings
+
+
+def directory_size_mb(*paths: str) -> float:
+    """Total size of files and directory trees, in MB."""
+    total = 0
+    for path in paths:
+        if os.path.isfile(path):
+            total += os.path.getsize(path)
+        for root, _, files in os.walk(path):
+            total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total / 1024 / 1024
+
+
+def measure_latency(search: Callable[[Any], object], queries: list) -> dict:
+    latencies = np.empty(len(queries))
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        search(query)
+        latencies[i] = (time.perf_counter() - start) * 1000
+    return latency_stats(latencies)
+
+
+def measure_load(load: Callable[[], object], warm_up: Callable[[object], object], runs: int) -> tuple[float, float]:
+    """Median load time in seconds, and the heap (MB) held by one loaded and warmed-up instance.
+
+    Memory-mapped arrays are not on the heap, their size is part of the size on disk.
+    """
+    load_seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        load()
+        load_seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        instance = load()
+        warm_up(instance)
+        heap_bytes = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del instance
+
+    return statistics.median(load_seconds), heap_bytes / 1024 / 1024
+
+
+def benchmark_corpus(
+    num_docs: int,
+    cache_dir: str,
+    queries: list[str],
+    limit: int,
+    seed: int,
+    encoder: HashingEncoder,
+    load_runs: int,
+) -> dict:
+    """Build, size, load and query every index for one synthetic corpus."""
+    from .chunked_semantic_search import ChunkedSemanticSearch
+    from .keyword_search import InvertedIndex
+    from .semantic_search import SemanticSearch
+    from .synthetic_corpus import generate_movies
+
+    movies = list(generate_movies(num_docs, seed))
+    model_name = f"hashing-encoder-{encoder.dim}"
+    result = {"docs": num_docs}
+
+    # Keyword index
+    index = InvertedIndex(cache_dir)
+    start = time.perf_counter()
+    index.build(movies)
+    build_seconds = time.perf_counter() - start
+    index.save()
+    del index
+
+    def load_index() -> InvertedIndex:
+        index = InvertedIndex(cache_dir)
+        index.load()
+        return index
+
+    load_seconds, heap_mb = measure_load(load_index, lambda index: index.search(queries[0], limit), load_runs)
+    index = load_index()
+    result["keyword"] = {
+        "build_seconds": build_seconds,
+        "disk_mb": directory_size_mb(index.index_dir, index.doc_store_dir),
+        "heap_mb": heap_mb,
+        "load_seconds": load_seconds,
+        "latency": {
+            # search_command is load() plus InvertedIndex.search, the load is measured on its own
+            "search_command": measure_latency(lambda query: index.search(query, limit), queries),
+            "bm25_search": measure_latency(lambda query: index.bm25_search(query, limit), queries),
+        },
+    }
+    del index
+
+    # Movie and chunk embeddings, queries are distinct and the disk query cache is off, so every query is encoded
+    for name, engine_class, build, search in (
+        ("semantic", SemanticSearch, "build_embeddings", "search"),
+        ("chunked", ChunkedSemanticSearch, "build_chunk_embeddings", "search_chunks"),
+    ):
+        def create_engine() -> SemanticSearch:
+            engine = engine_class(model_name=model_name, query_disk_cache=False, cache_dir=cache_dir)
+            engine.model = encoder
+            return engine
+
+        engine = create_engine()
+        start = time.perf_counter()
+        getattr(engine, build)(movies)
+        build_seconds = time.perf_counter() - start
+        del engine
+
+        def load_engine() -> SemanticSearch:
+            engine = create_engine()
+            engine.load_or_create_embeddings(movies)
+            return engine
+
+        load_seconds, heap_mb = measure_load(load_engine, lambda engine: getattr(engine, search)(queries[0], limit), load_runs)
+        engine = load_engine()
+        prefix = "chunk" if name == "chunked" else "movie"
+        result[name] = {
+            "build_seconds": build_seconds,
+            "disk_mb": directory_size_mb(*glob.glob(os.path.join(cache_dir, f"{prefix}_*"))),
+            "heap_mb": heap_mb,
+            "load_seconds": load_seconds,
+            "latency": {f"{engine_class.__name__}.{search}": measure_latency(lambda query: getattr(engine, search)(query, limit), queries)},
+        }
+        del engine
+
+    return result
+
+
+def round_floats(value, digits: int = 4):
+    """Round every float in nested results, so runs diff cleanly."""
+    if isinstance(value, float):
+        return round(value, digits)
+    if isinstance(value, dict):
+        return {key: round_floats(item, digits) for key, item in value.items()}
+    if isinstance(value, list):
+        return [round_floats(item, digits) for item in value]
+    return value
+
+
+def suite_benchmark_command(
+    sizes: list[int],
+    num_queries: int = 200,
+    limit: int = 10,
+    seed: int = 0,
+    dim: int = BENCHMARK_ENCODER_DIM,
+    load_runs: int = 3,
+    work_dir: Optional[str] = None,
+) -> dict:
+    """Build, size, load and query every index on synthetic corpora of the given sizes.
+
+    Indexes are built in `work_dir`, a temporary directory that is removed afterwards unless given.
+    """
+    from .synthetic_corpus import generate_queries
+
+    queries = generate_queries(num_queries, seed)
+    encoder = HashingEncoder(dim)
+
+    temporary = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix="rag-benchmark-")
+    try:
+        results = [
+            benchmark_corpus(num_docs, os.path.join(work_dir, f"docs-{num_docs}"), queries, limit, seed, encoder, load_runs)
+            for num_docs in sizes
+        ]
+    finally:
+        if temporary:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return round_floats({
+        "config": {
+            "sizes": sizes,
+            "queries": num_queries,
+            "limit": limit,
+            "seed": seed,
+            "encoder": f"HashingEncoder(dim={dim})",
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    })
+
+
+def descriptive_queries(movies: list[dict], num_queries: int, num_words: int, seed: int = 0) -> list[str]:
+    """Runs of `num_words` consecutive words from random descriptions, like a user describing a movie."""
+    rng = np.random.default_rng([seed, num_words])
+    queries = []
+    for i in rng.choice(len(movies), size=num_queries).tolist():
+        words = movies[i]["description"].split()
+        start = int(rng.integers(max(1, len(words) - num_words + 1)))
+        queries.append(" ".join(words[start:start + num_words]))
+    return queries
+
+
+def pruning_benchmark_command(
+    num_docs: int = 100000,
+    num_queries: int = 200,
+    query_words: list[int] = [2, 4, 8, 16, 32],
+    limit: int = 10,
+    seed: int = 0,
+) -> list[dict]:
+    """Postings visited and latency of exhaustive and MaxScore-pruned BM25 on a synthetic corpus, per query length.
+
+    Pruned searches count every fully visited posting plus every probe of a posting
+    list for an already found document.
+    """
+    from .keyword_search import InvertedIndex
+    from .profiling import profiling
+    from .synthetic_corpus import generate_movies
+
+    movies = list(generate_movies(num_docs, seed))
+    index = InvertedIndex(tempfile.mkdtemp(prefix="rag-benchmark-"))
+    try:
+        index.build(movies)
+    finally:
+        shutil.rmtree(index.cache_dir, ignore_errors=True)
+    scorer = index._scorer
+
+    rows = []
+    for num_words in query_words:
+        queries = [index.tokenizer.tokenize(query) for query in descriptive_queries(movies, num_queries, num_words, seed)]
+
+        row = {"words": num_words, "queries": num_queries}
+        results = {}
+        for name, prune in (("exhaustive", False), ("pruned", True)):
+            scorer.prune = prune
+            with profiling() as profile:
+                results[name] = [scorer.search(tokens, limit) for tokens in queries]
+            visited = profile.counters.get("postings", 0) + profile.counters.get("posting_probes", 0)
+
+            row[f"{name}_postings"] = visited / num_queries
+            row[f"{name}_p50_ms"] = measure_latency(lambda tokens: scorer.search(tokens, limit), queries)["p50_ms"]
+
+        row["reduction"] = 1 - row["pruned_postings"] / row["exhaustive_postings"] if row["exhaustive_postings"] else 0.0
+        row["identical"] = results["pruned"] == results["exhaustive"]
+        rows.append(row)
+
+    return rows
+
+
+def postings_benchmark_command(num_docs: int = 100000, num_queries: int = 200, limit: int = 10, seed: int = 0, runs: int = 3) -> dict:
+    """Compression ratio, decode throughput and BM25 latency of compressed posting lists on a synthetic corpus.
+
+    Term decodes cover the posting lists of descriptive queries, the lists searches
+    actually read. Decode times are the best of `runs`.
+    """
+    from .index_format import CompressedPostings
+    from .keyword_search import InvertedIndex
+    from .synthetic_corpus import generate_movies
+
+    def best_seconds(run: Callable[[], object]) -> float:
+        seconds = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            run()
+            seconds.append(time.perf_counter() - start)
+        return min(seconds)
+
+    movies = list(generate_movies(num_docs, seed))
+    cache_dir = tempfile.mkdtemp(prefix="rag-benchmark-")
+    try:
+        index = InvertedIndex(cache_dir)
+        index.build(movies)
+        index.save()
+        plain = InvertedIndex(cache_dir)
+        plain.load()
+
+        # Saved again compressed, plain keeps reading the segment it has memory-mapped
+        index.compress = True
+        index.save()
+        packed = InvertedIndex(cache_dir)
+        packed.load()
+
+        segment = plain._segments[0]
+        compressed = packed._segments[0].compressed
+        num_postings = len(segment.postings)
+        encode_seconds = best_seconds(lambda: CompressedPostings.encode(segment.indptr, segment.postings, segment.tfs))
+        decode_seconds = best_seconds(compressed.decode_all)
+
+        queries = descriptive_queries(movies, num_queries, 8, seed)
+        term_ids = [term_id for query in queries for token in plain.tokenizer.tokenize(query) if (term_id := segment.term_id(token)) >= 0]
+        term_postings = sum(segment.doc_freq(term_id) for term_id in term_ids)
+        term_seconds = best_seconds(lambda: [compressed.decode_term(term_id) for term_id in term_ids])
+
+        plain_bytes = segment.postings.nbytes + segment.tfs.nbytes
+        return {
+            "docs": num_docs,
+            "postings": num_postings,
+            "plain_mb": plain_bytes / 1024 / 1024,
+            # The plain layout also stores an impact per posting, the compressed one computes them while searching
+            "plain_with_impacts_mb": (plain_bytes + segment.impacts.nbytes) / 1024 / 1024,
+            "compressed_mb": compressed.nbytes / 1024 / 1024,
+            "ratio": plain_bytes / compressed.nbytes,
+            "ratio_with_impacts": (plain_bytes + segment.impacts.nbytes) / compressed.nbytes,
+            "bytes_per_posting": compressed.nbytes / num_postings,
+            "encode_postings_per_sec": num_postings / encode_seconds,
+            "decode_postings_per_sec": num_postings / decode_seconds,
+            "term_decode_postings_per_sec": term_postings / term_seconds if term_seconds else 0.0,
+            "plain_latency": measure_latency(lambda query: plain.bm25_search(query, limit), queries),
+            "compressed_latency": measure_latency(lambda query: packed.bm25_search(query, limit), queries),
+            "identical": all(plain.bm25_search(query, limit) == packed.bm25_search(query, limit) for query in queries),
+        }
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def shards_benchmark_command(
+    num_docs: int = 100000,
+    shard_counts: list[int] = [1, 2, 4],
+    num_queries: int = 200,
+    limit: int = 10,
+    seed: int = 0,
+    dim: int = BENCHMARK_ENCODER_DIM,
+) -> list[dict]:
+    """BM25 and semantic latency of sharded searches against the unsharded engines on a synthetic corpus.
+
+    Searches are sequential, so the latencies show what fanning one query out to the
+    shards saves, or costs in inter-process overhead on small corpora and few cores.
+    """
+    from .keyword_search import InvertedIndex
+    from .semantic_search import SemanticSearch
+    from .sharded_search import ShardedSearch, build_shards
+    from .synthetic_corpus import generate_movies
+
+    movies = list(generate_movies(num_docs, seed))
+    queries = descriptive_queries(movies, num_queries, 4, seed)
+    encoder = HashingEncoder(dim)
+    cache_dir = tempfile.mkdtemp(prefix="rag-benchmark-")
+    try:
+        index = InvertedIndex(cache_dir)
+        index.build(movies)
+        semantic = SemanticSearch(cache_dir=cache_dir, query_disk_cache=False)
+        semantic.model = encoder
+        semantic.build_embeddings(movies)
+        expected = [index.bm25_search(query, limit) for query in queries]
+
+        rows = [{
+            "shards": 0,
+            "bm25": measure_latency(lambda query: index.bm25_search(query, limit), queries),
+            "semantic": measure_latency(lambda query: semantic.search(query, limit), queries),
+        }]
+
+        for num_shards in shard_counts:
+            shards_dir = os.path.join(cache_dir, f"shards-{num_shards}")
+            stats = build_shards(movies, num_shards, shards_dir, cache_dir, model=encoder)
+
+            search = ShardedSearch(shards_dir, cache_dir)
+            try:
+                search.query_encoder.model = encoder
+                search.query_encoder.query_cache.disk_cache = False
+                search.warm_up(embeddings=True)
+                results = [search.search("bm25", query, limit) for query in queries]
+                rows.append({
+                    "shards": num_shards,
+                    "build_seconds": stats["seconds"],
+                    "bm25": measure_latency(lambda query: search.search("bm25", query, limit), queries),
+                    "semantic": measure_latency(lambda query: search.search("semantic", query, limit), queries),
+                    "identical": all(
+                        [(result["id"], result["score"]) for result in shard_results] == [(doc_id, result["score"]) for doc_id, result in unsharded.items()]
+                        for shard_results, unsharded in zip(results, expected)
+                    ),
+                })
+            finally:
+                search.close()
+
+        return rows
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
@@ -0,0 +1,286 @@
+import math
+from collections import Counter
+from typing import Optional
+
+import numpy as np
+
+from .index_format import IndexSegment
+from .profiling import current_profile
+from .search_utils import BM25_B, BM25_K1, BM25_PRUNING
+
+# Relative slack on pruning decisions, far above the rounding error of summing a query's
+# impacts in a different order, so a document is never pruned because of rounding
+PRUNING_SLACK = 1e-9
+
+
+def bm25_idf(total_docs: int, df: int) -> float:
+    # Same formula as InvertedIndex.get_bm25_idf
+    return math.log((total_docs - df + 0.5) / (df + 0.5) + 1)
+
+
+def bm25_impacts(
+    tfs: np.ndarray,
+    doc_lengths: np.ndarray,
+    idf,
+    avg_doc_length: float,
+    k1: float = BM25_K1,
+    b: float = BM25_B,
+) -> np.ndarray:
+    """Return the BM25 score contribution of postings with the given tfs and doc lengths."""
+    # Same formula as InvertedIndex.get_bm25_tf
+    tfs = np.asarray(tfs, dtype=np.float64)
+    len_normalization = 1 - b + b * (np.asarray(doc_lengths) / avg_doc_length)
+    tf_component = (tfs * (k1 + 1)) / (tfs + k1 * len_normalization)
+    return tf_component * idf
+
+
+def compute_bm25_weights(
+    segment: IndexSegment,
+    total_docs: int,
+    avg_doc_length: float,
+    k1: float = BM25_K1,
+    b: float = BM25_B,
+    corpus_doc_freqs: Optional[np.ndarray] = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return the BM25 IDF of every term, the BM25 impact of every posting and the largest impact of every term.
+
+    The IDFs use `corpus_doc_freqs` when the segment is a shard of a larger corpus, the
+    document frequency of every term of the segment in the whole corpus.
+    """
+    doc_freqs = np.diff(segment.indptr).tolist()
+    idf_doc_freqs = doc_freqs if corpus_doc_freqs is None else np.asarray(corpus_doc_freqs).tolist()
+    idf = np.array([bm25_idf(total_docs, df) for df in idf_doc_freqs], dtype=np.float64)
+
+    doc_lengths = np.asarray(segment.doc_lengths)[segment.postings]
+    impacts = bm25_impacts(segment.tfs, doc_lengths, np.repeat(idf, doc_freqs), avg_doc_length, k1, b)
+
+    # Terms without postings never add to a score
+    max_impacts = np.zeros(len(doc_freqs), dtype=np.float64)
+    nonempty = np.flatnonzero(np.diff(segment.indptr))
+    if len(nonempty):
+        max_impacts[nonempty] = np.maximum.reduceat(impacts, np.asarray(segment.indptr)[nonempty])
+
+    return idf, impacts, max_impacts
+
+
+class BM25Scorer:
+    """Scores queries against the segments of an inverted index.
+
+    A freshly built or compacted index has a single segment whose BM25 impacts were
+    precomputed, so a query only accumulates them (a compressed segment stores its
+    IDFs only, and the impacts of the decoded postings are computed per query). Once incremental updates added
+    segments or tombstones the stored impacts are stale, and the impacts of the
+    query terms are computed from the live corpus statistics instead.
+
+    With precomputed impacts and per-term upper bounds, top-k searches are pruned
+    MaxScore style: terms are visited from the highest upper bound down, and once
+    the bounds of the remaining terms add up to less than the current k-th best
+    score, those terms can no longer bring in new documents. They are only probed
+    for the documents already found, and documents whose best possible score falls
+    below the k-th best are dropped.
+    """
+
+    def __init__(
+        self,
+        segments: list[IndexSegment],
+        total_docs: int,
+        avg_doc_length: float,
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+        prune: bool = BM25_PRUNING,
+    ) -> None:
+        self.segments = segments
+        self.total_docs = total_docs
+        self.avg_doc_length = avg_doc_length
+        self.k1 = k1
+        self.b = b
+
+        # Offset of each segment's rows in the score vector
+        self.row_offsets = np.cumsum([0] + [segment.total_docs for segment in segments])
+
+        self.use_impacts = (
+            len(segments) == 1
+            and segments[0].idf is not None
+            and segments[0].tombstones is None
+        )
+        self.prune = prune and self.use_impacts and segments[0].max_impacts is not None
+
+    def __term_impacts(self, token: str) -> list[tuple[int, np.ndarray, np.ndarray]]:
+        """Return (row offset, rows, impacts) of a term for every segment containing it."""
+        if self.use_impacts:
+            segment = self.segments[0]
+            term_id = segment.term_id(token)
+            if term_id < 0:
+                return []
+            return [(0, *self.__weights(term_id))]
+
+        matches = []
+        for offset, segment in zip(self.row_offsets.tolist(), self.segments):
+            term_id = segment.term_id(token)
+            if term_id >= 0:
+                rows, tfs = segment.live_postings(term_id)
+                matches.append((offset, segment, rows, tfs))
+
+        df = sum(len(rows) for _, _, rows, _ in matches)
+        if df == 0:
+            return []
+
+        idf = bm25_idf(self.total_docs, df)
+        return [
+            (offset, rows, bm25_impacts(tfs, segment.doc_lengths[rows], idf, self.avg_doc_length, self.k1, self.b))
+            for offset, segment, rows, tfs in matches
+        ]
+
+    def __weights(self, term_id: int, rows: Optional[np.ndarray] = None) -> tuple[np.ndarray, np.ndarray]:
+        """Sorted rows and BM25 impacts of a term of the single segment, only around `rows` if it is compressed."""
+        segment = self.segments[0]
+        if segment.impacts is not None:
+            postings = segment.posting_range(term_id)
+            return segment.postings[postings], segment.impacts[postings]
+
+        term_rows, tfs = segment.term_postings(term_id, rows)
+        impacts = bm25_impacts(tfs, segment.doc_lengths[term_rows], segment.idf[term_id], self.avg_doc_length, self.k1, self.b)
+        return term_rows, impacts
+
+    def __doc_ids(self, rows: np.ndarray) -> np.ndarray:
+        if len(self.segments) == 1:
+            return np.asarray(self.segments[0].doc_ids)[rows]
+
+        doc_ids = np.empty(len(rows), dtype=np.int64)
+        segment_idx = np.searchsorted(self.row_offsets, rows, side="right") - 1
+        for i, segment in enumerate(self.segments):
+            in_segment = segment_idx == i
+            doc_ids[in_segment] = segment.doc_ids[rows[in_segment] - self.row_offsets[i]]
+        return doc_ids
+
+    def search(self, tokens: list[str], limit: int) -> list[tuple[int, float]]:
+        """Return the top `limit` (doc_id, score) pairs for already tokenized query terms."""
+        if self.prune and limit > 0:
+            return self.__search_pruned(tokens, limit)
+
+        profile = current_profile()
+
+        # Maps rows -> BM25 score
+        scores = np.zeros(int(self.row_offsets[-1]), dtype=np.float64)
+
+        for token in tokens:
+            # Looking up the postings, and computing their impacts once the stored ones are stale
+            with profile.stage("postings"):
+                term_impacts = self.__term_impacts(token)
+
+            with profile.stage("bm25"):
+                for offset, rows, impacts in term_impacts:
+                    scores[offset + rows] += impacts
+                    profile.count("postings", len(rows))
+
+        with profile.stage("top_k"):
+            # Every impact is positive, so matched documents are exactly the non-zero rows
+            candidates = np.flatnonzero(scores)
+            profile.count("candidates", len(candidates))
+            return self.__top_k(candidates, scores[candidates], limit)
+
+    def __top_k(self, rows: np.ndarray, scores: np.ndarray, limit: int) -> list[tuple[int, float]]:
+        """The `limit` best (doc_id, score) pairs of the scored rows, ties broken by document ID."""
+        if limit <= 0 or len(rows) == 0:
+            return []
+
+        if len(rows) > limit:
+            # Keep everything tied with the k-th best score so ties are broken deterministically
+            kth_score = -np.partition(-scores, limit - 1)[limit - 1]
+            tied_or_better = scores >= kth_score
+            rows, scores = rows[tied_or_better], scores[tied_or_better]
+
+        # Sort by score (descending), then by document ID
+        doc_ids = self.__doc_ids(rows)
+        order = np.lexsort((doc_ids, -scores))[:limit]
+
+        return [(int(doc_ids[i]), float(scores[i])) for i in order]
+
+    def __search_pruned(self, tokens: list[str], limit: int) -> list[tuple[int, float]]:
+        """MaxScore top-k over the single segment with precomputed impacts, identical to the exhaustive search."""
+        profile = current_profile()
+        segment = self.segments[0]
+
+        # Distinct query terms in the index, a repeated term adds its impact once per occurrence
+        with profile.stage("postings"):
+            term_ids = {}
+            bounds = {}
+            for token, count in Counter(tokens).items():
+                term_ids[token] = segment.term_id(token)
+                if term_ids[token] >= 0:
+                    bounds[token] = float(segment.max_impacts[term_ids[token]]) * count
+            if not bounds:
+                return []
+
+            # Highest upper bound first, remaining[i] bounds what terms i.. can still add to a document
+            terms = sorted(bounds, key=lambda token: (-bounds[token], token))
+            remaining = np.cumsum([bounds[token] for token in reversed(terms)])[::-1].tolist() + [0.0]
+            counts = Counter(tokens)
+
+        scores = np.zeros(segment.total_docs, dtype=np.float64)
+        threshold = 0.0
+
+        # Essential terms: every posting is visited, any document can still reach the top k
+        visited: list[np.ndarray] = []
+        with profile.stage("bm25"):
+            i = 0
+            while i < len(terms) and remaining[i] >= threshold:
+                token = terms[i]
+                rows, impacts = self.__weights(term_ids[token])
+                scores[rows] += impacts * counts[token]
+                visited.append(rows)
+                profile.count("postings", len(rows))
+
+                # Rows of one list are distinct documents, so their k-th best partial score bounds the final k-th best
+                threshold = max(threshold, kth_best(scores[rows], limit))
+                i += 1
+
+            candidates = np.unique(np.concatenate(visited))
+
+        # Non-essential terms: only probed for the documents already found, which are
+        # dropped as soon as even the remaining terms cannot lift them to the threshold
+        with profile.stage("bm25_probe"):
+            profile.count("pruned_terms", len(terms) - i)
+            for token in terms[i:]:
+                candidates = candidates[scores[candidates] + remaining[i] >= threshold]
+                term_rows, impacts = self.__weights(term_ids[token], candidates)
+                positions, found = find_rows(term_rows, candidates)
+                scores[candidates[found]] += impacts[positions[found]] * counts[token]
+                profile.count("posting_probes", len(candidates))
+                threshold = max(threshold, kth_best(scores[candidates], limit))
+                i += 1
+            candidates = candidates[scores[candidates] >= threshold]
+
+        # Rescore the survivors adding the impacts in query order, as the exhaustive search does
+        with profile.stage("top_k"):
+            profile.count("candidates", len(candidates))
+            final_scores = np.zeros(len(candidates), dtype=np.float64)
+            matches = {}
+            for token in tokens:
+                if term_ids[token] < 0:
+                    continue
+                if token not in matches:
+                    term_rows, impacts = self.__weights(term_ids[token], candidates)
+                    positions, found = find_rows(term_rows, candidates)
+                    matches[token] = (found, impacts[positions[found]])
+                found, impacts = matches[token]
+                final_scores[found] += impacts
+                profile.count("posting_probes", len(candidates))
+
+            return self.__top_k(candidates, final_scores, limit)
+
+
+def kth_best(scores: np.ndarray, k: int) -> float:
+    """The k-th highest of the partial scores of distinct documents, lowered by the pruning slack; 0 if there are fewer."""
+    if len(scores) < k:
+        return 0.0
+    return float(np.partition(scores, len(scores) - k)[len(scores) - k]) * (1 - PRUNING_SLACK)
+
+
+def find_rows(term_rows: np.ndarray, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Position of each row in a term's sorted posting rows, and whether it is there."""
+    if len(term_rows) == 0:
+        return np.zeros(len(rows), dtype=np.int64), np.zeros(len(rows), dtype=bool)
+
+    positions = np.minimum(np.searchsorted(term_rows, rows), len(term_rows) - 1)
+    return positions, term_rows[positions] == rows
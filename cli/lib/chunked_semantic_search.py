@@ -1,142 +1,578 @@
 import json
 import os
-from typing import Any
-from nltk import defaultdict
+import time
+from typing import Any, Optional
 import numpy as np
 
+from .batch_search import stream_batch_results
+from .index_format import append_rows, save_array
+from .ann_index import IVFIndex, measure_recall
+from .doc_store import doc_store_fingerprint, document_map, load_doc_store
+from .embedding_pipeline import (
+    CheckpointedEmbeddings,
+    build_fingerprint,
+    format_build_stats,
+    iter_chunks,
+    iter_document_chunks,
+    stream_chunk_batches
+)
+from .embedding_store import format_store_stats, text_key, text_keys
+from .profiling import current_profile
+from .quantization import QuantizedEmbeddings, load_or_build_quantized, measure_quantization, remove_quantized
+from .query_cache import format_query_cache_stats
+from .result_cache import format_result_cache_stats, result_cache
 from .semantic_search import (
-    cosine_similarity,
-    semantic_chunk_command,
+    encode_into,
+    load_or_build_ann_index,
+    normalize_embeddings,
+    rows_match_documents,
+    scan_embeddings,
+    score_batches,
+    score_embeddings,
+    top_k_indices,
     SemanticSearch
 )
 from .search_utils import (
+    ANN_NPROBE,
     CACHE_DIR, 
-    DEFAULT_MAX_CHUNK_SIZE,
+    DEFAULT_QUERY_BATCH_SIZE,
+    EMBED_BATCH_SIZE,
+    EMBED_CHUNK_WORKERS,
+    EMBED_QUEUE_BATCHES,
+    EMBEDDING_DTYPE,
+    QUERY_DISK_CACHE,
+    RESCORE_MULTIPLIER,
     SCORE_PRECISION, 
-    load_movies
+    TOMBSTONE_ID
 )
 
+# Columns of the chunk metadata array
+CHUNK_MOVIE_IDX = 0  # ID of the document the chunk belongs to (TOMBSTONE_ID once deleted or replaced)
+CHUNK_IDX = 1  # Index of the chunk within the document
+CHUNK_TOTAL = 2  # Number of chunks of the document
+
 
 class ChunkedSemanticSearch(SemanticSearch):
-    def __init__(self) -> None:
-        super().__init__()
+    def __init__(
+        self,
+        model_name="all-MiniLM-L6-v2",
+        embedding_dtype: Optional[str] = None,
+        query_disk_cache: bool = QUERY_DISK_CACHE,
+        cache_dir: str = CACHE_DIR,
+        quantization: Optional[str] = None,
+        encode_batch_size: int = EMBED_BATCH_SIZE,
+        chunk_workers: int = EMBED_CHUNK_WORKERS,
+    ) -> None:
+        super().__init__(model_name, embedding_dtype, query_disk_cache, cache_dir, quantization, encode_batch_size)
         self.chunk_embeddings = None
-        self.chunk_metadata = None
-        self.chunk_embeddings_path = os.path.join(CACHE_DIR, "chunk_embeddings.npy")
-        self.chunk_metadata_path = os.path.join(CACHE_DIR, "chunk_metadata.json")
+
+        # Processes chunking the documents while builds encode the previous batch
+        self.chunk_workers = chunk_workers
+
+        # One int32 row per chunk embedding, see the CHUNK_* columns
+        self.chunk_metadata: Optional[np.ndarray] = None
+
+        # Content key of the description each chunk was cut from, to detect edited documents
+        self.chunk_keys: Optional[np.ndarray] = None
+
+        # Bumped on disk every time the cached chunk embeddings change, like embeddings_generation
+        self.chunk_embeddings_generation = 0
+
+        self.chunk_ann_index: Optional[IVFIndex] = None
+        self.chunk_quantized: Optional[QuantizedEmbeddings] = None
+        self.chunk_embeddings_path = os.path.join(cache_dir, "chunk_embeddings.npy")
+        self.chunk_metadata_path = os.path.join(cache_dir, "chunk_metadata.npy")
+        self.chunk_keys_path = os.path.join(cache_dir, "chunk_document_keys.npy")
+        self.chunk_embeddings_info_path = os.path.join(cache_dir, "chunk_embeddings.json")
+        self.chunk_ann_index_path = os.path.join(cache_dir, "chunk_ivf.npz")
+
+        # Written by older versions as a list of dicts
+        self.legacy_chunk_metadata_path = os.path.join(cache_dir, "chunk_metadata.json")
+
+    def __chunk_documents(self, documents: list[dict]) -> tuple[list[str], np.ndarray, np.ndarray]:
+        """Split document descriptions into chunks, returning the chunks, their metadata rows and content keys."""
+        document_chunks: list[str] = []
+        document_chunk_metadata: list[tuple[int, int, int]] = []
+        document_chunk_keys: list[int] = []
+
+        for chunk, metadata, key in iter_document_chunks(documents, self.model_name):
+            document_chunks.append(chunk)
+            document_chunk_metadata.append(metadata)
+            document_chunk_keys.append(key)
+
+        return (
+            document_chunks,
+            np.array(document_chunk_metadata, dtype=np.int32).reshape(-1, 3),
+            np.array(document_chunk_keys, dtype=np.uint64),
+        )
+
+    def __load_chunk_embeddings_info(self) -> dict:
+        """Model and layout of the cached chunk embeddings, empty for caches written by older versions."""
+        if not os.path.exists(self.chunk_embeddings_info_path):
+            return {}
+
+        with open(self.chunk_embeddings_info_path, 'r') as f:
+            return json.load(f)
+
+    def __save_chunk_embeddings_info(self, normalized: bool = True, documents_fingerprint: Optional[str] = None) -> None:
+        """Record the model and layout of the cached chunk embeddings, and the doc store version they match.
+
+        Every call starts a new generation of the chunk embeddings.
+        """
+        self.chunk_embeddings_generation = self.__load_chunk_embeddings_info().get("generation", 0) + 1
+        info = {"model": self.model_name, "normalized": normalized, "generation": self.chunk_embeddings_generation}
+        if documents_fingerprint is not None:
+            info["documents"] = documents_fingerprint
+        tmp_path = f"{self.chunk_embeddings_info_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(info, f)
+        os.replace(tmp_path, self.chunk_embeddings_info_path)
+
+    def __migrate_chunk_metadata(self) -> None:
+        """Convert chunk metadata written by older versions (JSON) into the metadata array."""
+        if os.path.exists(self.chunk_metadata_path) or not os.path.exists(self.legacy_chunk_metadata_path):
+            return
+
+        with open(self.legacy_chunk_metadata_path, 'r') as f:
+            legacy_metadata = json.load(f)
+
+        chunk_metadata = np.array(
+            [(chunk["movie_idx"], chunk["chunk_idx"], chunk["total_chunks"]) for chunk in legacy_metadata["chunks"]],
+            dtype=np.int32,
+        ).reshape(-1, 3)
+        save_array(self.chunk_metadata_path, chunk_metadata)
+        self.__save_chunk_embeddings_info(normalized=legacy_metadata.get("normalized", False))
+        os.remove(self.legacy_chunk_metadata_path)
 
     def build_chunk_embeddings(self, documents: list[dict]) -> list[Any]:
+        """Chunk, encode and save every document, streaming fixed-size batches of chunks through the encoder.
+
+        Documents are chunked by a producer thread (or worker processes) while the
+        previous batch is encoded. Every encoded batch is written to a pre-sized,
+        memory-mapped file and checkpointed, so an interrupted build of the same
+        chunks resumes after its last batch; the file replaces the cached chunk
+        embeddings once complete.
+        """
         self.documents = documents
-        self.document_map = {document['id']: document for document in documents}
-        document_chunks: list[str] = []
-        document_chunk_metadata: list[dict] = []
+        self.document_map = document_map(documents)
+        dtype = self.embedding_dtype or EMBEDDING_DTYPE
+        os.makedirs(self.cache_dir, exist_ok=True)
 
-        for document in documents:
-            description = document['description']
-            if not description.strip():
-                continue
-            
-            # Split description into 4 sentence chunks with 1 sentence overlap
-            chunks = semantic_chunk_command(
-                text=description, 
-                max_chunk_size=DEFAULT_MAX_CHUNK_SIZE,
-                overlap=1
-            )
-
-            for idx, chunk in enumerate(chunks):
-                document_chunks.append(chunk)
-                document_chunk_metadata.append({
-                    "movie_idx": document['id'],
-                    "chunk_idx": idx,
-                    "total_chunks": len(chunks)
-                })
+        # The metadata of every chunk sizes the output and identifies the build to resume
+        start_time = time.perf_counter()
+        chunk_metadata: list[tuple[int, int, int]] = []
+        chunk_keys: list[int] = []
+        for _, metadata, key in iter_chunks(documents, self.model_name, self.chunk_workers, self.encode_batch_size):
+            chunk_metadata.append(metadata)
+            chunk_keys.append(key)
+        self.chunk_metadata = np.array(chunk_metadata, dtype=np.int32).reshape(-1, 3)
+        self.chunk_keys = np.array(chunk_keys, dtype=np.uint64)
+        layout_seconds = time.perf_counter() - start_time
 
-        self.chunk_embeddings = self.model.encode(document_chunks, show_progress_bar=True)
-        self.chunk_metadata = {"chunks": document_chunk_metadata, "total_chunks": len(document_chunks)}
+        output = CheckpointedEmbeddings(
+            self.chunk_embeddings_path, len(self.chunk_keys), dtype, build_fingerprint(self.chunk_metadata, self.chunk_keys)
+        )
+        resumed = output.rows_done
+        stats: dict = {}
+        batches = stream_chunk_batches(
+            documents, self.model_name, self.encode_batch_size, self.chunk_workers, EMBED_QUEUE_BATCHES, stats, skip=resumed
+        )
+        timings = encode_into(self.embedding_store, self.load_model, (texts for texts, _, _ in batches), output, dtype)
+        self.chunk_embeddings = output.finish()
 
-        # Save chunk embeddings to a file
-        np.save(self.chunk_embeddings_path, self.chunk_embeddings)
+        self.last_build_stats = {
+            **stats,
+            **timings,
+            "chunk_seconds": stats["chunk_seconds"] + layout_seconds,
+            "seconds": time.perf_counter() - start_time,
+            "resumed": resumed,
+            "batch_size": self.encode_batch_size,
+            "workers": self.chunk_workers,
+        }
 
-        # Save chunk metadata to a json file
-        with open(self.chunk_metadata_path, 'w') as f:
-            json.dump(self.chunk_metadata, f, indent=2)
+        # Save chunk metadata next to them, it is written last
+        save_array(self.chunk_keys_path, self.chunk_keys)
+        save_array(self.chunk_metadata_path, self.chunk_metadata)
+        self.__save_chunk_embeddings_info(documents_fingerprint=doc_store_fingerprint(documents))
+        self.chunk_ann_index = load_or_build_ann_index(self.chunk_ann_index_path, self.chunk_embeddings, rebuild=True)
+        remove_quantized(self.chunk_embeddings_path)
+        if self.quantization is not None:
+            self.chunk_quantized = load_or_build_quantized(self.chunk_embeddings_path, self.chunk_embeddings, self.quantization)
 
         return self.chunk_embeddings
 
+    def __load_cached_chunk_embeddings(self, documents: list[dict]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Memory-map the cached chunk embeddings and load their metadata and content keys.
+
+        Older caches are normalized or cast first.
+        """
+        self.__migrate_chunk_metadata()
+        chunk_embeddings = np.load(self.chunk_embeddings_path, 'r')
+
+        dtype = self.embedding_dtype or chunk_embeddings.dtype
+        if not self.__load_chunk_embeddings_info().get("normalized") or chunk_embeddings.dtype != dtype:
+            # Normalizing and casting the stored vectors is enough, nothing is re-encoded
+            save_array(self.chunk_embeddings_path, normalize_embeddings(chunk_embeddings, dtype))
+            self.__save_chunk_embeddings_info()
+            chunk_embeddings = np.load(self.chunk_embeddings_path, 'r')
+
+        chunk_metadata = np.load(self.chunk_metadata_path, 'r')
+        movie_ids = chunk_metadata[:, CHUNK_MOVIE_IDX]
+
+        if os.path.exists(self.chunk_keys_path):
+            chunk_keys = np.load(self.chunk_keys_path)[:len(chunk_metadata)]
+            # Rows whose key was not written never match a document
+            chunk_keys = np.pad(chunk_keys, (0, len(chunk_metadata) - len(chunk_keys)))
+        else:
+            # Caches written before content keys existed are assumed to match the documents
+            documents_keys = {doc['id']: text_key(self.model_name, doc['description']) for doc in documents}
+            chunk_keys = np.array([documents_keys.get(movie_id, 0) for movie_id in movie_ids.tolist()], dtype=np.uint64)
+            save_array(self.chunk_keys_path, chunk_keys)
+
+        # Rows appended after the metadata was last written are not published yet
+        return chunk_embeddings[:len(chunk_metadata)], chunk_metadata, chunk_keys
+
+    def __seed_embedding_store(self, documents: list[dict]) -> None:
+        """Add the cached chunk embeddings of documents whose description did not change to the embedding store."""
+        movie_ids = np.asarray(self.chunk_metadata[:, CHUNK_MOVIE_IDX])
+        chunk_indices = np.asarray(self.chunk_metadata[:, CHUNK_IDX])
+        documents_by_id = {doc['id']: doc for doc in documents}
+
+        rows: list[np.ndarray] = []
+        texts: list[str] = []
+        for movie_id, first_row in zip(*np.unique(movie_ids, return_index=True)):
+            document = documents_by_id.get(int(movie_id))
+            if document is None or self.chunk_keys[first_row] != text_key(self.model_name, document['description']):
+                continue
+
+            # The chunks of a document are contiguous rows in chunk order
+            document_chunks, _, _ = self.__chunk_documents([document])
+            document_rows = np.arange(first_row, min(first_row + len(document_chunks), len(movie_ids)))
+            if len(document_rows) != len(document_chunks) or np.any(movie_ids[document_rows] != movie_id) \
+                    or np.any(chunk_indices[document_rows] != np.arange(len(document_chunks))):
+                continue
+
+            rows.append(document_rows)
+            texts.extend(document_chunks)
+
+        if texts:
+            self.embedding_store.add(text_keys(self.model_name, texts), self.chunk_embeddings[np.concatenate(rows)])
+
     def load_or_create_embeddings(self, documents: list[dict]) -> list[Any]:
         self.documents = documents
-        self.document_map = {document['id']: document for document in documents}
+        self.document_map = document_map(documents)
 
-        # If chunk embeddings are cached, load them
-        if os.path.exists(self.chunk_embeddings_path):
-            self.chunk_embeddings = np.load(self.chunk_embeddings_path, 'r')
+        # If chunk embeddings of this model are cached and match the current descriptions, load them
+        info = self.__load_chunk_embeddings_info()
+        self.chunk_embeddings_generation = info.get("generation", 0)
+        cached_model = info.get("model", self.model_name)
+        cached = os.path.exists(self.chunk_metadata_path) or os.path.exists(self.legacy_chunk_metadata_path)
+        if os.path.exists(self.chunk_embeddings_path) and cached and cached_model == self.model_name:
+            profile = current_profile()
+            with profile.stage("load_embeddings"):
+                self.chunk_embeddings, self.chunk_metadata, self.chunk_keys = self.__load_cached_chunk_embeddings(documents)
 
-        # If chunk metadata is cached, load them
-        if os.path.exists(self.chunk_metadata_path):
-            with open(self.chunk_metadata_path, 'r') as f:
-                self.chunk_metadata = json.load(f)
+            with profile.stage("check_embeddings"):
+                # Chunks known to match this doc store version are not compared text by text
+                fingerprint = doc_store_fingerprint(documents)
+                up_to_date = fingerprint is not None and info.get("documents") == fingerprint
+                if not up_to_date:
+                    # Documents without a description have no chunks
+                    chunked = [doc for doc in documents if doc['description'].strip()]
+                    documents_keys = text_keys(self.model_name, [doc['description'] for doc in chunked])
+                    movie_ids = np.asarray(self.chunk_metadata[:, CHUNK_MOVIE_IDX])
+                    up_to_date = rows_match_documents(movie_ids, self.chunk_keys, [doc['id'] for doc in chunked], documents_keys)
+                    if up_to_date and fingerprint is not None:
+                        self.__save_chunk_embeddings_info(documents_fingerprint=fingerprint)
 
-        if self.chunk_embeddings is None or self.chunk_metadata is None:
-            self.build_chunk_embeddings(documents)
+            if up_to_date:
+                with profile.stage("load_ann_index"):
+                    self.chunk_ann_index = load_or_build_ann_index(self.chunk_ann_index_path, self.chunk_embeddings)
+                if self.quantization is not None:
+                    with profile.stage("load_quantized"):
+                        self.chunk_quantized = load_or_build_quantized(self.chunk_embeddings_path, self.chunk_embeddings, self.quantization)
+                return self.chunk_embeddings
 
-        return self.chunk_embeddings
+            # Chunks of unchanged descriptions are reused by the rebuild
+            if self.chunk_embeddings.dtype == np.float32:
+                self.__seed_embedding_store(chunked)
+
+        # Only new or changed chunk texts are encoded
+        return self.build_chunk_embeddings(documents)
 
-    def search_chunks(self, query: str, limit: int = 10) -> list[dict]:
+    def search_chunks(self, query: str, limit: int = 10, exact: bool = False, nprobe: int = ANN_NPROBE) -> list[dict]:
         # Generate an embedding of the query
-        query_embedding = self.generate_embedding(query)
-        
-        # Track scores for each chunk embedding
-        chunk_scores: list[dict] = []
-        
-        # For each chunk embedding
-        for chunk_idx, metadata in enumerate(self.chunk_metadata.get("chunks", [])):
-            # Calculate the cosine similarity between the chunk embedding and the query embedding
-            chunk_embedding = self.chunk_embeddings[chunk_idx]
-            score = cosine_similarity(query_embedding, chunk_embedding)
-            
-            chunk_scores.append({
-                "chunk_idx": metadata['chunk_idx'],  # The index of the chunk within the document
-                "movie_idx": metadata["movie_idx"],  # The index of the document in self.documents
-                "score": score  # The cosine similarity score
-            })
-        
-        # Track scores for each movie
-        movie_scores: dict = {}
-        
-        for chunk_score in chunk_scores:
-            movie_idx = chunk_score["movie_idx"]
-            score = chunk_score["score"]
-            
-            if movie_idx not in movie_scores or score > movie_scores[movie_idx]:
-                movie_scores[movie_idx] = score
-        
-        # Sort the movie scores by score in descending order
-        sorted_movie_scores = sorted(movie_scores.items(), key=lambda x: x[1], reverse=True)
-        
+        query_embedding = normalize_embeddings(self.generate_embedding(query))
+
+        return self.search_chunks_by_embedding(query_embedding, limit, exact, nprobe)
+
+    def search_chunks_by_embedding(
+        self,
+        query_embedding: np.ndarray,
+        limit: int = 10,
+        exact: bool = False,
+        nprobe: int = ANN_NPROBE,
+    ) -> list[dict]:
+        """Search chunks with an already normalized query embedding."""
+        # Score the chunks of the probed IVF lists, or every chunk for an exact search
+        scores, rows = scan_embeddings(
+            self.chunk_embeddings, query_embedding, self.chunk_ann_index, exact, nprobe, self.chunk_quantized, limit * RESCORE_MULTIPLIER
+        )
+
+        return self.__top_movies(scores, rows, limit)
+
+    def search_chunks_batch(self, queries: list[str], limit: int = 10, exact: bool = False, nprobe: int = ANN_NPROBE) -> list[list[dict]]:
+        """Results of many queries, encoded in one batch and, when every chunk is scanned, scored with matrix products."""
+        query_embeddings = normalize_embeddings(self.generate_embeddings(queries))
+        if (not exact and self.chunk_ann_index is not None) or self.chunk_quantized is not None:
+            # Every query probes its own lists or rescores its own candidates, so they are scored one at a time
+            return [self.search_chunks_by_embedding(query_embedding, limit, exact, nprobe) for query_embedding in query_embeddings]
+
+        rows = np.arange(len(self.chunk_embeddings))
+        results = []
+        for batch in score_batches(len(self.chunk_embeddings), len(queries)):
+            scores = score_embeddings(self.chunk_embeddings, query_embeddings[batch])
+            results.extend(self.__top_movies(query_scores, rows, limit) for query_scores in scores)
+        return results
+
+    def __top_movies(self, scores: np.ndarray, rows: np.ndarray, limit: int) -> list[dict]:
+        profile = current_profile()
+        with profile.stage("aggregate"):
+            # Skip chunks of deleted or replaced documents
+            movie_ids = np.asarray(self.chunk_metadata[rows, CHUNK_MOVIE_IDX])
+            live = movie_ids != TOMBSTONE_ID
+
+            # Score each movie by its best chunk
+            movie_ids, movie_scores = max_pool_by_group(movie_ids[live], scores[live])
+
+        with profile.stage("top_k"):
+            top_indices = top_k_indices(movie_scores, limit)
+
         results = []
-        for movie_idx, score in sorted_movie_scores[:limit]:
-            doc = self.document_map.get(movie_idx)
+        for i in top_indices:
+            doc = self.document_map.get(int(movie_ids[i]))
             if doc:
                 results.append({
                     "id": doc["id"],
                     "title": doc["title"],
                     "description": doc["description"][:100],
-                    "score": round(score, SCORE_PRECISION)
+                    "score": round(float(movie_scores[i]), SCORE_PRECISION)
                 })
         
         return results
 
+    def apply_delta(self, previous_documents: list[dict], upserts: list[dict], deletes: list[int]) -> Optional[dict]:
+        """Chunk and encode only added or changed documents, appending them to the cached chunk embeddings.
 
-def embed_chunks_command():
-    documents = load_movies()
-    chunkedSS = ChunkedSemanticSearch()
+        Chunks of replaced or deleted documents are tombstoned until compact() drops them.
+        Returns None if there are no cached chunk embeddings to update.
+        """
+        self.__migrate_chunk_metadata()
+        if not os.path.exists(self.chunk_embeddings_path) or not os.path.exists(self.chunk_metadata_path):
+            return None
+
+        chunk_embeddings, chunk_metadata, chunk_keys = self.__load_cached_chunk_embeddings(previous_documents)
+        # Rows are about to change, they no longer match any doc store version
+        self.__save_chunk_embeddings_info()
+        if len(chunk_embeddings) != len(np.load(self.chunk_embeddings_path, 'r')):
+            # Drop unpublished rows so appended rows line up with their metadata
+            save_array(self.chunk_embeddings_path, np.array(chunk_embeddings))
+
+        upserts_by_id = {document['id']: document for document in upserts}
+        chunk_metadata = np.array(chunk_metadata)
+        removed = np.isin(chunk_metadata[:, CHUNK_MOVIE_IDX], list(set(deletes) | set(upserts_by_id)))
+        chunk_metadata[removed, CHUNK_MOVIE_IDX] = TOMBSTONE_ID
+
+        document_chunks, document_chunk_metadata, document_chunk_keys = self.__chunk_documents(list(upserts_by_id.values()))
+        if document_chunks:
+            vectors = self.embedding_store.encode(self.load_model, document_chunks, show_progress_bar=True)
+            append_rows(self.chunk_embeddings_path, normalize_embeddings(vectors))
+            chunk_metadata = np.concatenate([chunk_metadata, document_chunk_metadata])
+            chunk_keys = np.concatenate([chunk_keys, document_chunk_keys])
+
+        # Publishing the metadata makes the appended rows and the tombstones visible
+        save_array(self.chunk_keys_path, chunk_keys)
+        save_array(self.chunk_metadata_path, chunk_metadata)
+        self.__save_chunk_embeddings_info()
+        self.chunk_metadata = chunk_metadata
+        self.chunk_keys = chunk_keys
+
+        return {"encoded": len(document_chunks), "tombstoned": int(removed.sum())}
+
+    def compact(self) -> bool:
+        """Drop tombstoned chunks from the cached chunk embeddings. Returns False if there was nothing to drop."""
+        self.__migrate_chunk_metadata()
+        if not os.path.exists(self.chunk_embeddings_path) or not os.path.exists(self.chunk_metadata_path):
+            return False
+
+        chunk_embeddings = np.load(self.chunk_embeddings_path, 'r')
+        chunk_metadata = np.load(self.chunk_metadata_path)
+        live = chunk_metadata[:, CHUNK_MOVIE_IDX] != TOMBSTONE_ID
+        if live.all() and len(chunk_embeddings) == len(chunk_metadata):
+            return False
+
+        save_array(self.chunk_embeddings_path, chunk_embeddings[:len(chunk_metadata)][live])
+        if os.path.exists(self.chunk_keys_path):
+            chunk_keys = np.load(self.chunk_keys_path)[:len(chunk_metadata)]
+            chunk_keys = np.pad(chunk_keys, (0, len(chunk_metadata) - len(chunk_keys)))
+            save_array(self.chunk_keys_path, chunk_keys[live])
+        save_array(self.chunk_metadata_path, chunk_metadata[live])
+        self.__save_chunk_embeddings_info()
+        self.chunk_metadata = chunk_metadata[live]
+
+        # Rows moved, the ANN index and the quantized codes are rebuilt on the next load
+        if os.path.exists(self.chunk_ann_index_path):
+            os.remove(self.chunk_ann_index_path)
+        remove_quantized(self.chunk_embeddings_path)
+        return True
+
+
+def max_pool_by_group(group_ids: np.ndarray, scores: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Maximum score of every group, as a segment reduction over the groups.
+
+    Groups are returned in order of their first appearance in `group_ids`, so
+    ties between groups are broken the same way as a stable sort would.
+    """
+    if len(group_ids) == 0:
+        return group_ids, scores
+
+    # Contiguous segments per group; a stable sort keeps each segment in input order
+    order = np.argsort(group_ids, kind="stable")
+    sorted_ids = group_ids[order]
+    starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+    max_scores = np.maximum.reduceat(scores[order], starts)
+
+    by_first_appearance = np.argsort(order[starts])
+    return sorted_ids[starts][by_first_appearance], max_scores[by_first_appearance]
+
+
+def embed_chunks_command(batch_size: int = EMBED_BATCH_SIZE, workers: int = EMBED_CHUNK_WORKERS):
+    documents = load_doc_store()
+    chunkedSS = ChunkedSemanticSearch(encode_batch_size=batch_size, chunk_workers=workers)
     embeddings = chunkedSS.load_or_create_embeddings(documents)
 
     print(f"Generated {len(embeddings)} chunked embeddings")
+    if chunkedSS.last_build_stats is not None:
+        print(format_build_stats(chunkedSS.last_build_stats))
+    if chunkedSS.embedding_store.last_stats is not None:
+        print(format_store_stats(chunkedSS.embedding_store.last_stats))
 
-def search_chunked_command(query: str, limit: int) -> list[dict]:
-    documents = load_movies()
-    chunkedSS = ChunkedSemanticSearch()
+def search_chunked_command(
+    query: str,
+    limit: int,
+    exact: bool = False,
+    nprobe: int = ANN_NPROBE,
+    show_cache_stats: bool = False,
+    quantization: Optional[str] = None,
+) -> list[dict]:
+    documents = load_doc_store()
+    chunkedSS = ChunkedSemanticSearch(quantization=quantization)
     _ = chunkedSS.load_or_create_embeddings(documents)
 
-    return chunkedSS.search_chunks(query, limit)
\ No newline at end of file
+    cache = result_cache("chunked")
+    results = cache.get_or_search(
+        lambda: chunkedSS.search_chunks(query, limit, exact, nprobe),
+        chunkedSS.chunk_embeddings_generation,
+        doc_store_fingerprint(documents),
+        query,
+        limit,
+        model=chunkedSS.model_name,
+        dtype=str(chunkedSS.chunk_embeddings.dtype),
+        exact=exact,
+        nprobe=nprobe,
+        quantization=quantization,
+    )
+    if show_cache_stats:
+        print(format_query_cache_stats(chunkedSS.query_cache.stats()))
+        print(format_result_cache_stats(cache.stats()))
+
+    return results
+
+
+def batch_search_chunked_command(
+    queries_path: str,
+    limit: int,
+    exact: bool = False,
+    nprobe: int = ANN_NPROBE,
+    output_path: str = "-",
+    batch_size: int = DEFAULT_QUERY_BATCH_SIZE,
+    quantization: Optional[str] = None,
+) -> dict:
+    """Search every query of a file against the loaded chunk embeddings, streaming JSONL results."""
+    chunkedSS = ChunkedSemanticSearch(quantization=quantization)
+    chunkedSS.load_or_create_embeddings(load_doc_store())
+
+    return stream_batch_results(
+        lambda queries: chunkedSS.search_chunks_batch(queries, limit, exact, nprobe),
+        queries_path,
+        output_path,
+        batch_size,
+    )
+
+
+def ann_report_command(limit: int, num_queries: int, nprobes: list[int]) -> dict[str, list[dict]]:
+    """Recall@limit and latency of the ANN searches against exact search, for every nprobe.
+
+    Queries are the titles of randomly sampled movies, encoded once up front so
+    only the retrieval is timed.
+    """
+    documents = load_doc_store()
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(documents), size=min(num_queries, len(documents)), replace=False)
+
+    semanticSS = SemanticSearch()
+    semanticSS.load_or_create_embeddings(documents)
+    chunkedSS = ChunkedSemanticSearch()
+    chunkedSS.load_or_create_embeddings(documents)
+
+    queries = normalize_embeddings(semanticSS.model.encode([documents.field_at(int(i), 'title') for i in sample]))
+
+    # Small matrices have no ANN index on disk, build one in memory for the report
+    if semanticSS.ann_index is None:
+        semanticSS.ann_index = IVFIndex.build(semanticSS.embeddings)
+    if chunkedSS.chunk_ann_index is None:
+        chunkedSS.chunk_ann_index = IVFIndex.build(chunkedSS.chunk_embeddings)
+
+    def search_movies(i: int, nprobe: Optional[int]) -> list[int]:
+        results = semanticSS.search_by_embedding(queries[i], limit, exact=nprobe is None, nprobe=nprobe or ANN_NPROBE)
+        return [result['id'] for result in results]
+
+    def search_chunks(i: int, nprobe: Optional[int]) -> list[int]:
+        results = chunkedSS.search_chunks_by_embedding(queries[i], limit, exact=nprobe is None, nprobe=nprobe or ANN_NPROBE)
+        return [result['id'] for result in results]
+
+    return {
+        "movies": measure_recall(search_movies, len(queries), nprobes),
+        "chunks": measure_recall(search_chunks, len(queries), nprobes),
+    }
+
+
+def quantization_report_command(limit: int, num_queries: int) -> dict[str, list[dict]]:
+    """Memory saved, recall@limit and latency of the quantized searches against scanning the stored embeddings.
+
+    Every search scans all rows, so the recall only reflects the quantization.
+    Queries are the titles of randomly sampled movies, encoded once up front.
+    """
+    documents = load_doc_store()
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(documents), size=min(num_queries, len(documents)), replace=False)
+
+    semanticSS = SemanticSearch()
+    semanticSS.load_or_create_embeddings(documents)
+    chunkedSS = ChunkedSemanticSearch()
+    chunkedSS.load_or_create_embeddings(documents)
+
+    queries = normalize_embeddings(semanticSS.model.encode([documents.field_at(int(i), 'title') for i in sample]))
+
+    def search_movies(i: int, quantized: Optional[QuantizedEmbeddings]) -> list[int]:
+        semanticSS.quantized = quantized
+        return [result['id'] for result in semanticSS.search_by_embedding(queries[i], limit, exact=True)]
+
+    def search_chunks(i: int, quantized: Optional[QuantizedEmbeddings]) -> list[int]:
+        chunkedSS.chunk_quantized = quantized
+        return [result['id'] for result in chunkedSS.search_chunks_by_embedding(queries[i], limit, exact=True)]
+
+    return {
+        "movies": measure_quantization(search_movies, len(queries), semanticSS.embeddings, semanticSS.embeddings_path),
+        "chunks": measure_quantization(search_chunks, len(queries), chunkedSS.chunk_embeddings, chunkedSS.chunk_embeddings_path),
+    }
@@ -0,0 +1,344 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections.abc import Mapping
+from typing import Any, Iterable, Iterator, Optional, Union
+
+import numpy as np
+
+from .index_builder import iter_documents
+from .index_format import (
+    StringTable,
+    load_array,
+    next_segment_name,
+    read_generation,
+    read_manifest,
+    remove_unused_segments,
+    save_array,
+    write_manifest,
+)
+from .profiling import current_profile
+from .search_utils import CACHE_DIR, DATA_PATH
+
+DOC_STORE_DIR = "docstore"
+RECORDS_FILE = "records.bin"
+VERSION_FILE = "version.json"
+
+# Name an inverted index pins the version of its cache directory's store under
+INDEX_PIN = "index"
+
+# Stores opened by this process, so every engine of the process shares one mapping per directory
+_open_stores: dict[str, "DocStore"] = {}
+_open_stores_lock = threading.Lock()
+
+
+class DocRecord(Mapping):
+    """One document of a doc store, every field decoded from the mapped records when it is read."""
+
+    __slots__ = ("_store", "_row")
+
+    def __init__(self, store: "DocStore", row: int) -> None:
+        self._store = store
+        self._row = row
+
+    def __getitem__(self, name: str) -> Any:
+        if name == "id":
+            return int(self._store.ids[self._row])
+        return self._store.field_at(self._row, name)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(("id", *self._store.fields))
+
+    def __len__(self) -> int:
+        return len(self._store.fields) + 1
+
+    def __reduce__(self):
+        # Sent to other processes as a plain dict, not with the whole store
+        return dict, (dict(self),)
+
+    def __repr__(self) -> str:
+        return f"DocRecord({dict(self)!r})"
+
+
+class DocStore:
+    """Documents stored as one binary file of UTF-8 field values plus an offset table, memory-mapped.
+
+    Field f of the document in row r is the byte range of entry r * len(fields) + f
+    of the offset table. Text fields are stored as is, other fields as JSON. Records
+    are looked up by document ID and decoded a field at a time, so loading a store
+    reads no document. Every write publishes a new version directory through a
+    manifest, readers that have the previous one mapped keep reading it. A version
+    pinned by an index stays loadable until the index pins another one.
+    """
+
+    def __init__(self, directory: str, manifest: dict, ids: np.ndarray, order: np.ndarray, records: StringTable) -> None:
+        self.directory = directory
+        self.version: str = manifest["segments"][0]
+        self.generation: int = manifest["generation"]
+        self.fingerprint: str = manifest["fingerprint"]
+        self.fields: list[str] = manifest["fields"]
+        self.json_fields = frozenset(manifest["json_fields"])
+        self.source: Optional[dict] = manifest.get("source")
+        self.ids = ids
+        self.records = records
+
+        # Rows in document ID order, to find a document by binary search
+        self._order = order
+        self._sorted_ids = ids[order]
+        self._field_index = {name: i for i, name in enumerate(self.fields)}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[DocRecord]:
+        """Every document in the order it was written."""
+        return (DocRecord(self, row) for row in range(len(self.ids)))
+
+    def __contains__(self, doc_id: int) -> bool:
+        return self.row(doc_id) >= 0
+
+    def row(self, doc_id: int) -> int:
+        """Row of a document, -1 if it is not stored."""
+        i = int(np.searchsorted(self._sorted_ids, doc_id))
+        if i < len(self._sorted_ids) and self._sorted_ids[i] == doc_id:
+            return int(self._order[i])
+        return -1
+
+    def get(self, doc_id: int, default: Any = None) -> Union[DocRecord, Any]:
+        row = self.row(doc_id)
+        return DocRecord(self, row) if row >= 0 else default
+
+    def __getitem__(self, doc_id: int) -> DocRecord:
+        row = self.row(doc_id)
+        if row < 0:
+            raise KeyError(doc_id)
+        return DocRecord(self, row)
+
+    def field_at(self, row: int, name: str) -> Any:
+        if name not in self._field_index:
+            raise KeyError(name)
+
+        value = self.records[row * len(self.fields) + self._field_index[name]]
+        return json.loads(value) if name in self.json_fields else value
+
+    def is_current(self) -> bool:
+        """Whether the file the store was written from is unchanged, always True for stores of in-memory documents."""
+        if self.source is None:
+            return True
+        return self.source == source_stat(self.source["path"])
+
+    @classmethod
+    def load(cls, directory: str, version: Optional[str] = None) -> Optional["DocStore"]:
+        """Memory-map the published version of a store, or a version still kept by the store.
+
+        Returns None if there is no such version.
+        """
+        manifest = read_manifest(directory)
+        if manifest is None:
+            return None
+
+        if version is not None and version != manifest["segments"][0]:
+            if version not in manifest["segments"]:
+                return None
+            with open(os.path.join(directory, version, VERSION_FILE), "r") as f:
+                manifest = {**json.load(f), "segments": [version]}
+
+        version_dir = os.path.join(directory, manifest["segments"][0])
+        return cls(
+            directory,
+            manifest,
+            load_array(os.path.join(version_dir, "ids.npy")),
+            load_array(os.path.join(version_dir, "order.npy")),
+            load_records(version_dir),
+        )
+
+
+class DocStoreWriter:
+    """Writes documents to a new version of a doc store, readable after close() and current after publish().
+
+    Documents stream straight to the records file. The fields of the first document
+    are the fields of the store; a later document with other fields is rejected.
+    Only the first document with a given ID is written.
+    """
+
+    def __init__(self, directory: str, source_path: Optional[str] = None) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.version = next_segment_name(directory)
+        self.version_dir = os.path.join(directory, self.version)
+        os.makedirs(self.version_dir)
+
+        # Taken before any document is read, a change made while writing makes the store stale
+        self.source = source_stat(source_path) if source_path is not None else None
+
+        self.fields: Optional[list[str]] = None
+        self.json_fields: set[str] = set()
+        self._ids: list[int] = []
+        self._seen: set[int] = set()
+        self._offsets: list[int] = [0]
+        self._digest = hashlib.blake2b(digest_size=16)
+        self._records = open(os.path.join(self.version_dir, RECORDS_FILE), "wb")
+        self._manifest: Optional[dict] = None
+
+    def add(self, document: dict) -> bool:
+        """Write a document, returns False if a document with its ID was already written."""
+        doc_id = document['id']
+        if doc_id in self._seen:
+            return False
+
+        if self.fields is None:
+            self.fields = [name for name in document if name != "id"]
+            self.json_fields = {name for name in self.fields if not isinstance(document[name], str)}
+        if len(document) != len(self.fields) + 1 or any(name not in document for name in self.fields):
+            raise ValueError(f"Document {doc_id} has fields {', '.join(document)}, expected id, {', '.join(self.fields)}")
+
+        for name in self.fields:
+            value = document[name]
+            if name in self.json_fields:
+                value = json.dumps(value)
+            elif not isinstance(value, str):
+                raise ValueError(f"Field '{name}' of document {doc_id} is not text")
+
+            encoded = value.encode("utf-8")
+            self._records.write(encoded)
+            self._digest.update(encoded)
+            self._offsets.append(self._offsets[-1] + len(encoded))
+
+        self._seen.add(doc_id)
+        self._ids.append(doc_id)
+        return True
+
+    def add_many(self, documents: Iterable[dict]) -> Iterator[dict]:
+        """Write documents as they stream past, yielding those written (the first of every ID)."""
+        for document in documents:
+            if self.add(document):
+                yield document
+
+    def close(self) -> DocStore:
+        """Finish writing and return the new version, not yet visible to other readers of the store."""
+        if self._manifest is None:
+            self._records.close()
+            ids = np.array(self._ids, dtype=np.int64)
+            offsets = np.array(self._offsets, dtype=np.int64)
+            save_array(os.path.join(self.version_dir, "ids.npy"), ids)
+            save_array(os.path.join(self.version_dir, "order.npy"), np.argsort(ids, kind="stable"))
+            save_array(os.path.join(self.version_dir, "offsets.npy"), offsets)
+
+            self._digest.update(ids.tobytes())
+            self._digest.update(offsets.tobytes())
+            self._manifest = {
+                "segments": [self.version],
+                "fields": self.fields or [],
+                "json_fields": sorted(self.json_fields),
+                "fingerprint": self._digest.hexdigest(),
+                "source": self.source,
+            }
+
+        return self.__open(read_generation(self.directory) + 1)
+
+    def publish(self, pin: Optional[str] = None) -> DocStore:
+        """Make the written documents the current version of the store and return it.
+
+        Versions pinned by name are kept next to the current one; `pin` pins this
+        version under that name, in place of the one pinned before.
+        """
+        self.close()
+        generation = read_generation(self.directory) + 1
+        previous_manifest = read_manifest(self.directory)
+        pins = dict((previous_manifest or {}).get("pins", {}))
+        if pin is not None:
+            pins[pin] = self.version
+
+        # Kept in the version directory, to load the version once another one is current
+        with open(os.path.join(self.version_dir, VERSION_FILE), "w") as f:
+            json.dump({"generation": generation, **self._manifest}, f, indent=2)
+
+        manifest = {"generation": generation, **self._manifest, "pins": pins}
+        manifest["segments"] = [self.version] + sorted(set(pins.values()) - {self.version})
+        write_manifest(self.directory, manifest)
+        remove_unused_segments(self.directory, manifest, previous_manifest)
+
+        store = self.__open(generation)
+        with _open_stores_lock:
+            _open_stores[os.path.abspath(self.directory)] = store
+        return store
+
+    def __open(self, generation: int) -> DocStore:
+        return DocStore(
+            self.directory,
+            {"generation": generation, **self._manifest},
+            load_array(os.path.join(self.version_dir, "ids.npy")),
+            load_array(os.path.join(self.version_dir, "order.npy")),
+            load_records(self.version_dir),
+        )
+
+    def abort(self) -> None:
+        self._records.close()
+        shutil.rmtree(self.version_dir, ignore_errors=True)
+
+
+def load_records(version_dir: str) -> StringTable:
+    path = os.path.join(version_dir, RECORDS_FILE)
+    # An empty file cannot be memory-mapped
+    blob = np.memmap(path, dtype=np.uint8, mode="r") if os.path.getsize(path) else np.empty(0, dtype=np.uint8)
+    return StringTable(blob, load_array(os.path.join(version_dir, "offsets.npy")))
+
+
+def source_stat(path: str) -> Optional[dict]:
+    """Identity of a file's current content: its path, size and modification time."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def write_doc_store(documents: Iterable[dict], directory: str, source_path: Optional[str] = None) -> DocStore:
+    writer = DocStoreWriter(directory, source_path)
+    try:
+        for document in documents:
+            writer.add(document)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.publish()
+
+
+def load_doc_store(cache_dir: str = CACHE_DIR, source_path: str = DATA_PATH) -> DocStore:
+    """The doc store of a cache directory, shared by every engine of the process.
+
+    Written from the source file when there is none, and written again from the
+    file it was written from (if it still exists) once that file changed.
+    """
+    directory = os.path.join(cache_dir, DOC_STORE_DIR)
+    key = os.path.abspath(directory)
+    with _open_stores_lock:
+        store = _open_stores.get(key)
+    if store is not None and store.generation == read_generation(directory) and store.is_current():
+        return store
+
+    with current_profile().stage("load_doc_store"):
+        store = DocStore.load(directory)
+    if store is None or not store.is_current():
+        if store is not None and store.source is not None and os.path.exists(store.source["path"]):
+            source_path = store.source["path"]
+        with current_profile().stage("write_doc_store"):
+            store = write_doc_store(iter_documents(source_path), directory, source_path)
+
+    with _open_stores_lock:
+        _open_stores[key] = store
+    return store
+
+
+def document_map(documents: Union[DocStore, list[dict]]) -> Union[DocStore, dict[int, dict]]:
+    """Documents by ID: a doc store already is one, a list is indexed into a dict."""
+    if isinstance(documents, DocStore):
+        return documents
+    return {document['id']: document for document in documents}
+
+
+def doc_store_fingerprint(documents: Union[DocStore, list[dict]]) -> Optional[str]:
+    """Fingerprint of the doc store version holding the documents, None for a list of documents."""
+    return documents.fingerprint if isinstance(documents, DocStore) else None
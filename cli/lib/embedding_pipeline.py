@@ -0,0 +1,254 @@
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from itertools import batched, islice
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+from .embedding_store import text_key
+from .index_format import save_array
+from .search_utils import DEFAULT_MAX_CHUNK_SIZE, EMBED_BATCH_SIZE, EMBED_CHUNK_WORKERS, EMBED_QUEUE_BATCHES
+from .text_chunking import semantic_chunk_command
+
+# Ends the chunk batches on the queue, the producer puts an exception instead if it failed
+_DONE = object()
+
+# Seconds a blocked put waits before checking whether the consumer stopped
+_PUT_TIMEOUT = 0.1
+
+
+def iter_document_chunks(documents: Iterable[dict], model_name: str) -> Iterator[tuple[str, tuple[int, int, int], int]]:
+    """Yield every chunk of the document descriptions with its (document ID, index, total) metadata and content key."""
+    for document in documents:
+        description = document['description']
+        if not description.strip():
+            continue
+
+        # Split description into 4 sentence chunks with 1 sentence overlap
+        chunks = semantic_chunk_command(
+            text=description,
+            max_chunk_size=DEFAULT_MAX_CHUNK_SIZE,
+            overlap=1
+        )
+
+        key = text_key(model_name, description)
+        for idx, chunk in enumerate(chunks):
+            yield chunk, (document['id'], idx, len(chunks)), key
+
+
+def _chunk_documents(documents: list[dict], model_name: str) -> list[tuple[str, tuple[int, int, int], int]]:
+    return list(iter_document_chunks(documents, model_name))
+
+
+def iter_chunks(
+    documents: Iterable[dict],
+    model_name: str,
+    workers: int = EMBED_CHUNK_WORKERS,
+    task_size: int = EMBED_BATCH_SIZE,
+) -> Iterator[tuple[str, tuple[int, int, int], int]]:
+    """Chunks of every document in document order, cut in this process or by a pool of worker processes.
+
+    Workers chunk `task_size` documents per task and at most two tasks per worker
+    are in flight, so memory stays bounded by the task size.
+    """
+    if workers <= 1:
+        yield from iter_document_chunks(documents, model_name)
+        return
+
+    # Imported here, multiprocessing is only needed by parallel builds and costs every CLI start
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        for batch in batched(documents, task_size):
+            # Bound the number of tasks waiting in the pool
+            while len(pending) >= 2 * workers:
+                yield from pending.pop(0).result()
+            pending.append(executor.submit(_chunk_documents, list(batch), model_name))
+
+        for future in pending:
+            yield from future.result()
+
+
+def stream_chunk_batches(
+    documents: Iterable[dict],
+    model_name: str,
+    batch_size: int = EMBED_BATCH_SIZE,
+    workers: int = EMBED_CHUNK_WORKERS,
+    queue_size: int = EMBED_QUEUE_BATCHES,
+    stats: Optional[dict] = None,
+    skip: int = 0,
+) -> Iterator[tuple[list[str], np.ndarray, np.ndarray]]:
+    """Yield (texts, metadata rows, content keys) batches of `batch_size` chunks, the last one possibly smaller.
+
+    A producer thread chunks the documents while the caller encodes the previous
+    batches; at most `queue_size` batches wait between them. `stats` receives the
+    number of chunks, the seconds spent chunking and the seconds the caller waited.
+    The first `skip` chunks are cut but not yielded, to resume an interrupted build.
+    """
+    if batch_size < 1:
+        raise ValueError(f"Batch size ({batch_size}) must be at least 1")
+
+    stats = stats if stats is not None else {}
+    stats.update(chunks=0, chunk_seconds=0.0, wait_seconds=0.0)
+    batches: queue.Queue = queue.Queue(maxsize=max(queue_size, 1))
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # Gives up once the consumer stopped, so an abandoned build does not block forever
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        chunks = iter_chunks(documents, model_name, workers, batch_size)
+        chunk_batches = batched(islice(chunks, skip, None), batch_size)
+        try:
+            while True:
+                start = time.perf_counter()
+                batch = next(chunk_batches, None)
+                if batch is None:
+                    break
+                texts, metadata, keys = zip(*batch)
+                item = (list(texts), np.array(metadata, dtype=np.int32).reshape(-1, 3), np.array(keys, dtype=np.uint64))
+                stats["chunk_seconds"] += time.perf_counter() - start
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as e:
+            put(e)
+        finally:
+            chunks.close()
+
+    producer = threading.Thread(target=produce, name="chunk-producer", daemon=True)
+    producer.start()
+    try:
+        while True:
+            start = time.perf_counter()
+            item = batches.get()
+            stats["wait_seconds"] += time.perf_counter() - start
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            stats["chunks"] += len(item[0])
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+
+
+def build_fingerprint(*arrays: np.ndarray) -> str:
+    """Digest of the row IDs and content keys of a build, a checkpoint only resumes a build of the same rows."""
+    digest = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(f"{array.dtype.str}{array.shape}".encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+class CheckpointedEmbeddings:
+    """Embedding matrix written a batch at a time into a pre-sized memory-mapped file next to its target.
+
+    After every batch the rows are flushed and a checkpoint records how many are
+    complete, so a build of the same rows restarted after an interruption resumes
+    after the last complete batch. finish() swaps the matrix in for the target.
+    """
+
+    def __init__(self, path: str, num_rows: int, dtype, fingerprint: str) -> None:
+        self.path = path
+        self.building_path = f"{path}.building"
+        self.checkpoint_path = f"{path}.checkpoint.json"
+        self.num_rows = num_rows
+        self.dtype = np.dtype(dtype)
+        self.fingerprint = fingerprint
+
+        # Rows written and flushed so far, including those of an interrupted build
+        self.rows_done = 0
+        self._matrix: Optional[np.memmap] = None
+        self.__resume()
+
+    def __resume(self) -> None:
+        try:
+            with open(self.checkpoint_path, "r") as f:
+                checkpoint = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            checkpoint = None
+
+        if checkpoint is not None and os.path.exists(self.building_path) and checkpoint.get("fingerprint") == self.fingerprint:
+            matrix = np.lib.format.open_memmap(self.building_path, mode="r+")
+            if matrix.shape[0] == self.num_rows and matrix.dtype == self.dtype:
+                self._matrix = matrix
+                self.rows_done = min(int(checkpoint["rows_done"]), self.num_rows)
+                return
+
+        # Nothing to resume: a different build, or one interrupted before its first batch
+        self.discard()
+
+    def write(self, vectors: np.ndarray) -> None:
+        """Write the next rows and checkpoint them."""
+        if self.rows_done + len(vectors) > self.num_rows:
+            raise ValueError(f"Writing {len(vectors)} rows after {self.rows_done} exceeds the {self.num_rows} rows of the build")
+
+        if self._matrix is None:
+            # Sized once the first batch gives the dimension
+            self._matrix = np.lib.format.open_memmap(
+                self.building_path, mode="w+", dtype=self.dtype, shape=(self.num_rows, vectors.shape[1])
+            )
+        self._matrix[self.rows_done:self.rows_done + len(vectors)] = vectors
+        self._matrix.flush()
+        self.rows_done += len(vectors)
+
+        # The checkpoint only ever counts rows already flushed
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"fingerprint": self.fingerprint, "rows_done": self.rows_done, "num_rows": self.num_rows}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def finish(self) -> np.ndarray:
+        """Atomically replace the target with the complete matrix and return it memory-mapped."""
+        if self.rows_done != self.num_rows:
+            raise ValueError(f"Only {self.rows_done} of {self.num_rows} rows were written")
+
+        if self._matrix is None:
+            save_array(self.building_path, np.empty((0, 0), dtype=self.dtype))
+        else:
+            self._matrix.flush()
+            self._matrix = None
+
+        os.replace(self.building_path, self.path)
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        return np.load(self.path, 'r')
+
+    def discard(self) -> None:
+        self._matrix = None
+        self.rows_done = 0
+        for path in (self.building_path, self.checkpoint_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def format_build_stats(stats: dict) -> str:
+    """Chunks per second of every stage of a streaming build, and of the whole build."""
+    def rate(seconds: float) -> str:
+        return f"{stats['chunks'] / seconds:.0f} chunks/sec" if seconds > 0 else "n/a"
+
+    return (
+        f"Built {stats['chunks']} chunks in {stats['seconds']:.2f}s ({rate(stats['seconds'])}, "
+        f"batches of {stats['batch_size']}, {stats['workers']} chunking workers)\n"
+        f"  chunk:  {stats['chunk_seconds']:.2f}s ({rate(stats['chunk_seconds'])})\n"
+        f"  encode: {stats['encode_seconds']:.2f}s ({rate(stats['encode_seconds'])})\n"
+        f"  write:  {stats['write_seconds']:.2f}s ({rate(stats['write_seconds'])})\n"
+        f"  waited on chunking: {stats['wait_seconds']:.2f}s"
+        + (f"\n  resumed after {stats['resumed']} chunks of an interrupted build" if stats.get("resumed") else "")
+    )
@@ -0,0 +1,161 @@
+import hashlib
+import os
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+from .index_format import append_rows, save_array
+from .search_utils import CACHE_DIR
+
+
+def text_key(model_name: str, text: str) -> int:
+    """64-bit content hash of a text as encoded by a model."""
+    digest = hashlib.blake2b(f"{model_name}\0{text}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def text_keys(model_name: str, texts: list[str]) -> np.ndarray:
+    return np.fromiter((text_key(model_name, text) for text in texts), dtype=np.uint64, count=len(texts))
+
+
+class EmbeddingStore:
+    """Embeddings of one model keyed by a hash of (model name, exact text).
+
+    Texts that were encoded before, by any build, are served from the store and
+    only unseen texts go through the model, each distinct text once. Stored as a
+    keys array and a row-aligned vectors array that both only ever grow; the keys
+    are written last, so rows without a key are ignored.
+
+    Streaming builds encode with publish=False: new rows are appended to the
+    vectors file right away but their keys are kept pending, in memory, until
+    publish() writes them once for the whole build.
+    """
+
+    def __init__(self, model_name: str, cache_dir: str = CACHE_DIR) -> None:
+        self.model_name = model_name
+        self.store_dir = os.path.join(cache_dir, "embedding_store", model_name.replace("/", "__"))
+        self.keys_path = os.path.join(self.store_dir, "keys.npy")
+        self.vectors_path = os.path.join(self.store_dir, "vectors.npy")
+
+        self.keys: Optional[np.ndarray] = None
+        self.vectors: Optional[np.ndarray] = None
+        self._sorted_rows: Optional[np.ndarray] = None
+
+        # Keys of rows appended but not published yet, and their rows
+        self._pending_keys: list[np.ndarray] = []
+        self._pending_rows: dict[int, int] = {}
+
+        # Counts of the last encode() call
+        self.last_stats: Optional[dict] = None
+
+    def __len__(self) -> int:
+        self.__load()
+        return len(self.keys) + len(self._pending_rows)
+
+    def __load(self) -> None:
+        if self.keys is not None:
+            return
+
+        if os.path.exists(self.keys_path) and os.path.exists(self.vectors_path):
+            self.keys = np.load(self.keys_path)
+            self.vectors = np.load(self.vectors_path, mmap_mode="r")[:len(self.keys)]
+        else:
+            self.keys = np.empty(0, dtype=np.uint64)
+            self.vectors = None
+        self._sorted_rows = np.argsort(self.keys, kind="stable")
+
+    def __find(self, keys: np.ndarray) -> np.ndarray:
+        """Store row of every key, -1 for keys that are not stored."""
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        if len(self.keys):
+            sorted_keys = self.keys[self._sorted_rows]
+            positions = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+            found = sorted_keys[positions] == keys
+            rows[found] = self._sorted_rows[positions[found]]
+
+        if self._pending_rows:
+            for i in np.flatnonzero(rows < 0).tolist():
+                rows[i] = self._pending_rows.get(int(keys[i]), -1)
+        return rows
+
+    def __append(self, keys: np.ndarray, vectors: np.ndarray, publish: bool = True) -> None:
+        os.makedirs(self.store_dir, exist_ok=True)
+        num_rows = len(self)
+        if num_rows == 0:
+            save_array(self.vectors_path, vectors)
+        else:
+            if len(np.load(self.vectors_path, mmap_mode="r")) != num_rows:
+                # Drop rows of an interrupted append so new rows line up with their keys
+                save_array(self.vectors_path, np.array(self.vectors))
+            append_rows(self.vectors_path, vectors)
+
+        self._pending_keys.append(keys)
+        self._pending_rows.update(zip(keys.tolist(), range(num_rows, num_rows + len(keys))))
+        self.vectors = np.load(self.vectors_path, mmap_mode="r")[:num_rows + len(keys)]
+        if publish:
+            self.publish()
+
+    def publish(self) -> None:
+        """Write the keys of every appended row, making the rows visible to other processes."""
+        if not self._pending_keys:
+            return
+
+        self.keys = np.concatenate([self.keys, *self._pending_keys])
+        save_array(self.keys_path, self.keys)
+        self._pending_keys = []
+        self._pending_rows = {}
+        self._sorted_rows = np.argsort(self.keys, kind="stable")
+
+    def add(self, keys: np.ndarray, vectors: np.ndarray) -> int:
+        """Store already encoded vectors under their text keys, skipping stored keys. Returns the number added."""
+        self.__load()
+        keys, first_index = np.unique(keys, return_index=True)
+        new = self.__find(keys) < 0
+        if new.any():
+            self.__append(keys[new], np.asarray(vectors[first_index[new]], dtype=np.float32))
+        return int(new.sum())
+
+    def encode(
+        self,
+        load_model: Callable[[], Any],
+        texts: list[str],
+        show_progress_bar: bool = False,
+        publish: bool = True,
+    ) -> np.ndarray:
+        """Return the (unnormalized, float32) embedding of every text, encoding only texts not stored yet.
+
+        load_model is only called when some text is missing from the store. With
+        publish=False the keys of new texts stay pending until publish().
+        """
+        self.__load()
+        keys = text_keys(self.model_name, texts)
+        unique_keys, first_index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+        rows = self.__find(unique_keys)
+        missing = np.flatnonzero(rows < 0)
+        if len(missing):
+            vectors = load_model().encode([texts[i] for i in first_index[missing]], show_progress_bar=show_progress_bar)
+            rows[missing] = np.arange(len(self), len(self) + len(missing))
+            self.__append(unique_keys[missing], np.asarray(vectors, dtype=np.float32), publish)
+
+        self.last_stats = {
+            "texts": len(texts),
+            "unique": len(unique_keys),
+            "hits": len(unique_keys) - len(missing),
+            "misses": len(missing),
+        }
+
+        if len(texts) == 0:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.asarray(self.vectors[rows[inverse]], dtype=np.float32)
+
+
+def format_store_stats(stats: Optional[dict]) -> str:
+    if not stats:
+        return "Embedding store: nothing encoded"
+
+    hit_ratio = stats["hits"] / stats["unique"] if stats["unique"] else 1.0
+    return (
+        f"Embedding store: {stats['texts']} texts, {stats['unique']} distinct, "
+        f"{stats['hits']} hits, {stats['misses']} encoded ({hit_ratio:.2%} hit ratio)"
+    )
@@ -0,0 +1,101 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+from .search_utils import ENCODE_MAX_BATCH, ENCODE_MAX_WAIT_MS
+
+# Seconds without work after which the worker thread exits, a later encode starts a new one
+WORKER_IDLE_SECONDS = 5.0
+
+
+class EncodeScheduler:
+    """Coalesces concurrent single-text encodes into batched model calls.
+
+    A background thread takes the first waiting text, keeps collecting texts for
+    up to `max_wait_ms` or until `max_batch` are waiting, encodes them with one
+    model call and hands every caller its own row. Texts that queue up while the
+    model is busy always join the next batch, so a zero wait still batches under
+    load without delaying a lone caller.
+    """
+
+    def __init__(
+        self,
+        load_model: Callable[[], Any],
+        max_batch: int = ENCODE_MAX_BATCH,
+        max_wait_ms: float = ENCODE_MAX_WAIT_MS,
+    ) -> None:
+        if max_batch < 1:
+            raise ValueError("max_batch must be at least 1")
+        if max_wait_ms < 0:
+            raise ValueError("max_wait_ms cannot be negative")
+
+        self.load_model = load_model
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+
+        self._queue: queue.SimpleQueue[tuple[str, Future]] = queue.SimpleQueue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+        self.batches = 0
+        self.texts = 0
+
+    def encode(self, text: str) -> np.ndarray:
+        """Embedding of one text, blocking until the batch it joined is encoded."""
+        future: Future = Future()
+        self._queue.put((text, future))
+        self.__ensure_worker()
+        return future.result()
+
+    def __ensure_worker(self) -> None:
+        # Taken after queueing, so either a running worker sees the text or a new one is started
+        with self._worker_lock:
+            if self._worker is None:
+                # A daemon thread, it never keeps the process alive
+                self._worker = threading.Thread(target=self.__run, name="encode-scheduler", daemon=True)
+                self._worker.start()
+
+    def __next_batch(self) -> Optional[list[tuple[str, Future]]]:
+        """The next batch to encode, or None once the worker has been idle long enough to exit."""
+        try:
+            batch = [self._queue.get(timeout=WORKER_IDLE_SECONDS)]
+        except queue.Empty:
+            with self._worker_lock:
+                if self._queue.empty():
+                    self._worker = None
+                    return None
+            batch = [self._queue.get()]
+
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def __run(self) -> None:
+        while (batch := self.__next_batch()) is not None:
+            try:
+                vectors = self.load_model().encode([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.texts += len(batch)
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(np.asarray(vector))
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "mean_batch_size": self.texts / self.batches if self.batches else 0.0,
+        }
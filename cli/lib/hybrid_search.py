@@ -1,27 +1,165 @@
+import contextvars
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+from .chunked_semantic_search import ChunkedSemanticSearch
+from .doc_store import document_map, load_doc_store
 from .keyword_search import InvertedIndex
-from .semantic_search import ChunkedSemanticSearch
+from .search_utils import (
+    DEFAULT_SEARCH_LIMIT,
+    HYBRID_ALPHA,
+    HYBRID_CANDIDATE_MULTIPLIER,
+    RRF_K
+)
 
 
 class HybridSearch:
     def __init__(self, documents):
         self.documents = documents
+        self.document_map = document_map(documents)
+
         self.semantic_search = ChunkedSemanticSearch()
-        self.semantic_search.load_or_create_chunk_embeddings(documents)
+        self.semantic_search.load_or_create_embeddings(documents)
 
         self.idx = InvertedIndex()
         if not os.path.exists(self.idx.index_path):
             self.idx.build()
             self.idx.save()
+        # Loaded once, every search reuses it
+        self.idx.load()
+
+        # Runs the BM25 and semantic legs of a query side by side
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="hybrid")
+
+        # Milliseconds spent by each leg and by the whole last search
+        self.last_timings = {}
 
     def _bm25_search(self, query, limit):
-        self.idx.load()
         return self.idx.bm25_search(query, limit)
 
-    def weighted_search(self, query, alpha, limit=5):
-        raise NotImplementedError("Weighted hybrid search is not implemented yet.")
+    def _semantic_search(self, query, limit):
+        return self.semantic_search.search_chunks(query, limit)
+
+    def _search_legs(self, query, limit) -> tuple[list[int], list[float], list[int], list[float]]:
+        """Run both legs concurrently, returning the (doc ids, scores) ranking of each."""
+        def timed(name, search):
+            start = time.perf_counter()
+            results = search(query, limit)
+            self.last_timings[f"{name}_ms"] = (time.perf_counter() - start) * 1000
+            return results
+
+        start = time.perf_counter()
+        # Each leg runs in a copy of the caller's context, so an active profile records both
+        bm25_future = self._executor.submit(contextvars.copy_context().run, timed, "bm25", self._bm25_search)
+        semantic_future = self._executor.submit(contextvars.copy_context().run, timed, "semantic", self._semantic_search)
+        bm25_results = bm25_future.result()
+        semantic_results = semantic_future.result()
+        self.last_timings["total_ms"] = (time.perf_counter() - start) * 1000
+
+        return (
+            list(bm25_results),
+            [result['score'] for result in bm25_results.values()],
+            [result['id'] for result in semantic_results],
+            [result['score'] for result in semantic_results],
+        )
+
+    def __result(self, doc_id, score, **details) -> dict:
+        doc = self.document_map[doc_id]
+        return {"id": doc_id, "title": doc['title'], "description": doc['description'][:100], "score": score, **details}
+
+    def weighted_search(self, query, alpha=HYBRID_ALPHA, limit=DEFAULT_SEARCH_LIMIT, candidates=HYBRID_CANDIDATE_MULTIPLIER):
+        """Blend min-max normalized BM25 and semantic scores: alpha * bm25 + (1 - alpha) * semantic.
+
+        Each leg retrieves `candidates` results per requested result.
+        """
+        if not 0 <= alpha <= 1:
+            raise ValueError(f"alpha ({alpha}) must be between 0 and 1")
+
+        bm25_ids, bm25_scores, semantic_ids, semantic_scores = self._search_legs(query, limit * validate_candidates(candidates))
+
+        # Documents missing from a leg get a normalized score of 0 there
+        bm25_normalized = dict(zip(bm25_ids, normalize_scores(bm25_scores)))
+        semantic_normalized = dict(zip(semantic_ids, normalize_scores(semantic_scores)))
+
+        combined = {}
+        for doc_id in bm25_normalized.keys() | semantic_normalized.keys():
+            bm25_score = bm25_normalized.get(doc_id, 0.0)
+            semantic_score = semantic_normalized.get(doc_id, 0.0)
+            combined[doc_id] = (alpha * bm25_score + (1 - alpha) * semantic_score, bm25_score, semantic_score)
+
+        ranked = sorted(combined.items(), key=lambda item: (-item[1][0], item[0]))[:limit]
+        return [
+            self.__result(doc_id, score, bm25_score=bm25_score, semantic_score=semantic_score)
+            for doc_id, (score, bm25_score, semantic_score) in ranked
+        ]
+
+    def rrf_search(self, query, k=RRF_K, limit=DEFAULT_SEARCH_LIMIT, candidates=HYBRID_CANDIDATE_MULTIPLIER):
+        """Reciprocal rank fusion: every leg adds 1 / (k + rank) for each document it returned.
+
+        Each leg retrieves `candidates` results per requested result.
+        """
+        bm25_ids, _, semantic_ids, _ = self._search_legs(query, limit * validate_candidates(candidates))
+
+        bm25_ranks = {doc_id: rank for rank, doc_id in enumerate(bm25_ids, start=1)}
+        semantic_ranks = {doc_id: rank for rank, doc_id in enumerate(semantic_ids, start=1)}
+
+        combined = {}
+        for doc_id in bm25_ranks.keys() | semantic_ranks.keys():
+            score = sum(rrf_score(ranks[doc_id], k) for ranks in (bm25_ranks, semantic_ranks) if doc_id in ranks)
+            combined[doc_id] = score
+
+        ranked = sorted(combined.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [
+            self.__result(doc_id, score, bm25_rank=bm25_ranks.get(doc_id), semantic_rank=semantic_ranks.get(doc_id))
+            for doc_id, score in ranked
+        ]
+
+
+def validate_candidates(candidates: int) -> int:
+    if candidates < 1:
+        raise ValueError(f"Candidates per result ({candidates}) must be at least 1")
+    return candidates
+
+
+def normalize_scores(scores: list[float]) -> list[float]:
+    """Min-max normalize scores to [0, 1]; if they are all equal, every score becomes 1."""
+    if not scores:
+        return []
+
+    min_score = min(scores)
+    max_score = max(scores)
+    if max_score == min_score:
+        return [1.0] * len(scores)
+
+    return [(score - min_score) / (max_score - min_score) for score in scores]
+
+
+def rrf_score(rank: int, k: int = RRF_K) -> float:
+    return 1 / (k + rank)
+
+
+def normalize_command(scores: list[float]) -> list[float]:
+    return normalize_scores(scores)
+
+
+def weighted_search_command(
+    query: str,
+    alpha: float = HYBRID_ALPHA,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    candidates: int = HYBRID_CANDIDATE_MULTIPLIER,
+) -> tuple[list[dict], dict]:
+    search = HybridSearch(load_doc_store())
+    results = search.weighted_search(query, alpha, limit, candidates)
+    return results, search.last_timings
+
 
-    def rrf_search(self, query, k, limit=10):
-        raise NotImplementedError("RRF hybrid search is not implemented yet.")
-        
\ No newline at end of file
+def rrf_search_command(
+    query: str,
+    k: int = RRF_K,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    candidates: int = HYBRID_CANDIDATE_MULTIPLIER,
+) -> tuple[list[dict], dict]:
+    search = HybridSearch(load_doc_store())
+    results = search.rrf_search(query, k, limit, candidates)
+    return results, search.last_timings
@@ -0,0 +1,123 @@
+import fcntl
+import json
+import os
+import subprocess
+import sys
+from contextlib import contextmanager
+from typing import Iterator
+
+from .keyword_search import InvertedIndex
+from .search_utils import CACHE_DIR, load_movies, save_movies
+
+# Held while a delta or a compaction rewrites the caches
+UPDATE_LOCK_PATH = os.path.join(CACHE_DIR, "update.lock")
+COMPACTION_LOG_PATH = os.path.join(CACHE_DIR, "compaction.log")
+
+UPDATE_CLI_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "update_cli.py")
+
+
+def load_delta(path: str) -> tuple[list[dict], list[int]]:
+    """Read a delta file and return (added or changed documents, deleted document IDs).
+
+    A delta is a JSON object with any of the keys "add", "update" (lists of full
+    documents) and "delete" (list of document IDs). Adding an existing ID
+    replaces that document.
+    """
+    with open(path, "r") as f:
+        delta = json.load(f)
+
+    upserts = delta.get("add", []) + delta.get("update", [])
+    deletes = [int(doc_id) for doc_id in delta.get("delete", [])]
+
+    for document in upserts:
+        missing = {"id", "title", "description"} - document.keys()
+        if missing:
+            raise ValueError(f"Document {document.get('id')} is missing fields: {', '.join(sorted(missing))}")
+
+    return upserts, deletes
+
+
+@contextmanager
+def update_lock() -> Iterator[None]:
+    """Serialize updates and compactions across processes."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(UPDATE_LOCK_PATH, "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def apply_delta_to_documents(documents: list[dict], upserts: list[dict], deletes: list[int]) -> list[dict]:
+    """Return the corpus with the delta applied, keeping the order of existing documents."""
+    upserts_by_id = {document['id']: document for document in upserts}
+    removed_ids = set(deletes) - set(upserts_by_id)
+
+    updated = []
+    for document in documents:
+        if document['id'] in removed_ids:
+            continue
+        updated.append(upserts_by_id.pop(document['id'], document))
+
+    # Whatever is left are new documents
+    updated.extend(upserts_by_id.values())
+    return updated
+
+
+def update_command(delta_path: str) -> dict:
+    """Apply a delta to every cache that was built and to the movies dataset.
+
+    Only added or changed documents are tokenized and encoded; replaced and
+    deleted ones are tombstoned until the next compaction.
+    """
+    upserts, deletes = load_delta(delta_path)
+    stats = {}
+
+    with update_lock():
+        documents = load_movies()
+        # Written first, the doc store version published below records the updated file as its source
+        save_movies(apply_delta_to_documents(documents, upserts, deletes))
+
+        index = InvertedIndex()
+        if os.path.exists(index.index_path):
+            stats["keyword"] = index.apply_delta(upserts, deletes)
+
+        # Imported lazily, loading the embedding model is slow
+        from .chunked_semantic_search import ChunkedSemanticSearch
+        from .semantic_search import SemanticSearch
+
+        stats["semantic"] = SemanticSearch().apply_delta(documents, upserts, deletes)
+        stats["chunked"] = ChunkedSemanticSearch().apply_delta(documents, upserts, deletes)
+
+    return stats
+
+
+def compact_command() -> dict[str, bool]:
+    """Merge index segments and drop tombstoned rows from every cache."""
+    with update_lock():
+        stats = {}
+
+        index = InvertedIndex()
+        stats["keyword"] = os.path.exists(index.index_path) and index.compact()
+
+        from .chunked_semantic_search import ChunkedSemanticSearch
+        from .semantic_search import SemanticSearch
+
+        stats["semantic"] = SemanticSearch().compact()
+        stats["chunked"] = ChunkedSemanticSearch().compact()
+
+    return stats
+
+
+def start_background_compaction() -> int:
+    """Run the compaction in a detached process, returning its PID. Output goes to the compaction log."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(COMPACTION_LOG_PATH, "a") as log:
+        process = subprocess.Popen(
+            [sys.executable, UPDATE_CLI_PATH, "compact"],
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+    return process.pid
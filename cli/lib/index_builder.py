@@ -0,0 +1,286 @@
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+from collections import Counter, defaultdict
+from itertools import batched, islice
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional
+
+import numpy as np
+
+from .index_format import IndexSegment, StringTable
+from .tokenizer import StemMap, Tokenizer
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+# Size of each read while streaming a JSON document array
+JSON_READ_SIZE = 1 << 20
+
+# Per-process tokenizer of the pool workers
+_worker_tokenizer: Optional[Tokenizer] = None
+
+# Number of stem map entries each worker has already written to a partial index
+_worker_saved_stems = 0
+
+
+def iter_documents(path: str) -> Iterator[dict]:
+    """Stream documents from a JSONL file or from a JSON file holding an array of documents.
+
+    JSON files can be either a top-level array or the movies.json layout
+    ({"movies": [...]}). Only one document is decoded at a time.
+    """
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = ""
+        pos = -1
+        eof = False
+
+        # Find the opening bracket of the document array
+        while pos < 0 and not eof:
+            data = f.read(JSON_READ_SIZE)
+            eof = not data
+            buffer += data
+            key = buffer.find('"movies"')
+            pos = buffer.find("[", key if key >= 0 else 0)
+        if pos < 0:
+            raise ValueError(f"No document array found in {path}")
+        pos += 1
+
+        while True:
+            # Skip separators between documents
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+
+            try:
+                document, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The document is cut off by the end of the buffer, read more
+                if eof:
+                    raise
+                data = f.read(JSON_READ_SIZE)
+                eof = not data
+                buffer = buffer[pos:] + data
+                pos = 0
+                continue
+
+            yield document
+            pos = end
+
+
+def document_text(document: dict) -> str:
+    return f"{document['title']} {document['description']}"
+
+
+def peak_rss_mb() -> dict[str, float]:
+    """Peak resident set size of this process and of its largest child process, in MB."""
+    # ru_maxrss is reported in kilobytes on Linux
+    return {
+        "main": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "workers": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def _init_worker() -> None:
+    global _worker_tokenizer
+    _worker_tokenizer = Tokenizer(record_vocabulary=True)
+
+
+def _index_batch(part_dir: str, batch: list[tuple[int, str]]) -> int:
+    """Tokenize a batch of (doc_id, text) pairs and write it as a partial index."""
+    global _worker_saved_stems
+
+    index = defaultdict(set)
+    term_frequencies: dict[int, Counter] = {}
+    docs_length: dict[int, int] = {}
+
+    doc_ids = [doc_id for doc_id, _ in batch]
+    for doc_id, tokens in zip(doc_ids, _worker_tokenizer.tokenize_many(text for _, text in batch)):
+        for token in set(tokens):
+            index[token].add(doc_id)
+        term_frequencies[doc_id] = Counter(tokens)
+        docs_length[doc_id] = len(tokens)
+
+    segment = IndexSegment.from_dicts(index, term_frequencies, docs_length)
+    segment.save(part_dir)
+
+    # Only the words this worker has not written to an earlier partial index
+    vocabulary = _worker_tokenizer.vocabulary
+    StemMap.from_dict(dict(islice(vocabulary.items(), _worker_saved_stems, None))).save(part_dir)
+    _worker_saved_stems = len(vocabulary)
+
+    return len(batch)
+
+
+def merge_segments(
+    segment_dirs: list[str],
+    output_dir: str,
+    tombstones: Optional[list[Optional[np.ndarray]]] = None,
+) -> IndexSegment:
+    """Merge segments into one, written straight to disk.
+
+    Rows of segment i follow the rows of segment i - 1, so the postings of a term
+    are the concatenation of its per-segment posting lists. Tombstoned rows and
+    terms left without postings are dropped. Only one input segment is read at a
+    time.
+    """
+    tombstones = tombstones or [None] * len(segment_dirs)
+
+    def load_segment(i: int) -> IndexSegment:
+        segment = IndexSegment.load(segment_dirs[i])
+        segment.tombstones = tombstones[i]
+        return segment
+
+    def live_postings(segment: IndexSegment) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Term (position in the segment vocabulary) of every live posting, plus a live row mask
+        live = segment.live_rows()
+        terms = np.repeat(np.arange(len(segment.terms)), np.diff(segment.indptr))
+        keep = live[segment.postings]
+        return live, keep, terms[keep]
+
+    # First pass: global vocabulary and live document frequency of every term
+    vocabulary: set[str] = set()
+    for segment_dir in segment_dirs:
+        vocabulary.update(StringTable.load(segment_dir, "terms").to_list())
+    all_terms = np.array(sorted(vocabulary), dtype=str)
+
+    doc_freqs = np.zeros(len(all_terms), dtype=np.int64)
+    total_docs = 0
+    for i in range(len(segment_dirs)):
+        segment = load_segment(i)
+        live, _, terms = live_postings(segment)
+        term_ids = np.searchsorted(all_terms, np.array(segment.terms.to_list(), dtype=str))
+        doc_freqs += np.bincount(term_ids[terms], minlength=len(all_terms))
+        total_docs += int(live.sum())
+
+    # Maps global term positions -> output term IDs
+    kept_terms = doc_freqs > 0
+    output_term_ids = np.cumsum(kept_terms) - 1
+    doc_freqs = doc_freqs[kept_terms]
+
+    indptr = np.zeros(len(doc_freqs) + 1, dtype=np.int64)
+    np.cumsum(doc_freqs, out=indptr[1:])
+    total_postings = int(indptr[-1])
+
+    # Second pass: scatter every live posting into its slot of the output arrays
+    os.makedirs(output_dir, exist_ok=True)
+    StringTable.from_strings(all_terms[kept_terms].tolist()).save(output_dir, "terms")
+    np.save(os.path.join(output_dir, "indptr.npy"), indptr)
+
+    def open_output(name: str, dtype, size: int) -> np.memmap:
+        return np.lib.format.open_memmap(
+            os.path.join(output_dir, f"{name}.npy"), mode="w+", dtype=dtype, shape=(size,)
+        )
+
+    postings = open_output("postings", np.int32, total_postings)
+    tfs = open_output("tfs", np.int32, total_postings)
+    doc_ids = open_output("doc_ids", np.int64, total_docs)
+    doc_lengths = open_output("doc_lengths", np.int32, total_docs)
+
+    cursor = indptr[:-1].copy()
+    first_row = 0
+    for i in range(len(segment_dirs)):
+        segment = load_segment(i)
+        live, keep, terms = live_postings(segment)
+        term_ids = output_term_ids[np.searchsorted(all_terms, np.array(segment.terms.to_list(), dtype=str))]
+        lengths = np.bincount(terms, minlength=len(segment.terms))
+
+        # Maps input rows -> output rows
+        new_rows = np.cumsum(live) - 1 + first_row
+
+        # Destination of each posting: start of its term in the output plus its offset in the term
+        starts = np.cumsum(lengths) - lengths
+        offsets = np.arange(len(terms)) - np.repeat(starts, lengths)
+        destinations = np.repeat(cursor[term_ids], lengths) + offsets
+        postings[destinations] = new_rows[segment.postings[keep]]
+        tfs[destinations] = segment.tfs[keep]
+
+        # Terms without live postings were dropped and must not move any cursor
+        present = lengths > 0
+        cursor[term_ids[present]] += lengths[present]
+
+        live_docs = int(live.sum())
+        doc_ids[first_row:first_row + live_docs] = segment.doc_ids[live]
+        doc_lengths[first_row:first_row + live_docs] = segment.doc_lengths[live]
+        first_row += live_docs
+
+    for array in (postings, tfs, doc_ids, doc_lengths):
+        array.flush()
+    del postings, tfs, doc_ids, doc_lengths
+
+    return IndexSegment.load(output_dir)
+
+
+def merge_stem_maps(stem_maps: Iterable[Optional[StemMap]]) -> StemMap:
+    vocabulary: dict[str, str] = {}
+    for stem_map in stem_maps:
+        if stem_map is not None:
+            vocabulary.update(zip(stem_map.words.to_list(), stem_map.stems.to_list()))
+
+    return StemMap.from_dict(vocabulary)
+
+
+def build_segment_parallel(
+    documents: Iterable[dict],
+    output_dir: str,
+    workers: Optional[int] = None,
+    batch_size: int = 1000,
+) -> tuple[IndexSegment, StemMap, dict]:
+    """Tokenize documents across a process pool and merge the partial indexes into a segment.
+
+    Documents are consumed lazily and at most two batches per worker are in flight,
+    so memory stays bounded by the batch size rather than by the corpus size.
+    Returns the segment, the raw word -> stem map and build statistics.
+    """
+    # Imported here, multiprocessing is only needed by parallel builds and costs every CLI start
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = workers or os.cpu_count() or 1
+    start_time = time.perf_counter()
+    tmp_dir = tempfile.mkdtemp(prefix="build-", dir=os.path.dirname(output_dir))
+
+    try:
+        part_dirs: list[str] = []
+        pending: list["Future"] = []
+        total_docs = 0
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            for batch in batched(((doc["id"], document_text(doc)) for doc in documents), batch_size):
+                # Bound the number of batches waiting in the pool
+                while len(pending) >= 2 * workers:
+                    total_docs += pending.pop(0).result()
+
+                part_dir = os.path.join(tmp_dir, f"part-{len(part_dirs):06d}")
+                part_dirs.append(part_dir)
+                pending.append(executor.submit(_index_batch, part_dir, list(batch)))
+
+            for future in pending:
+                total_docs += future.result()
+
+        tokenize_seconds = time.perf_counter() - start_time
+        segment = merge_segments(part_dirs, output_dir)
+        stem_map = merge_stem_maps(StemMap.load(part_dir) for part_dir in part_dirs)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    elapsed = time.perf_counter() - start_time
+    stats = {
+        "docs": total_docs,
+        "workers": workers,
+        "tokenize_seconds": tokenize_seconds,
+        "merge_seconds": elapsed - tokenize_seconds,
+        "seconds": elapsed,
+    }
+    return segment, stem_map, stats
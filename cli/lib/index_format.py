@@ -0,0 +1,588 @@
+import io
+import json
+import os
+import shutil
+from collections import Counter
+from typing import Optional
+
+import numpy as np
+
+from .search_utils import POSTING_BLOCK_SIZE
+
+# Bump whenever the on-disk layout changes
+FORMAT_VERSION = 1
+
+MANIFEST_FILE = "manifest.json"
+SEGMENT_PREFIX = "seg-"
+
+# Low 7 bits of a variable-byte encoded byte hold data, the high bit is set on every byte of a value but the last
+VARBYTE_CONTINUATION = 0x80
+
+# Files of a segment holding plain posting arrays, and files of a compressed one
+PLAIN_POSTING_FILES = ("postings", "tfs", "impacts")
+PACKED_POSTING_FILES = ("block_ptr", "block_first_rows", "packed_rows", "packed_row_offsets", "packed_tfs", "packed_tf_offsets")
+
+
+class StringTable:
+    """Strings stored as a single UTF-8 byte blob plus an offsets array.
+
+    When the strings are sorted, `find` binary searches the table without decoding
+    it, so a memory-mapped table is never materialized as Python objects.
+    """
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray) -> None:
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings: list[str]) -> "StringTable":
+        encoded = [string.encode("utf-8") for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(blob, offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self.__get_bytes(i).decode("utf-8")
+
+    def __get_bytes(self, i: int) -> bytes:
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def to_list(self) -> list[str]:
+        # Decode the whole table in one pass instead of slicing the blob per string
+        data = self.blob.tobytes()
+        offsets = self.offsets.tolist()
+        return [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(self))]
+
+    def find(self, string: str) -> int:
+        """Return the position of a string in a sorted table, or -1 if it is missing."""
+        key = string.encode("utf-8")
+        low, high = 0, len(self)
+        while low < high:
+            mid = (low + high) // 2
+            if self.__get_bytes(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+
+        if low < len(self) and self.__get_bytes(low) == key:
+            return low
+        return -1
+
+    def save(self, directory: str, name: str) -> None:
+        save_array(os.path.join(directory, f"{name}.npy"), self.blob)
+        save_array(os.path.join(directory, f"{name}_offsets.npy"), self.offsets)
+
+    @classmethod
+    def load(cls, directory: str, name: str) -> "StringTable":
+        return cls(
+            load_array(os.path.join(directory, f"{name}.npy")),
+            load_array(os.path.join(directory, f"{name}_offsets.npy")),
+        )
+
+
+class CompressedPostings:
+    """Posting lists compressed a block of POSTING_BLOCK_SIZE postings at a time.
+
+    Term i owns blocks block_ptr[i]:block_ptr[i + 1]. The first row of every block is
+    kept uncompressed in a skip table, the others are stored as variable-byte deltas
+    from the previous row, so each block decodes on its own and a lookup only decodes
+    the blocks that can hold the rows it needs. Term frequencies are variable-byte
+    encoded alongside, a posting usually takes 2-3 bytes instead of 8.
+    """
+
+    def __init__(
+        self,
+        indptr: np.ndarray,
+        block_ptr: np.ndarray,
+        block_first_rows: np.ndarray,
+        packed_rows: np.ndarray,
+        packed_row_offsets: np.ndarray,
+        packed_tfs: np.ndarray,
+        packed_tf_offsets: np.ndarray,
+        block_size: int = POSTING_BLOCK_SIZE,
+    ) -> None:
+        self.indptr = indptr
+        self.block_ptr = block_ptr
+        self.block_first_rows = block_first_rows
+
+        # Encoded bytes, block b owns bytes offsets[b]:offsets[b + 1]
+        self.packed_rows = packed_rows
+        self.packed_row_offsets = packed_row_offsets
+        self.packed_tfs = packed_tfs
+        self.packed_tf_offsets = packed_tf_offsets
+
+        self.block_size = block_size
+
+    @classmethod
+    def encode(cls, indptr: np.ndarray, postings: np.ndarray, tfs: np.ndarray, block_size: int = POSTING_BLOCK_SIZE) -> "CompressedPostings":
+        """Compress CSR posting arrays, whose rows are sorted within every term."""
+        indptr = np.asarray(indptr, dtype=np.int64)
+        postings = np.asarray(postings, dtype=np.int64)
+        doc_freqs = np.diff(indptr)
+
+        blocks_per_term = -(-doc_freqs // block_size)
+        block_ptr = np.zeros(len(doc_freqs) + 1, dtype=np.int64)
+        np.cumsum(blocks_per_term, out=block_ptr[1:])
+        num_blocks = int(block_ptr[-1])
+
+        # Position of the first posting of every block
+        block_terms = np.repeat(np.arange(len(doc_freqs)), blocks_per_term)
+        block_starts = indptr[block_terms] + (np.arange(num_blocks) - block_ptr[block_terms]) * block_size
+        is_first = np.zeros(len(postings), dtype=bool)
+        is_first[block_starts] = True
+        posting_blocks = np.cumsum(is_first) - 1
+
+        packed_rows, row_lengths = varbyte_encode(np.diff(postings, prepend=0)[~is_first])
+        packed_tfs, tf_lengths = varbyte_encode(tfs)
+
+        def block_offsets(blocks: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+            offsets = np.zeros(num_blocks + 1, dtype=np.int64)
+            np.cumsum(np.bincount(blocks, weights=lengths, minlength=num_blocks).astype(np.int64), out=offsets[1:])
+            return offsets
+
+        return cls(
+            indptr=indptr,
+            block_ptr=block_ptr,
+            block_first_rows=postings[block_starts].astype(np.int32),
+            packed_rows=packed_rows,
+            packed_row_offsets=block_offsets(posting_blocks[~is_first], row_lengths),
+            packed_tfs=packed_tfs,
+            packed_tf_offsets=block_offsets(posting_blocks, tf_lengths),
+            block_size=block_size,
+        )
+
+    @property
+    def num_blocks(self) -> int:
+        return len(self.block_first_rows)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in PACKED_POSTING_FILES)
+
+    def term_blocks(self, term_id: int, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Blocks of a term, only those whose row range can hold one of `rows` if given."""
+        blocks = np.arange(int(self.block_ptr[term_id]), int(self.block_ptr[term_id + 1]))
+        if rows is None or len(blocks) <= 1:
+            return blocks
+
+        # A row can only be in the last block starting at or before it
+        containing = np.searchsorted(self.block_first_rows[blocks[0]:blocks[-1] + 1], rows, side="right") - 1
+        return blocks[np.unique(containing[containing >= 0])]
+
+    def block_counts(self, blocks: np.ndarray) -> np.ndarray:
+        # Every block of a term is full but its last one
+        terms = np.searchsorted(self.block_ptr, blocks, side="right") - 1
+        first_postings = self.indptr[terms] + (blocks - self.block_ptr[terms]) * self.block_size
+        return np.minimum(self.block_size, self.indptr[terms + 1] - first_postings)
+
+    def decode(self, blocks: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Return the rows and term frequencies of the given blocks, in block order."""
+        blocks = np.asarray(blocks, dtype=np.int64)
+        if len(blocks) == 0:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+
+        counts = self.block_counts(blocks)
+        starts = np.cumsum(counts) - counts
+        is_first = np.zeros(int(counts.sum()), dtype=bool)
+        is_first[starts] = True
+
+        # Every block starts from its first row and adds up its deltas
+        values = np.empty(len(is_first), dtype=np.int64)
+        values[is_first] = self.block_first_rows[blocks]
+        values[~is_first] = varbyte_decode(gather_blocks(self.packed_rows, self.packed_row_offsets, blocks))
+        totals = np.cumsum(values)
+        rows = totals - np.repeat(totals[starts] - values[starts], counts)
+
+        tfs = varbyte_decode(gather_blocks(self.packed_tfs, self.packed_tf_offsets, blocks))
+        return rows.astype(np.int32), tfs.astype(np.int32)
+
+    def decode_term(self, term_id: int, rows: Optional[np.ndarray] = None) -> tuple[np.ndarray, np.ndarray]:
+        return self.decode(self.term_blocks(term_id, rows))
+
+    def decode_all(self) -> tuple[np.ndarray, np.ndarray]:
+        """Decode every posting, in the order of the plain CSR arrays."""
+        return self.decode(np.arange(self.num_blocks))
+
+    def save(self, directory: str) -> None:
+        for name in PACKED_POSTING_FILES:
+            save_array(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        save_array(os.path.join(directory, "posting_block_size.npy"), np.array([self.block_size]))
+
+    @classmethod
+    def load(cls, directory: str, indptr: np.ndarray) -> Optional["CompressedPostings"]:
+        """Load the compressed postings of a segment, or None if it stores plain arrays."""
+        if not os.path.exists(os.path.join(directory, "block_ptr.npy")):
+            return None
+
+        arrays = {name: load_array(os.path.join(directory, f"{name}.npy")) for name in PACKED_POSTING_FILES}
+        block_size = int(np.load(os.path.join(directory, "posting_block_size.npy"))[0])
+        return cls(indptr=indptr, block_size=block_size, **arrays)
+
+
+def varbyte_encode(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Variable-byte encode non-negative integers, 7 bits per byte from the lowest up.
+
+    Returns the bytes and the number of bytes of every value.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    high = values >> np.uint64(7)
+    while high.any():
+        lengths += high > 0
+        high >>= np.uint64(7)
+
+    starts = np.cumsum(lengths) - lengths
+    byte_values = np.repeat(np.arange(len(values)), lengths)
+    positions = np.arange(int(lengths.sum())) - starts[byte_values]
+
+    data = ((values[byte_values] >> (7 * positions).astype(np.uint64)) & np.uint64(0x7F)).astype(np.uint8)
+    data[positions < lengths[byte_values] - 1] |= VARBYTE_CONTINUATION
+    return data, lengths
+
+
+def varbyte_decode(data: np.ndarray) -> np.ndarray:
+    """Decode a run of variable-byte encoded integers in one vectorized pass."""
+    data = np.asarray(data)
+    if len(data) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    is_last = data < VARBYTE_CONTINUATION
+    starts = np.concatenate(([0], np.flatnonzero(is_last)[:-1] + 1))
+    if len(starts) == len(data):
+        # Every value fits in one byte
+        return data.astype(np.int64)
+
+    byte_values = np.cumsum(is_last) - is_last
+    shifts = 7 * (np.arange(len(data)) - starts[byte_values])
+    return np.add.reduceat((data & 0x7F).astype(np.int64) << shifts, starts)
+
+
+def gather_blocks(data: np.ndarray, offsets: np.ndarray, blocks: np.ndarray) -> np.ndarray:
+    """Concatenate the bytes of the given blocks."""
+    if blocks[-1] - blocks[0] == len(blocks) - 1:
+        # Consecutive blocks, e.g. a whole posting list, are a single slice
+        return data[int(offsets[blocks[0]]):int(offsets[blocks[-1] + 1])]
+
+    lengths = offsets[blocks + 1] - offsets[blocks]
+    starts = np.cumsum(lengths) - lengths
+    return data[np.repeat(offsets[blocks] - starts, lengths) + np.arange(int(lengths.sum()))]
+
+
+class IndexSegment:
+    """Inverted index stored as flat arrays.
+
+    Term i of the sorted term dictionary owns postings indptr[i]:indptr[i + 1] (CSR
+    layout). A posting is a row into doc_ids/doc_lengths plus its term frequency.
+    Postings of a term are sorted by row; rows are not necessarily sorted by
+    document ID. Rows of deleted or replaced documents are flagged in `tombstones`
+    until the segment is compacted; tombstone files are versioned by the manifest.
+
+    A segment saved compressed keeps its postings in a CompressedPostings instead;
+    lookups decode the blocks they need and the plain arrays are only decoded, in
+    full, when something reads them (e.g. a merge).
+    """
+
+    def __init__(
+        self,
+        terms: StringTable,
+        indptr: np.ndarray,
+        postings: Optional[np.ndarray],
+        tfs: Optional[np.ndarray],
+        doc_ids: np.ndarray,
+        doc_lengths: np.ndarray,
+        idf: Optional[np.ndarray] = None,
+        impacts: Optional[np.ndarray] = None,
+        tombstones: Optional[np.ndarray] = None,
+        max_impacts: Optional[np.ndarray] = None,
+        compressed: Optional[CompressedPostings] = None,
+    ) -> None:
+        self.terms = terms
+        self.indptr = indptr
+        self._postings = postings
+        self._tfs = tfs
+        self.compressed = compressed
+
+        # Maps rows -> document IDs and document lengths
+        self.doc_ids = doc_ids
+        self.doc_lengths = doc_lengths
+
+        # Precomputed BM25 IDF per term and impact per posting, and the largest impact of
+        # every term, an upper bound of its contribution to any document's score
+        self.idf = idf
+        self.impacts = impacts
+        self.max_impacts = max_impacts
+
+        # Maps rows -> True if the document was deleted or replaced
+        self.tombstones = tombstones
+
+        # Sorted document IDs and their rows, built on the first lookup by document ID
+        self._sorted_doc_ids: Optional[np.ndarray] = None
+        self._sorted_doc_rows: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_dicts(
+        cls,
+        index: dict[str, set[int]],
+        term_frequencies: dict[int, Counter],
+        docs_length: dict[int, int],
+    ) -> "IndexSegment":
+        """Convert the dict based build structures into arrays."""
+        terms = sorted(index)
+        doc_ids = np.array(sorted(docs_length), dtype=np.int64)
+        doc_lengths = np.array([docs_length[doc_id] for doc_id in doc_ids.tolist()], dtype=np.int32)
+
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        posting_ids: list[int] = []
+        posting_tfs: list[int] = []
+        for i, term in enumerate(terms):
+            term_doc_ids = sorted(index[term])
+            posting_ids.extend(term_doc_ids)
+            posting_tfs.extend(term_frequencies[doc_id][term] for doc_id in term_doc_ids)
+            indptr[i + 1] = len(posting_ids)
+
+        postings = np.searchsorted(doc_ids, np.array(posting_ids, dtype=np.int64)).astype(np.int32)
+
+        return cls(
+            terms=StringTable.from_strings(terms),
+            indptr=indptr,
+            postings=postings,
+            tfs=np.array(posting_tfs, dtype=np.int32),
+            doc_ids=doc_ids,
+            doc_lengths=doc_lengths,
+        )
+
+    @property
+    def postings(self) -> np.ndarray:
+        if self._postings is None:
+            self._postings, self._tfs = self.compressed.decode_all()
+        return self._postings
+
+    @property
+    def tfs(self) -> np.ndarray:
+        if self._tfs is None:
+            self._postings, self._tfs = self.compressed.decode_all()
+        return self._tfs
+
+    @property
+    def total_docs(self) -> int:
+        return len(self.doc_ids)
+
+    def term_id(self, term: str) -> int:
+        return self.terms.find(term)
+
+    def doc_freq(self, term_id: int) -> int:
+        return int(self.indptr[term_id + 1] - self.indptr[term_id])
+
+    def posting_range(self, term_id: int) -> slice:
+        return slice(int(self.indptr[term_id]), int(self.indptr[term_id + 1]))
+
+    def term_postings(self, term_id: int, rows: Optional[np.ndarray] = None) -> tuple[np.ndarray, np.ndarray]:
+        """Return the sorted rows and term frequencies of a term.
+
+        With `rows`, a compressed segment only decodes the blocks that can hold them,
+        so the result may leave out other postings of the term.
+        """
+        if self._postings is None:
+            return self.compressed.decode_term(term_id, rows)
+
+        postings = self.posting_range(term_id)
+        return self.postings[postings], self.tfs[postings]
+
+    def live_postings(self, term_id: int) -> tuple[np.ndarray, np.ndarray]:
+        """Return the rows and term frequencies of a term, skipping tombstoned rows."""
+        rows, tfs = self.term_postings(term_id)
+        if self.tombstones is not None:
+            live = ~self.tombstones[rows]
+            rows, tfs = rows[live], tfs[live]
+        return rows, tfs
+
+    def live_rows(self) -> np.ndarray:
+        if self.tombstones is None:
+            return np.ones(self.total_docs, dtype=bool)
+        return ~np.asarray(self.tombstones)
+
+    def doc_rows(self, doc_ids: np.ndarray) -> np.ndarray:
+        """Return the row of each document ID, or -1 for IDs that are not indexed."""
+        if self._sorted_doc_ids is None:
+            self._sorted_doc_rows = np.argsort(self.doc_ids, kind="stable")
+            self._sorted_doc_ids = np.asarray(self.doc_ids)[self._sorted_doc_rows]
+
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        if len(self._sorted_doc_ids) == 0:
+            return np.full(len(doc_ids), -1, dtype=np.int64)
+
+        i = np.minimum(np.searchsorted(self._sorted_doc_ids, doc_ids), len(self._sorted_doc_ids) - 1)
+        found = self._sorted_doc_ids[i] == doc_ids
+        return np.where(found, self._sorted_doc_rows[i], -1)
+
+    def doc_row(self, doc_id: int, live_only: bool = True) -> int:
+        """Return the row of a document, or -1 if it is not indexed (or tombstoned)."""
+        row = int(self.doc_rows(np.array([doc_id]))[0])
+        if row >= 0 and live_only and self.tombstones is not None and self.tombstones[row]:
+            return -1
+        return row
+
+    def save(self, directory: str, compress: bool = False) -> None:
+        """Write the segment, with compressed postings and without per-posting impacts if `compress`."""
+        os.makedirs(directory, exist_ok=True)
+        self.terms.save(directory, "terms")
+        names = ["indptr", "doc_ids", "doc_lengths", "idf", "max_impacts"]
+        if compress:
+            # Impacts are computed from the decoded term frequencies while searching
+            (self.compressed or CompressedPostings.encode(self.indptr, self.postings, self.tfs)).save(directory)
+            stale_files = PLAIN_POSTING_FILES
+        else:
+            names += PLAIN_POSTING_FILES
+            stale_files = PACKED_POSTING_FILES + ("posting_block_size",)
+
+        for name in names:
+            array = getattr(self, name)
+            if array is not None:
+                save_array(os.path.join(directory, f"{name}.npy"), array)
+
+        # Files of the other layout, e.g. written by a parallel build or a merge into this directory
+        for name in stale_files:
+            path = os.path.join(directory, f"{name}.npy")
+            if os.path.exists(path):
+                os.remove(path)
+
+    @classmethod
+    def load(cls, directory: str) -> "IndexSegment":
+        def load_optional(name: str) -> Optional[np.ndarray]:
+            path = os.path.join(directory, f"{name}.npy")
+            return load_array(path) if os.path.exists(path) else None
+
+        indptr = load_array(os.path.join(directory, "indptr.npy"))
+        return cls(
+            terms=StringTable.load(directory, "terms"),
+            indptr=indptr,
+            postings=load_optional("postings"),
+            tfs=load_optional("tfs"),
+            doc_ids=load_array(os.path.join(directory, "doc_ids.npy")),
+            doc_lengths=load_array(os.path.join(directory, "doc_lengths.npy")),
+            idf=load_optional("idf"),
+            impacts=load_optional("impacts"),
+            max_impacts=load_optional("max_impacts"),
+            compressed=CompressedPostings.load(directory, indptr),
+        )
+
+
+def save_array(path: str, array: np.ndarray) -> None:
+    # Arrays memory-mapped from the target itself are already stored there
+    if isinstance(array, np.memmap) and array.filename and os.path.exists(path):
+        if os.path.samefile(array.filename, path):
+            return
+
+    # Write next to the target and swap it in, so processes that still have the
+    # old file memory-mapped keep reading a consistent copy
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.ascontiguousarray(array))
+    os.replace(tmp_path, path)
+
+
+def append_rows(path: str, rows: np.ndarray) -> None:
+    """Append rows to a 1-D or 2-D .npy file in place.
+
+    NumPy pads .npy headers so the first dimension can grow without moving the
+    data; the header is rewritten with the new shape and the rows are written at
+    the end of the file. Existing memory maps of the file stay valid.
+    """
+    with open(path, "r+b") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            read_header, write_header = np.lib.format.read_array_header_1_0, np.lib.format.write_array_header_1_0
+        else:
+            read_header, write_header = np.lib.format.read_array_header_2_0, np.lib.format.write_array_header_2_0
+
+        shape, fortran_order, dtype = read_header(f)
+        header_length = f.tell()
+        if fortran_order or shape[1:] != rows.shape[1:]:
+            raise ValueError(f"Cannot append rows of shape {rows.shape} to {path} with shape {shape}")
+
+        header = io.BytesIO()
+        write_header(header, {
+            "descr": np.lib.format.dtype_to_descr(dtype),
+            "fortran_order": False,
+            "shape": (shape[0] + len(rows), *shape[1:]),
+        })
+
+        if header.tell() != header_length:
+            # No room left in the header, rewrite the whole file
+            f.close()
+            save_array(path, np.concatenate([np.load(path), rows.astype(dtype)]))
+            return
+
+        f.seek(0, os.SEEK_END)
+        f.write(np.ascontiguousarray(rows, dtype=dtype).tobytes())
+        f.seek(0)
+        f.write(header.getvalue())
+
+
+def load_array(path: str) -> np.ndarray:
+    return np.load(path, mmap_mode="r")
+
+
+def read_manifest(index_dir: str) -> Optional[dict]:
+    path = os.path.join(index_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "r") as f:
+        manifest = json.load(f)
+
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported index format version {manifest.get('format_version')}. Please run the build command."
+        )
+    return manifest
+
+
+def read_generation(index_dir: str) -> int:
+    """Return the generation of the published index, or 0 if there is none."""
+    try:
+        with open(os.path.join(index_dir, MANIFEST_FILE), "r") as f:
+            return json.load(f).get("generation", 0)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return 0
+
+
+def write_manifest(index_dir: str, manifest: dict) -> None:
+    path = os.path.join(index_dir, MANIFEST_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"format_version": FORMAT_VERSION, **manifest}, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def next_segment_name(index_dir: str) -> str:
+    existing = [
+        int(name[len(SEGMENT_PREFIX):])
+        for name in os.listdir(index_dir)
+        if name.startswith(SEGMENT_PREFIX) and name[len(SEGMENT_PREFIX):].isdigit()
+    ] if os.path.isdir(index_dir) else []
+
+    return f"{SEGMENT_PREFIX}{max(existing, default=-1) + 1:05d}"
+
+
+def remove_unused_segments(index_dir: str, manifest: dict, previous_manifest: Optional[dict]) -> None:
+    """Delete the segment directories of the previous manifest and tombstone files the manifest no longer references.
+
+    Segment directories never published, such as those other processes are still
+    writing, are left alone.
+    """
+    # Unlinking is safe for readers that still have the files memory-mapped
+    in_use = set(manifest["segments"])
+    for name in (previous_manifest or {}).get("segments", []):
+        if name not in in_use:
+            shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)
+
+    for segment_name in in_use:
+        segment_dir = os.path.join(index_dir, segment_name)
+        for name in os.listdir(segment_dir):
+            if name.startswith("tombstones-") and manifest.get("tombstones", {}).get(segment_name) != name:
+                os.remove(os.path.join(segment_dir, name))
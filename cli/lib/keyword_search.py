@@ -1,46 +1,125 @@
 import math
 import os
 import pickle
-import string
+import time
 from collections import defaultdict
-from typing import Any, Counter, Optional
-
-from nltk.stem import PorterStemmer
-
+from typing import Any, Counter, Iterable, Optional
+
+import numpy as np
+
+from .batch_search import stream_batch_results
+from .bm25_scorer import BM25Scorer, compute_bm25_weights
+from .doc_store import DOC_STORE_DIR, INDEX_PIN, DocStore, DocStoreWriter, write_doc_store
+from .index_builder import (
+    build_segment_parallel,
+    document_text,
+    iter_documents,
+    merge_segments,
+    merge_stem_maps,
+    peak_rss_mb,
+)
+from .index_format import (
+    MANIFEST_FILE,
+    IndexSegment,
+    load_array,
+    next_segment_name,
+    read_generation,
+    read_manifest,
+    remove_unused_segments,
+    save_array,
+    write_manifest,
+)
+from .profiling import current_profile
+from .result_cache import result_cache
 from .search_utils import (
     BM25_B,
     BM25_K1,
     CACHE_DIR,
+    COMPRESS_POSTINGS,
+    DATA_PATH,
+    DEFAULT_BUILD_BATCH_SIZE,
+    DEFAULT_QUERY_BATCH_SIZE,
     DEFAULT_SEARCH_LIMIT,
-    load_movies,
-    load_stop_words,
 )
-
-stemmer = PorterStemmer()
+from .tokenizer import StemMap, Tokenizer, get_default_tokenizer, preprocess_text
 
 class InvertedIndex:
-    def __init__(self) -> None:
-        # Maps tokens -> document IDs
+    def __init__(self, cache_dir: str = CACHE_DIR, compress: bool = COMPRESS_POSTINGS) -> None:
+        # Maps tokens -> document IDs (build time only)
         self._index = defaultdict(set)
 
-        # Maps document IDs -> full document objects
-        self._docmap: dict[int, dict] = {}
+        # Indexed documents by ID, memory-mapped on first use
+        self._doc_store: Optional[DocStore] = None
+
+        # Documents of a build, written to a new doc store version that save() publishes
+        self._doc_store_writer: Optional[DocStoreWriter] = None
 
-        # Maps document IDs -> Counter (track how many times each term appears in each document)
+        # Doc store version the index was published with and its fingerprint, pinned in the store
+        self._doc_store_version: Optional[str] = None
+        self._doc_store_fingerprint: Optional[str] = None
+
+        # Maps document IDs -> Counter (build time only)
         self._term_frequencies: dict[int, Counter] = {}
 
-        # Maps document IDs -> document length (i.e., #tokens per document)
+        # Maps document IDs -> document length (build time only)
         self._docs_length = defaultdict(int)
 
-        self.index_path = os.path.join(CACHE_DIR, "index.pkl")
-        self.docmap_path = os.path.join(CACHE_DIR, "docmap.pkl")
-        self.term_frequencies_path = os.path.join(CACHE_DIR, "term_frequencies.pkl")
-        self.docs_length_path = os.path.join(CACHE_DIR, "docs_length.pkl")
+        # Array-backed index segments used for every lookup once the index is built or loaded.
+        # Incremental updates append segments, compaction merges them back into one.
+        self._segments: list[IndexSegment] = []
+        self._segment_names: list[str] = []
+        self._scorer: Optional[BM25Scorer] = None
+
+        # Query-time tokenizer, backed by the raw word -> stem maps persisted with the index
+        self.tokenizer = get_default_tokenizer()
+        self._stem_map: Optional[StemMap] = None
+        self._stem_maps: list[StemMap] = []
+
+        # Segment directory already written by a parallel build but not published yet
+        self._staged_segment_name: Optional[str] = None
+
+        # Bumped every time the manifest is published
+        self._generation = 0
+
+        # Whether saved segments store compressed postings, an index loaded compressed stays compressed
+        self.compress = compress
+
+        # Set for a shard scored with the corpus statistics of all shards, which incremental updates would break
+        self._corpus_statistics = False
+
+        # Maps segment names -> file holding the segment's tombstones
+        self._tombstone_files: dict[str, str] = {}
+
+        # Corpus statistics
+        self._total_docs = 0
+        self._avg_doc_length = 0.0
+
+        self.cache_dir = cache_dir
+        self.index_dir = os.path.join(cache_dir, "index")
+        self.index_path = os.path.join(self.index_dir, MANIFEST_FILE)
+        self.doc_store_dir = os.path.join(cache_dir, DOC_STORE_DIR)
 
-    def __add_document(self, doc_id: int, text: str) -> None:
-        # Tokenize input text
-        tokens = tokenize_text(text)
+        # Pickle files written by older versions, only read to migrate them
+        self.docmap_path = os.path.join(cache_dir, "docmap.pkl")
+        self.legacy_index_path = os.path.join(cache_dir, "index.pkl")
+        self.legacy_term_frequencies_path = os.path.join(cache_dir, "term_frequencies.pkl")
+        self.legacy_docs_length_path = os.path.join(cache_dir, "docs_length.pkl")
 
+    @property
+    def total_docs(self) -> int:
+        return self._total_docs
+
+    @property
+    def generation(self) -> int:
+        """Generation of the published index, bumped by every save, update and compaction."""
+        return self._generation
+
+    @property
+    def doc_store_fingerprint(self) -> Optional[str]:
+        """Fingerprint of the doc store version the index was published with, None if it was not recorded."""
+        return self._doc_store_fingerprint
+
+    def __add_document(self, doc_id: int, tokens: list[str]) -> None:
         # Add each token to the index with document ID
         for token in set(tokens):
             self._index[token].add(doc_id)
@@ -51,12 +130,97 @@ class InvertedIndex:
         # Track total number of tokens per document
         self._docs_length[doc_id] = len(tokens)
 
-    def __get_avg_doc_length(self) -> float:
-        total_docs = len(self._docs_length)
-        if total_docs == 0:
-            return 0.0
+    def __freeze(self) -> None:
+        """Convert the build dicts into an array-backed segment with precomputed BM25 weights."""
+        segment = IndexSegment.from_dicts(self._index, self._term_frequencies, self._docs_length)
+        if self.tokenizer.vocabulary is not None:
+            self._stem_map = StemMap.from_dict(self.tokenizer.vocabulary)
+
+        self.__set_segment(segment)
 
-        return sum(self._docs_length.values()) / total_docs
+        # Release the build structures
+        self._index = defaultdict(set)
+        self._term_frequencies = {}
+        self._docs_length = defaultdict(int)
+
+    def use_corpus_statistics(self, total_docs: int, avg_doc_length: float, doc_freqs: np.ndarray) -> None:
+        """Score a freshly built index holding one shard of a corpus with the statistics of the whole corpus.
+
+        `doc_freqs` is the corpus-wide document frequency of every term of the index, in
+        term order. BM25 scores then match those of an index of the whole corpus.
+        """
+        if len(self._segments) != 1:
+            raise ValueError("Index is empty. Please run the build command.")
+
+        segment = self._segments[0]
+        self._total_docs = total_docs
+        self._avg_doc_length = avg_doc_length
+        self._corpus_statistics = True
+        segment.idf, segment.impacts, segment.max_impacts = compute_bm25_weights(
+            segment, total_docs, avg_doc_length, corpus_doc_freqs=doc_freqs
+        )
+        self._scorer = BM25Scorer(self._segments, total_docs, avg_doc_length)
+
+    def term_doc_freqs(self) -> tuple[list[str], np.ndarray]:
+        """Terms of a freshly built index and the number of documents containing each."""
+        segment = self._segments[0]
+        return segment.terms.to_list(), np.diff(segment.indptr)
+
+    def total_doc_length(self) -> int:
+        return sum(int(np.sum(segment.doc_lengths, dtype=np.int64)) for segment in self._segments)
+
+    def doc_store(self) -> DocStore:
+        """Every indexed document, in indexing order."""
+        return self.__get_doc_store()
+
+    def __set_segment(self, segment: IndexSegment) -> None:
+        """Compute corpus statistics and BM25 weights for a freshly built segment."""
+        self._total_docs = segment.total_docs
+        total_docs_length = int(np.sum(segment.doc_lengths, dtype=np.int64))
+        self._avg_doc_length = total_docs_length / self._total_docs if self._total_docs else 0.0
+
+        segment.idf, segment.impacts, segment.max_impacts = compute_bm25_weights(segment, self._total_docs, self._avg_doc_length)
+        self._segments = [segment]
+        self._scorer = BM25Scorer(self._segments, self._total_docs, self._avg_doc_length)
+
+    def __get_doc_store(self) -> DocStore:
+        if self._doc_store is None:
+            with current_profile().stage("load_doc_store"):
+                # The version the index was built with, the store may have been written again since
+                self._doc_store = DocStore.load(self.doc_store_dir, self._doc_store_version)
+
+            if self._doc_store is None:
+                # Convert the document map pickled by older versions on first use
+                try:
+                    with open(self.docmap_path, 'rb') as f:
+                        docmap = pickle.load(f)
+                except FileNotFoundError:
+                    raise FileNotFoundError("Document store doesn't exist. Please run the build command.")
+                self._doc_store = write_doc_store(docmap.values(), self.doc_store_dir)
+                os.remove(self.docmap_path)
+
+        return self._doc_store
+
+    def __get_doc_freq(self, token: str) -> int:
+        df = 0
+        for segment in self._segments:
+            term_id = segment.term_id(token)
+            if term_id < 0:
+                continue
+            if segment.tombstones is None:
+                df += segment.doc_freq(term_id)
+            else:
+                df += len(segment.live_postings(term_id)[0])
+        return df
+
+    def __find_document(self, doc_id: int) -> tuple[Optional[IndexSegment], int]:
+        """Return the segment and row holding the live copy of a document, or (None, -1)."""
+        # Newer segments hold the latest version of updated documents
+        for segment in reversed(self._segments):
+            row = segment.doc_row(doc_id)
+            if row >= 0:
+                return segment, row
+        return None, -1
 
     def bm25(self, doc_id: int, term: str) -> float:
         tf = self.get_bm25_tf(doc_id, term)
@@ -65,30 +229,61 @@ class InvertedIndex:
         return tf * idf
 
     def bm25_search(self, query, limit) -> dict[int, dict[str, Any]]:
-        tokens = tokenize_text(query)
-        # Maps document IDs -> BM25 score
-        scores = defaultdict(float)
-
-        for token in tokens:
-            for doc_id in self._index.get(token, ""):
-                scores[doc_id] += self.bm25(doc_id, token)
+        profile = current_profile()
+        with profile.stage("tokenize"):
+            tokens = self.tokenizer.tokenize(query)
 
-        sorted_keys = sorted(scores, key=scores.get, reverse=True)[:limit]
+        ranked = self._scorer.search(tokens, limit)
+        documents = self.__get_doc_store() if ranked else {}
 
         results = {}
-        for doc_id in sorted_keys:
-            doc = self.get_document_by_id(doc_id)
-            results[doc_id] = {"title": doc['title'], "score": scores[doc_id]}
+        with profile.stage("fetch_documents"):
+            for doc_id, score in ranked:
+                doc = documents.get(doc_id)
+                if doc is None:
+                    # Not in the store the index was loaded with
+                    continue
+                results[doc_id] = {"title": doc['title'], "score": score}
+        return results
+
+    def search(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
+        """Documents containing any query token, in token order."""
+        results = []
+        seen_ids = set()  # Track seen IDs to avoid duplicates
+        profile = current_profile()
+        
+        # Preprocess query
+        with profile.stage("tokenize"):
+            query_tokens = self.tokenizer.tokenize(query)
+        
+        # Iterate over each token in the query
+        for token in query_tokens:
+            # Get matching documents for this token
+            with profile.stage("postings"):
+                matching_doc_ids = self.get_documents(term=token)
+            profile.count("postings", len(matching_doc_ids))
+            
+            for doc_id in matching_doc_ids:
+                if doc_id not in seen_ids:
+                    seen_ids.add(doc_id)
+                    doc = self.get_document_by_id(doc_id)
+                    if doc:
+                        results.append(doc)
+                    
+                    # Stop searching if we have enough results
+                    if len(results) >= limit:
+                        break
+        
         return results
 
     def get_bm25_idf(self, term: str) -> float:
-        tokens = tokenize_text(term)
+        tokens = self.tokenizer.tokenize(term)
         if len(tokens) != 1:
             raise ValueError("Term must be a single token.")
         
         token = tokens[0]
-        N = len(self._docmap) # Total number of documents
-        df = len(self.get_documents(token)) # Number of documents containing the given term (Document frequency)
+        N = self._total_docs # Total number of documents
+        df = self.__get_doc_freq(token) # Number of documents containing the given term (Document frequency)
 
         # BM25
         # N - df: Number of documents not containing the given term
@@ -100,8 +295,9 @@ class InvertedIndex:
         tf = self.get_tf(doc_id, term)
 
         # Consider doc length normalization
-        doc_length = self._docs_length[doc_id]
-        avg_doc_length = self.__get_avg_doc_length()
+        segment, row = self.__find_document(doc_id)
+        doc_length = int(segment.doc_lengths[row]) if segment is not None else 0
+        avg_doc_length = self._avg_doc_length
         len_normalization = 1 - b + b * (doc_length / avg_doc_length)
 
         # BM25 saturation formula
@@ -110,90 +306,359 @@ class InvertedIndex:
         return (tf * (k1 + 1)) / (tf + k1 * len_normalization)
 
     def calculate_idf(self, term: str) -> float:
-        tokens = tokenize_text(term)
+        tokens = self.tokenizer.tokenize(term)
         if len(tokens) != 1:
             raise ValueError("Term must be a single token.")
         
         token = tokens[0]
-        doc_count = len(self._docmap)
+        doc_count = self._total_docs
         # Measures how many documents in the dataset contain a term
-        term_doc_count = len(self.get_documents(token))
+        term_doc_count = self.__get_doc_freq(token)
 
         return math.log((doc_count + 1) / (term_doc_count + 1))
 
     def get_documents(self, term: str) -> list[int]:
-        doc_ids = self._index.get(term, set())
+        doc_ids = []
+        for segment in self._segments:
+            term_id = segment.term_id(term)
+            if term_id >= 0:
+                rows, _ = segment.live_postings(term_id)
+                doc_ids.append(segment.doc_ids[rows])
 
-        return sorted(list(doc_ids))
+        return np.sort(np.concatenate(doc_ids)).tolist() if doc_ids else []
 
     def get_document_by_id(self, doc_id: int) -> Optional[dict[int, dict]]:
-        return self._docmap.get(doc_id, {})
+        return dict(self.__get_doc_store().get(doc_id, {}))
 
     def get_tf(self, doc_id: int, term: str) -> int:
-        tokens = tokenize_text(term)
+        tokens = self.tokenizer.tokenize(term)
         if len(tokens) != 1:
             raise ValueError("Term must be a single token.")
 
         token = tokens[0]
-        # Get the term frequency for this document, return 0 if doc_id doesn't exist
-        term_freq = self._term_frequencies.get(doc_id, Counter())
-        return term_freq.get(token, 0)
-
-    def build(self) -> None:
-        # Read movies data
-        movies = load_movies()
-
-        # Iterate over all movies and add them to both index and docmap
-        for movie in movies:
-            # Store the full document in docmap
-            self._docmap[movie['id']] = movie
-            
+        # Get the term frequency for this document, return 0 if doc_id or the term doesn't exist
+        segment, row = self.__find_document(doc_id)
+        term_id = segment.term_id(token) if segment is not None else -1
+        if term_id < 0:
+            return 0
+
+        term_rows, tfs = segment.term_postings(term_id, np.array([row]))
+        i = int(np.searchsorted(term_rows, row))
+        if i < len(term_rows) and term_rows[i] == row:
+            return int(tfs[i])
+        return 0
+
+    def build(self, documents: Optional[list[dict]] = None, source_path: str = DATA_PATH) -> None:
+        # Read the documents file (movies data by default), unless the documents are given
+        movies = list(iter_documents(source_path)) if documents is None else documents
+        self.__start_doc_store(source_path if documents is None else None)
+
+        # Record the raw word -> stem vocabulary while tokenizing the whole corpus in one batch
+        self.tokenizer = Tokenizer(record_vocabulary=True)
+        movie_tokens = self.tokenizer.tokenize_many(document_text(movie) for movie in movies)
+
+        # The last document with an ID is the one stored, in the position of the first
+        self.__write_documents({movie['id']: movie for movie in movies}.values())
+        self._doc_store = self._doc_store_writer.close()
+
+        # Iterate over all movies and add them to the index
+        for movie, tokens in zip(movies, movie_tokens):
             # Add to inverted index
-            input_text = f"{movie['title']} {movie['description']}"
-            self.__add_document(doc_id=movie['id'], text=input_text)
+            self.__add_document(doc_id=movie['id'], tokens=tokens)
+
+        # Convert to arrays and precompute BM25 weights once for the whole corpus
+        self.__freeze()
+
+    def build_parallel(
+        self,
+        source_path: str = DATA_PATH,
+        workers: Optional[int] = None,
+        batch_size: int = DEFAULT_BUILD_BATCH_SIZE,
+    ) -> dict:
+        """Stream documents from a JSON/JSONL file and tokenize them across a process pool.
+
+        The merged segment is written straight into the index directory; call save()
+        to publish it. Returns build statistics.
+        """
+        os.makedirs(self.index_dir, exist_ok=True)
+        segment_name = next_segment_name(self.index_dir)
+
+        self.__start_doc_store(source_path)
+        segment, self._stem_map, stats = build_segment_parallel(
+            self._doc_store_writer.add_many(iter_documents(source_path)),
+            os.path.join(self.index_dir, segment_name),
+            workers=workers,
+            batch_size=batch_size,
+        )
+        self._staged_segment_name = segment_name
+        self._doc_store = self._doc_store_writer.close()
+        self.__set_segment(segment)
+        if self._stem_map is not None:
+            self.tokenizer = Tokenizer(stem_maps=[self._stem_map])
+
+        return stats
+
+    def __start_doc_store(self, source_path: Optional[str]) -> None:
+        """Write the documents of a build to a new doc store version, published by save()."""
+        if self._doc_store_writer is not None:
+            self._doc_store_writer.abort()
+        self._doc_store_writer = DocStoreWriter(self.doc_store_dir, source_path)
+
+    def __publish_doc_store(self) -> None:
+        """Publish the written documents, pinned in the store as the version this index serves."""
+        self._doc_store = self._doc_store_writer.publish(pin=INDEX_PIN)
+        self._doc_store_writer = None
+        self._doc_store_version = self._doc_store.version
+        self._doc_store_fingerprint = self._doc_store.fingerprint
+
+    def __write_documents(self, documents: Iterable[dict]) -> None:
+        for document in documents:
+            self._doc_store_writer.add(document)
 
     def save(self) -> None:
-        # Ensure cache directory exists
-        os.makedirs(CACHE_DIR, exist_ok=True)
-        
-        # Save inverted index
-        with open(self.index_path, 'wb') as f:
-            pickle.dump(self._index, f)
-        
-        # Save document map
-        with open(self.docmap_path, 'wb') as f:
-            pickle.dump(self._docmap, f)
-
-        # Save term frequencies
-        with open(self.term_frequencies_path, 'wb') as f:
-            pickle.dump(self._term_frequencies, f)
+        if not self._segments:
+            raise ValueError("Index is empty. Please run the build command.")
+        if len(self._segments) != 1:
+            raise ValueError("Index has pending incremental updates. Please run the compact command.")
 
-        # Save docs length
-        with open(self.docs_length_path, 'wb') as f:
-            pickle.dump(self._docs_length, f)
+        # Ensure cache directory exists
+        os.makedirs(self.index_dir, exist_ok=True)
+
+        # Every save writes a fresh segment directory, so readers that have the previous
+        # one memory-mapped are not affected until they reload the manifest
+        segment_name = self._staged_segment_name or next_segment_name(self.index_dir)
+        segment_dir = os.path.join(self.index_dir, segment_name)
+        self._segments[0].save(segment_dir, self.compress)
+        if self._stem_map is not None:
+            self._stem_map.save(segment_dir)
+
+        # Publish the documents of the build, a compacted index keeps its documents
+        if self._doc_store_writer is not None:
+            self.__publish_doc_store()
+
+        # Publish the new segment
+        self._segment_names = [segment_name]
+        self.__publish({})
+        self._staged_segment_name = None
+
+    def size_on_disk(self) -> int:
+        """Bytes of the published segments, without the doc store."""
+        return sum(
+            entry.stat().st_size
+            for segment_name in self._segment_names
+            for entry in os.scandir(os.path.join(self.index_dir, segment_name))
+        )
+
+    def __publish(self, tombstone_files: dict[str, str]) -> None:
+        """Atomically switch readers to the current segments and tombstones."""
+        # Generations keep increasing across rebuilds
+        self._generation = max(self._generation, read_generation(self.index_dir)) + 1
+        manifest = {
+            "generation": self._generation,
+            "segments": self._segment_names,
+            "tombstones": tombstone_files,
+            "total_docs": self._total_docs,
+            "avg_doc_length": self._avg_doc_length,
+            "k1": BM25_K1,
+            "b": BM25_B,
+            "corpus_statistics": self._corpus_statistics,
+            "doc_store": {"version": self._doc_store_version, "fingerprint": self._doc_store_fingerprint},
+        }
+        previous_manifest = read_manifest(self.index_dir)
+        write_manifest(self.index_dir, manifest)
+        remove_unused_segments(self.index_dir, manifest, previous_manifest)
+        self._tombstone_files = tombstone_files
 
     def load(self):
-        """Load the index and docmap from the disk."""
-
+        """Memory-map the index from the disk."""
+        profile = current_profile()
+        with profile.stage("load_index"):
+            manifest = read_manifest(self.index_dir)
+
+        if manifest is None:
+            # Convert pickles written by older versions on first use
+            self.migrate()
+            return
+
+        self._generation = manifest.get("generation", 0)
+        # Indexes published before the version was recorded serve the current doc store
+        doc_store = manifest.get("doc_store", {})
+        self._doc_store_version = doc_store.get("version")
+        self._doc_store_fingerprint = doc_store.get("fingerprint")
+        self._corpus_statistics = manifest.get("corpus_statistics", False)
+        if self._corpus_statistics and (manifest["k1"], manifest["b"]) != (BM25_K1, BM25_B):
+            # Without stored weights the IDFs would come from this shard's document frequencies
+            raise ValueError("Shard was scored with other BM25 parameters. Please build the shards again.")
+
+        self._segment_names = manifest["segments"]
+        self._tombstone_files = manifest.get("tombstones", {})
+        self._total_docs = manifest["total_docs"]
+        self._avg_doc_length = manifest["avg_doc_length"]
+
+        self._segments = []
+        self._stem_maps = []
+        with profile.stage("load_index"):
+            for segment_name in self._segment_names:
+                segment_dir = os.path.join(self.index_dir, segment_name)
+                segment = IndexSegment.load(segment_dir)
+                if segment_name in self._tombstone_files:
+                    segment.tombstones = load_array(os.path.join(segment_dir, self._tombstone_files[segment_name]))
+
+                # Stored impacts are only valid for the BM25 parameters they were computed with
+                if (manifest["k1"], manifest["b"]) != (BM25_K1, BM25_B):
+                    segment.idf, segment.impacts, segment.max_impacts = None, None, None
+
+                self._segments.append(segment)
+                self.compress = self.compress or segment.compressed is not None
+
+                stem_map = StemMap.load(segment_dir)
+                if stem_map is not None:
+                    self._stem_maps.append(stem_map)
+
+            self._scorer = BM25Scorer(self._segments, self._total_docs, self._avg_doc_length)
+
+        # Query terms found in the stem maps are stemmed without loading NLTK
+        if self._stem_maps:
+            self.tokenizer = Tokenizer(stem_maps=self._stem_maps)
+
+    def apply_delta(self, upserts: list[dict], deletes: list[int]) -> dict:
+        """Index added or changed documents as a new segment and tombstone replaced or deleted ones.
+
+        Scores stay exact: until compact() merges the segments back into one, query
+        terms are scored with the statistics of the live documents.
+        """
+        self.load()
+        if self._corpus_statistics:
+            raise ValueError("Shards are not updated incrementally. Please build the shards again.")
+        upserts_by_id = {document['id']: document for document in upserts}
+        removed_ids = np.array(sorted(set(deletes) | set(upserts_by_id)), dtype=np.int64)
+
+        # Tombstone the live copy of every replaced or deleted document
+        tombstone_files = dict(self._tombstone_files)
+        tombstoned = 0
+        for segment_name, segment in zip(self._segment_names, self._segments):
+            rows = segment.doc_rows(removed_ids)
+            tombstones = ~segment.live_rows()
+            rows = rows[rows >= 0]
+            rows = rows[~tombstones[rows]]
+            if len(rows) == 0:
+                continue
+
+            tombstones[rows] = True
+            tombstoned += len(rows)
+            segment.tombstones = tombstones
+            tombstone_files[segment_name] = f"tombstones-{self._generation + 1:05d}.npy"
+            save_array(os.path.join(self.index_dir, segment_name, tombstone_files[segment_name]), tombstones)
+
+        # Index the new versions as a segment of their own
+        if upserts_by_id:
+            documents = list(upserts_by_id.values())
+            tokenizer = Tokenizer(stem_maps=self._stem_maps, record_vocabulary=True)
+            for document, tokens in zip(documents, tokenizer.tokenize_many(document_text(doc) for doc in documents)):
+                self.__add_document(doc_id=document['id'], tokens=tokens)
+
+            segment = IndexSegment.from_dicts(self._index, self._term_frequencies, self._docs_length)
+            self._index = defaultdict(set)
+            self._term_frequencies = {}
+            self._docs_length = defaultdict(int)
+
+            segment_name = next_segment_name(self.index_dir)
+            segment_dir = os.path.join(self.index_dir, segment_name)
+            segment.save(segment_dir, self.compress)
+            StemMap.from_dict(tokenizer.vocabulary).save(segment_dir)
+            self._segment_names = self._segment_names + [segment_name]
+            self._segments.append(segment)
+
+        # Write a new doc store version, replaced documents keep their position
+        doc_store = self.__get_doc_store()
+        removed = set(deletes)
+        self.__start_doc_store(doc_store.source["path"] if doc_store.source else None)
+        self.__write_documents(
+            upserts_by_id.get(document['id']) or dict(document) for document in doc_store if document['id'] not in removed
+        )
+        self.__write_documents(upserts_by_id.values())
+        self.__publish_doc_store()
+
+        # Corpus statistics of the live documents
+        live_rows = [segment.live_rows() for segment in self._segments]
+        self._total_docs = sum(int(live.sum()) for live in live_rows)
+        total_docs_length = sum(
+            int(np.sum(segment.doc_lengths[live], dtype=np.int64))
+            for segment, live in zip(self._segments, live_rows)
+        )
+        self._avg_doc_length = total_docs_length / self._total_docs if self._total_docs else 0.0
+
+        self.__publish(tombstone_files)
+        self.load()
+
+        return {
+            "upserted": len(upserts_by_id),
+            "tombstoned": tombstoned,
+            "segments": len(self._segments),
+        }
+
+    def compact(self) -> bool:
+        """Merge all segments into one, dropping tombstoned documents, and precompute BM25 weights again.
+
+        Returns False if there was nothing to compact.
+        """
+        self.load()
+        if len(self._segments) == 1 and self._segments[0].tombstones is None:
+            return False
+
+        segment_name = next_segment_name(self.index_dir)
+        segment = merge_segments(
+            [os.path.join(self.index_dir, name) for name in self._segment_names],
+            os.path.join(self.index_dir, segment_name),
+            [segment.tombstones for segment in self._segments],
+        )
+        self._stem_map = merge_stem_maps(self._stem_maps)
+        self._staged_segment_name = segment_name
+        self.__set_segment(segment)
+        self.save()
+        return True
+
+    def migrate(self) -> None:
+        """Convert the pickle files written by older versions into the binary index format."""
         try:
-            # Load index
-            with open(self.index_path, 'rb') as f:
+            with open(self.legacy_index_path, 'rb') as f:
                 self._index = pickle.load(f)
 
-            # Load docmap
             with open(self.docmap_path, 'rb') as f:
-                self._docmap = pickle.load(f)
+                docmap = pickle.load(f)
 
-            # Load term frequencies
-            with open(self.term_frequencies_path, 'rb') as f:
+            with open(self.legacy_term_frequencies_path, 'rb') as f:
                 self._term_frequencies = pickle.load(f)
 
-            # Load docs
-            with open(self.docs_length_path, 'rb') as f:
+            with open(self.legacy_docs_length_path, 'rb') as f:
                 self._docs_length = pickle.load(f)
         except FileNotFoundError:
             raise FileNotFoundError("Index files doesn't exist. Please run the build command.")
 
+        self.__start_doc_store(None)
+        self.__write_documents(docmap.values())
+        self._doc_store = self._doc_store_writer.close()
+        self.__freeze()
+        self.save()
+        os.remove(self.docmap_path)
+
+
+def use_shared_statistics(indexes: list[InvertedIndex]) -> None:
+    """Score freshly built indexes, the shards of one corpus, with the statistics of the whole corpus."""
+    total_docs = sum(index.total_docs for index in indexes)
+    avg_doc_length = sum(index.total_doc_length() for index in indexes) / total_docs if total_docs else 0.0
+
+    # Corpus-wide document frequency of every term, summed over the shards containing it
+    shard_terms, shard_doc_freqs = zip(*(index.term_doc_freqs() for index in indexes))
+    all_terms, term_ids = np.unique(np.array([term for terms in shard_terms for term in terms], dtype=str), return_inverse=True)
+    doc_freqs = np.zeros(len(all_terms), dtype=np.int64)
+    np.add.at(doc_freqs, term_ids, np.concatenate(shard_doc_freqs))
+
+    start = 0
+    for index, terms in zip(indexes, shard_terms):
+        index.use_corpus_statistics(total_docs, avg_doc_length, doc_freqs[term_ids[start:start + len(terms)]])
+        start += len(terms)
+
 
 def bm25idf_command(term: str) -> float:
     index = InvertedIndex()
@@ -213,14 +678,57 @@ def bm25search_command(query: str, limit: int) -> dict[int, dict[str, Any]]:
     index = InvertedIndex()
     index.load()
 
-    return index.bm25_search(query, limit)
+    def search() -> list:
+        # JSON object keys are strings, so the ID -> result mapping is cached as pairs
+        return [[doc_id, {**result, "score": float(result["score"])}] for doc_id, result in index.bm25_search(query, limit).items()]
+
+    results = result_cache("bm25").get_or_search(
+        search, index.generation, index.doc_store_fingerprint, query, limit, k1=BM25_K1, b=BM25_B
+    )
+    return {doc_id: result for doc_id, result in results}
 
 
-def build_command() -> None:
+def batch_command(
+    queries_path: str,
+    limit: int,
+    bm25: bool = True,
+    output_path: str = "-",
+    batch_size: int = DEFAULT_QUERY_BATCH_SIZE,
+) -> dict:
+    """Search every query of a file against one loaded index, streaming JSONL results."""
     index = InvertedIndex()
-    index.build()
+    index.load()
+
+    def search_batch(queries: list[str]) -> list[list[dict]]:
+        if bm25:
+            return [[{"id": doc_id, **result} for doc_id, result in index.bm25_search(query, limit).items()] for query in queries]
+        return [index.search(query, limit) for query in queries]
+
+    return stream_batch_results(search_batch, queries_path, output_path, batch_size)
+
+
+def build_command(
+    parallel: bool = False,
+    source_path: str = DATA_PATH,
+    workers: Optional[int] = None,
+    batch_size: int = DEFAULT_BUILD_BATCH_SIZE,
+    compress: bool = COMPRESS_POSTINGS,
+) -> dict:
+    start_time = time.perf_counter()
+    index = InvertedIndex(compress=compress)
+    if parallel:
+        stats = index.build_parallel(source_path, workers, batch_size)
+    else:
+        index.build(source_path=source_path)
+        stats = {"docs": index.total_docs, "workers": 1}
     index.save()
 
+    stats["seconds"] = time.perf_counter() - start_time
+    stats["docs_per_sec"] = stats["docs"] / stats["seconds"] if stats["seconds"] else 0.0
+    stats["peak_rss_mb"] = peak_rss_mb()
+    stats["index_mb"] = index.size_on_disk() / 1024 / 1024
+    return stats
+
 
 def idf_command(term: str) -> float:
     index = InvertedIndex()
@@ -228,33 +736,21 @@ def idf_command(term: str) -> float:
     return index.calculate_idf(term)
 
 
+def migrate_command() -> tuple[list[str], list[str]]:
+    """Migrate the pickled index, returning the pickle files removed and those left to delete."""
+    index = InvertedIndex()
+    index.migrate()
+
+    # The document map is converted to the doc store and removed, the other pickles are kept
+    legacy_paths = [index.legacy_index_path, index.legacy_term_frequencies_path, index.legacy_docs_length_path]
+    return [index.docmap_path], [path for path in legacy_paths if os.path.exists(path)]
+
+
 def search_command(query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
     index = InvertedIndex()
     index.load()
 
-    results = []
-    seen_ids = set()  # Track seen IDs to avoid duplicates
-    
-    # Preprocess query
-    query_tokens = tokenize_text(query)
-    
-    # Iterate over each token in the query
-    for token in query_tokens:
-        # Get matching documents for this token
-        matching_doc_ids = index.get_documents(term=token)
-        
-        for doc_id in matching_doc_ids:
-            if doc_id not in seen_ids:
-                seen_ids.add(doc_id)
-                doc = index.get_document_by_id(doc_id)
-                if doc:
-                    results.append(doc)
-                
-                # Stop searching if we have enough results
-                if len(results) >= limit:
-                    break
-    
-    return results
+    return index.search(query, limit)
 
 
 def tf_command(doc_id: int, term: str):
@@ -273,31 +769,9 @@ def tfidf_command(doc_id: int, term: str):
     return float(tf) * idf
 
 
-def preprocess_text(text: str) -> list[str]:
-    """Preprocess text for text matching."""
-    # Convert to lowercase
-    text = text.lower()
-
-    # Create a translation table that maps all punctuation to None (removes them)
-    translator = str.maketrans('', '', string.punctuation)
-    # Remove all punctuation from text
-    text = text.translate(translator)
-    
-    return text
-
-
 def tokenize_text(text: str) -> list[str]:
     """Split text and convert it into word-based tokens, filtering out stopwords."""
-    text = preprocess_text(text)
-    
-    # Split text into word-based tokens
-    tokens = text.split()
-    
-    # Load stopwords
-    stop_words = load_stop_words()
-    
-    # Filter out empty tokens and stopwords
-    return [stemmer.stem(token) for token in tokens if token.strip() and token not in stop_words]
+    return get_default_tokenizer().tokenize(text)
 
 
 def has_matching_token(query_tokens: list[str], title_tokens: list[str]) -> bool:
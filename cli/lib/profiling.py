@@ -0,0 +1,155 @@
+import atexit
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional, TextIO, Union
+
+PROFILE_FORMATS = ("text", "json")
+
+
+class Stage:
+    """Adds the wall time of a `with` block to a stage of a profile."""
+
+    __slots__ = ("profile", "name", "start")
+
+    def __init__(self, profile: "Profile", name: str) -> None:
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        self.profile.add_time(self.name, time.perf_counter() - self.start)
+
+
+class Profile:
+    """Wall time per stage and counters of everything that ran while the profile was active.
+
+    Stages are flat: each instrumented block adds its time and one call to its
+    stage, blocks are placed so they do not nest. Safe to share between threads.
+    """
+
+    def __init__(self) -> None:
+        # Maps stage name -> [seconds, calls], in the order stages first ran
+        self.stages: dict[str, list] = {}
+        self.counters: dict[str, int] = {}
+        self.started_at = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def __bool__(self) -> bool:
+        return True
+
+    def stage(self, name: str) -> Stage:
+        return Stage(self, name)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        with self._lock:
+            stage = self.stages.setdefault(name, [0.0, 0])
+            stage[0] += seconds
+            stage[1] += 1
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "total_ms": (time.perf_counter() - self.started_at) * 1000,
+                "stages": {name: {"ms": seconds * 1000, "calls": calls} for name, (seconds, calls) in self.stages.items()},
+                "counters": dict(self.counters),
+            }
+
+
+class DisabledProfile:
+    """Stand-in used while nothing is profiled, every call is a no-op."""
+
+    __slots__ = ()
+
+    def __bool__(self) -> bool:
+        return False
+
+    def stage(self, name: str) -> "DisabledStage":
+        return DISABLED_STAGE
+
+    def count(self, name: str, n: int = 1) -> None:
+        pass
+
+
+class DisabledStage:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+DISABLED_PROFILE = DisabledProfile()
+DISABLED_STAGE = DisabledStage()
+
+# Profile of the current thread or task, instrumented code records into whatever is active
+_active_profile: ContextVar[Union[Profile, DisabledProfile]] = ContextVar("active_profile", default=DISABLED_PROFILE)
+
+
+def current_profile() -> Union[Profile, DisabledProfile]:
+    """The active profile, falsy and free to call into when profiling is off."""
+    return _active_profile.get()
+
+
+@contextmanager
+def profiling() -> Iterator[Profile]:
+    """Profile everything run in this context until the block exits."""
+    profile = Profile()
+    token = _active_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _active_profile.reset(token)
+
+
+def enable_profiling(output_format: str = "text") -> Profile:
+    """Profile the rest of the process and report it on stderr when the process exits (for the CLIs)."""
+    profile = Profile()
+    _active_profile.set(profile)
+    atexit.register(print_profile, profile, output_format)
+    return profile
+
+
+def add_profile_argument(subparsers) -> None:
+    """Add --profile to every subcommand of a CLI."""
+    for parser in subparsers.choices.values():
+        parser.add_argument(
+            "--profile",
+            nargs="?",
+            const="text",
+            choices=PROFILE_FORMATS,
+            help="Print time per stage and counters on stderr, as text or json (Optional)",
+        )
+
+
+def format_profile(profile: Profile) -> str:
+    report = profile.to_dict()
+    lines = [f"Profile: {report['total_ms']:.2f} ms total"]
+    if report["stages"]:
+        lines.append(f"  {'stage':<20} {'ms':>10} {'calls':>7} {'%':>6}")
+        for name, stage in report["stages"].items():
+            share = stage["ms"] / report["total_ms"] if report["total_ms"] else 0.0
+            lines.append(f"  {name:<20} {stage['ms']:>10.3f} {stage['calls']:>7} {share:>6.1%}")
+    if report["counters"]:
+        lines.append("  " + ", ".join(f"{name}: {value}" for name, value in report["counters"].items()))
+    return "\n".join(lines)
+
+
+def print_profile(profile: Profile, output_format: str = "text", file: Optional[TextIO] = None) -> None:
+    # Results go to stdout, so the profile goes to stderr
+    file = file or sys.stderr
+    if output_format == "json":
+        print(json.dumps(profile.to_dict()), file=file)
+    else:
+        print(format_profile(profile), file=file)
@@ -0,0 +1,172 @@
+import os
+import time
+from typing import Callable, Optional
+
+import numpy as np
+
+from .ann_index import recall_at_k
+from .search_utils import EMBEDDING_QUANTIZATIONS, SCORE_BLOCK_SIZE
+
+# int8 codes span [-INT8_LEVELS, INT8_LEVELS]
+INT8_LEVELS = 127
+
+
+class QuantizedEmbeddings:
+    """Compact codes of an L2-normalized embedding matrix, scanned before rescoring with the full vectors.
+
+    int8 stores every value as a signed byte, scaled per dimension by the largest
+    magnitude of that dimension. binary stores only the sign of every value, 8
+    dimensions per byte, and ranks rows by Hamming distance to the query's signs.
+    """
+
+    def __init__(self, mode: str, codes: np.ndarray, scales: Optional[np.ndarray], dim: int) -> None:
+        self.mode = mode
+        self.codes = codes
+        # Per-dimension scale of the int8 codes, None for binary codes
+        self.scales = scales
+        self.dim = dim
+
+    @property
+    def num_rows(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, mode: str) -> "QuantizedEmbeddings":
+        """Quantize an embedding matrix a block of rows at a time."""
+        num_rows, dim = embeddings.shape
+        if mode == "binary":
+            codes = np.empty((num_rows, (dim + 7) // 8), dtype=np.uint8)
+            for start in range(0, num_rows, SCORE_BLOCK_SIZE):
+                block = np.asarray(embeddings[start:start + SCORE_BLOCK_SIZE])
+                codes[start:start + len(block)] = np.packbits(block > 0, axis=1)
+            return cls(mode, codes, None, dim)
+
+        if mode != "int8":
+            raise ValueError(f"Unsupported quantization '{mode}', expected one of {', '.join(EMBEDDING_QUANTIZATIONS)}")
+
+        max_abs = np.zeros(dim, dtype=np.float32)
+        for start in range(0, num_rows, SCORE_BLOCK_SIZE):
+            block = np.asarray(embeddings[start:start + SCORE_BLOCK_SIZE], dtype=np.float32)
+            np.maximum(max_abs, np.abs(block).max(axis=0, initial=0), out=max_abs)
+        # Dimensions that are zero in every row keep a scale of 1 and code 0
+        scales = np.where(max_abs == 0, 1, max_abs / INT8_LEVELS).astype(np.float32)
+
+        codes = np.empty((num_rows, dim), dtype=np.int8)
+        for start in range(0, num_rows, SCORE_BLOCK_SIZE):
+            block = np.asarray(embeddings[start:start + SCORE_BLOCK_SIZE], dtype=np.float32)
+            codes[start:start + len(block)] = np.clip(np.rint(block / scales), -INT8_LEVELS, INT8_LEVELS)
+        return cls(mode, codes, scales, dim)
+
+    def score(self, query_embedding: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Approximate score of the given rows (all rows if None) for a normalized query, higher is closer."""
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        codes = self.codes if rows is None else self.codes[rows]
+
+        if self.mode == "binary":
+            query_bits = np.packbits(query_embedding > 0)
+            hamming = np.bitwise_count(codes ^ query_bits).sum(axis=1, dtype=np.int32)
+            # Dot product of the +-1 sign vectors
+            return (self.dim - 2 * hamming).astype(np.float32)
+
+        # Folding the scales into the query scores the codes without dequantizing them first
+        scaled_query = query_embedding * self.scales
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK_SIZE):
+            block = codes[start:start + SCORE_BLOCK_SIZE]
+            scores[start:start + len(block)] = block.astype(np.float32) @ scaled_query
+        return scores
+
+    def is_valid_for(self, num_rows: int, dim: int) -> bool:
+        return self.num_rows == num_rows and self.dim == dim
+
+    def save(self, path: str) -> None:
+        # A single file swapped in atomically, so readers never mix two builds
+        tmp_path = f"{path}.tmp.npz"
+        arrays = {"codes": self.codes, "dim": np.array(self.dim)}
+        if self.scales is not None:
+            arrays["scales"] = self.scales
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, mode: str) -> Optional["QuantizedEmbeddings"]:
+        """Load quantized embeddings, or None if there are none."""
+        if not os.path.exists(path):
+            return None
+
+        with np.load(path) as data:
+            scales = data["scales"] if "scales" in data else None
+            return cls(mode, data["codes"], scales, int(data["dim"]))
+
+
+def quantized_path(embeddings_path: str, mode: str) -> str:
+    """File holding the codes of an embedding matrix, e.g. cache/movie_embeddings.int8.npz."""
+    return f"{os.path.splitext(embeddings_path)[0]}.{mode}.npz"
+
+
+def load_or_build_quantized(embeddings_path: str, embeddings: np.ndarray, mode: str, rebuild: bool = False) -> QuantizedEmbeddings:
+    """Load the codes of an embedding matrix, quantizing it first if they are missing or stale."""
+    path = quantized_path(embeddings_path, mode)
+    quantized = None if rebuild else QuantizedEmbeddings.load(path, mode)
+    if quantized is None or not quantized.is_valid_for(*embeddings.shape):
+        quantized = QuantizedEmbeddings.build(embeddings, mode)
+        quantized.save(path)
+    return quantized
+
+
+def remove_quantized(embeddings_path: str) -> None:
+    """Delete the codes of every mode, e.g. after rows of the matrix moved."""
+    for mode in EMBEDDING_QUANTIZATIONS:
+        path = quantized_path(embeddings_path, mode)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def measure_quantization(
+    search: Callable[[int, Optional[QuantizedEmbeddings]], list],
+    num_queries: int,
+    embeddings: np.ndarray,
+    embeddings_path: str,
+) -> list[dict]:
+    """Memory, recall and latency of search(query_idx, codes) for every quantization, against search(query_idx, None).
+
+    The memory is what a process keeps resident to scan: the whole matrix, or only
+    the codes once the matrix is memory-mapped for rescoring.
+    """
+
+    def run(quantized: Optional[QuantizedEmbeddings]) -> tuple[list[list], np.ndarray]:
+        results = []
+        latencies = np.empty(num_queries)
+        for i in range(num_queries):
+            start = time.perf_counter()
+            results.append(search(i, quantized))
+            latencies[i] = (time.perf_counter() - start) * 1000
+        return results, latencies
+
+    exact_results, exact_latencies = run(None)
+    rows = [{
+        "storage": str(embeddings.dtype),
+        "mb": embeddings.nbytes / 1024 / 1024,
+        "saved": 0.0,
+        "recall": 1.0,
+        "mean_ms": float(exact_latencies.mean()),
+        "p95_ms": float(np.percentile(exact_latencies, 95)),
+    }]
+
+    for mode in EMBEDDING_QUANTIZATIONS:
+        quantized = load_or_build_quantized(embeddings_path, embeddings, mode)
+        results, latencies = run(quantized)
+        rows.append({
+            "storage": mode,
+            "mb": quantized.nbytes / 1024 / 1024,
+            "saved": 1 - quantized.nbytes / embeddings.nbytes,
+            "recall": float(np.mean([recall_at_k(a, e) for a, e in zip(results, exact_results)])),
+            "mean_ms": float(latencies.mean()),
+            "p95_ms": float(np.percentile(latencies, 95)),
+        })
+
+    return rows
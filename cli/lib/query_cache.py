@@ -0,0 +1,156 @@
+import hashlib
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import numpy as np
+
+from .profiling import current_profile
+from .search_utils import CACHE_DIR, QUERY_CACHE_SIZE
+
+
+def normalize_query(text: str) -> str:
+    """Canonical form of a query for cache lookups: NFC, trimmed, single spaces.
+
+    Case is kept, cased models embed "Alien" and "alien" differently.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class QueryEmbeddingCache:
+    """Query embeddings of one model: a bounded in-process LRU in front of an optional on-disk tier.
+
+    The disk tier stores one .npy file per query under CACHE_DIR, named after a
+    hash of (model name, normalized query), so repeated queries skip the model
+    across processes too.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        capacity: int = QUERY_CACHE_SIZE,
+        disk_cache: bool = False,
+        cache_dir: str = CACHE_DIR,
+    ) -> None:
+        self.model_name = model_name
+        self.capacity = capacity
+        self.disk_cache = disk_cache
+        self.disk_dir = os.path.join(cache_dir, "query_embeddings", model_name.replace("/", "__"))
+
+        self._entries: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def __disk_path(self, query: str) -> str:
+        key = hashlib.blake2b(f"{self.model_name}\0{query}".encode("utf-8"), digest_size=16).hexdigest()
+        return os.path.join(self.disk_dir, key[:2], f"{key}.npy")
+
+    def __remember(self, query: str, embedding: np.ndarray) -> None:
+        with self._lock:
+            self._entries[query] = embedding
+            self._entries.move_to_end(query)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def __lookup(self, query: str) -> Optional[np.ndarray]:
+        """Cached embedding of a normalized query from either tier, or None on a miss."""
+        profile = current_profile()
+        with self._lock:
+            embedding = self._entries.get(query)
+            if embedding is not None:
+                self._entries.move_to_end(query)
+                self.memory_hits += 1
+                profile.count("query_cache_memory_hits")
+                return embedding
+
+        path = self.__disk_path(query) if self.disk_cache else None
+        if path is None or not os.path.exists(path):
+            with self._lock:
+                self.misses += 1
+            profile.count("query_cache_misses")
+            return None
+
+        embedding = np.load(path)
+        with self._lock:
+            self.disk_hits += 1
+        profile.count("query_cache_disk_hits")
+        return self.__cache(query, embedding, write_to_disk=False)
+
+    def __cache(self, query: str, embedding: np.ndarray, write_to_disk: bool = True) -> np.ndarray:
+        if write_to_disk and self.disk_cache:
+            # Written next to the target and swapped in, concurrent readers never see a partial file
+            path = self.__disk_path(query)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, embedding)
+            os.replace(tmp_path, path)
+
+        # Shared between callers, so it must not be modified in place
+        embedding.flags.writeable = False
+        self.__remember(query, embedding)
+        return embedding
+
+    def get_or_encode(self, encode: Callable[[str], np.ndarray], text: str) -> np.ndarray:
+        """Return the embedding of a query, calling encode(query) only on a miss in both tiers."""
+        query = normalize_query(text)
+        profile = current_profile()
+
+        with profile.stage("query_cache"):
+            embedding = self.__lookup(query)
+        if embedding is None:
+            # Includes loading the model on the first encode
+            with profile.stage("encode"):
+                vector = np.asarray(encode(query))
+            with profile.stage("query_cache"):
+                embedding = self.__cache(query, vector)
+        return embedding
+
+    def get_or_encode_many(self, encode_many: Callable[[list[str]], np.ndarray], texts: list[str]) -> np.ndarray:
+        """Return the embeddings of many queries as rows, encoding every distinct miss in one encode_many call."""
+        queries = [normalize_query(text) for text in texts]
+
+        embeddings: list[Optional[np.ndarray]] = [None] * len(queries)
+        missing: dict[str, list[int]] = {}
+        for i, query in enumerate(queries):
+            if query in missing:
+                missing[query].append(i)
+                continue
+
+            embeddings[i] = self.__lookup(query)
+            if embeddings[i] is None:
+                missing[query] = [i]
+
+        if missing:
+            with current_profile().stage("encode"):
+                vectors = encode_many(list(missing))
+            for (query, positions), vector in zip(missing.items(), vectors):
+                # A copy, a view would keep the whole batch alive in the cache
+                embedding = self.__cache(query, np.array(vector))
+                for i in positions:
+                    embeddings[i] = embedding
+
+        return np.stack(embeddings) if embeddings else np.empty((0, 0), dtype=np.float32)
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "lookups": lookups,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
+
+
+def format_query_cache_stats(stats: dict) -> str:
+    return (
+        f"Query cache: {stats['lookups']} lookups, {stats['memory_hits']} memory hits, "
+        f"{stats['disk_hits']} disk hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate)"
+    )
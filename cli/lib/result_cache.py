@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+from .profiling import current_profile
+from .query_cache import normalize_query
+from .search_utils import CACHE_DIR, RESULT_CACHE_SIZE, RESULT_CACHE_TTL, RESULT_DISK_CACHE
+
+# Caches of this process by search mode, shared by every command that searches in that mode
+_result_caches: dict[str, "ResultCache"] = {}
+_result_caches_lock = threading.Lock()
+
+
+class ResultCache:
+    """Full results of one search mode: a bounded in-process LRU with a TTL in front of an optional on-disk tier.
+
+    Entries are keyed by (mode, normalized query, limit, parameters) and tagged with
+    the version of the index they were computed from: its generation, bumped
+    whenever it changes, and the fingerprint of the documents it serves, which
+    tells apart an index rebuilt from scratch whose generation started over. An
+    entry of another version is stale and dropped on lookup. The disk tier stores
+    one JSON file per entry under CACHE_DIR.
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        capacity: int = RESULT_CACHE_SIZE,
+        ttl: Optional[float] = RESULT_CACHE_TTL,
+        disk_cache: bool = RESULT_DISK_CACHE,
+        cache_dir: str = CACHE_DIR,
+    ) -> None:
+        self.mode = mode
+        self.capacity = capacity
+        self.ttl = ttl
+        self.disk_cache = disk_cache
+        self.disk_dir = os.path.join(cache_dir, "results", mode)
+
+        # key -> ([generation, fingerprint], expiry in wall-clock seconds, results)
+        self._entries: OrderedDict[str, tuple[list, float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, query: str, limit: int, **params) -> str:
+        fields = [self.mode, normalize_query(query), limit, params]
+        return hashlib.blake2b(json.dumps(fields, sort_keys=True).encode("utf-8"), digest_size=16).hexdigest()
+
+    def __disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def __expiry(self) -> float:
+        return time.time() + self.ttl if self.ttl else float("inf")
+
+    def __remember(self, key: str, version: list, expires_at: float, results: Any) -> None:
+        with self._lock:
+            self._entries[key] = (version, expires_at, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def __read_disk(self, key: str) -> Optional[tuple[list, float, Any]]:
+        path = self.__disk_path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return entry.get("version"), entry["expires_at"] or float("inf"), entry["results"]
+
+    def __lookup(self, key: str, version: list) -> Optional[Any]:
+        """Cached results computed from this version of the index from either tier, or None on a miss."""
+        profile = current_profile()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == version and entry[1] > time.time():
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    profile.count("result_cache_memory_hits")
+                    return entry[2]
+                del self._entries[key]
+
+        entry = self.__read_disk(key) if self.disk_cache else None
+        if entry is not None and entry[0] == version and entry[1] > time.time():
+            with self._lock:
+                self.disk_hits += 1
+            profile.count("result_cache_disk_hits")
+            self.__remember(key, *entry)
+            return entry[2]
+
+        if entry is not None:
+            # Stale or expired, never served again
+            try:
+                os.remove(self.__disk_path(key))
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self.misses += 1
+        profile.count("result_cache_misses")
+        return None
+
+    def __cache(self, key: str, version: list, results: Any) -> None:
+        expires_at = self.__expiry()
+        if self.disk_cache:
+            # Written next to the target and swapped in, concurrent readers never see a partial file
+            path = self.__disk_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"version": version, "expires_at": expires_at if self.ttl else None, "results": results}, f)
+            os.replace(tmp_path, path)
+
+        self.__remember(key, version, expires_at, results)
+
+    def get_or_search(
+        self,
+        search: Callable[[], Any],
+        generation: int,
+        fingerprint: Optional[str],
+        query: str,
+        limit: int,
+        **params,
+    ) -> Any:
+        """Return the results of a query, calling search() only on a miss in both tiers.
+
+        `generation` and `fingerprint` identify the index searched. Results must be
+        JSON values and are shared between callers, so they must not be modified.
+        """
+        key = self.key(query, limit, **params)
+        version = [generation, fingerprint]
+        profile = current_profile()
+
+        with profile.stage("result_cache"):
+            results = self.__lookup(key, version)
+        if results is None:
+            results = search()
+            with profile.stage("result_cache"):
+                self.__cache(key, version, results)
+        return results
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "lookups": lookups,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
+
+
+def result_cache(mode: str, cache_dir: str = CACHE_DIR) -> ResultCache:
+    """The result cache of a search mode, created on first use and shared by the whole process."""
+    key = f"{os.path.abspath(cache_dir)}\0{mode}"
+    with _result_caches_lock:
+        if key not in _result_caches:
+            _result_caches[key] = ResultCache(mode, cache_dir=cache_dir)
+        return _result_caches[key]
+
+
+def format_result_cache_stats(stats: dict) -> str:
+    return (
+        f"Result cache: {stats['lookups']} lookups, {stats['memory_hits']} memory hits, "
+        f"{stats['disk_hits']} disk hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate)"
+    )
@@ -0,0 +1,82 @@
+import json
+import sys
+import urllib.error
+import urllib.request
+from typing import Any, Optional
+
+from .profiling import current_profile
+from .search_utils import SERVER_INFO_PATH, SERVER_TIMEOUT
+
+# Requests go straight to the local server, never through a configured HTTP proxy
+_opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+
+
+class SearchServerError(RuntimeError):
+    """The search server is running but rejected a request."""
+
+
+def server_url() -> Optional[str]:
+    """Base URL of the running search server, or None if none is running."""
+    try:
+        with open(SERVER_INFO_PATH, "r") as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return f"http://{info['host']}:{info['port']}"
+
+
+def request(path: str, payload: Optional[dict] = None, timeout: float = SERVER_TIMEOUT) -> Optional[Any]:
+    """Send a request to the search server, GET without a payload and POST with one.
+
+    Returns the decoded response, or None if no server is reachable.
+    """
+    url = server_url()
+    if url is None:
+        return None
+
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    http_request = urllib.request.Request(url + path, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with _opener.open(http_request, timeout=timeout) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        raise SearchServerError(json.load(e).get("error", str(e))) from e
+    except OSError:
+        # Nothing listening (e.g. the server was killed and left its info file) or no answer in time
+        return None
+
+
+def forward_search(mode: str, query: str, limit: int, **params) -> Optional[Any]:
+    """Run a search on the running server, in the shape the matching local command returns.
+
+    Returns None if no server is running or it failed the search, so the caller
+    searches locally. Profiled searches always run locally, where their stages can
+    be measured.
+    """
+    if current_profile():
+        return None
+
+    try:
+        response = request("/search", {"mode": mode, "query": query, "limit": limit, **params})
+    except SearchServerError as e:
+        print(f"Search server error: {e}. Searching locally.", file=sys.stderr)
+        return None
+    if response is None:
+        return None
+
+    if mode == "bm25":
+        return {doc_id: result for doc_id, result in response["results"]}
+    return response["results"]
+
+
+def server_status() -> Optional[dict]:
+    return request("/health")
+
+
+def reload_server() -> Optional[dict]:
+    """Make a running server load the indexes again. Returns its status, or None if none is running."""
+    return request("/reload", {})
+
+
+def stop_server() -> bool:
+    return request("/shutdown", {}) is not None
@@ -0,0 +1,191 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Optional
+
+from .chunked_semantic_search import ChunkedSemanticSearch
+from .doc_store import load_doc_store
+from .encode_scheduler import EncodeScheduler
+from .keyword_search import InvertedIndex
+from .search_utils import (
+    ANN_NPROBE,
+    CACHE_DIR,
+    DEFAULT_SEARCH_LIMIT,
+    SERVER_HOST,
+    SERVER_INFO_PATH,
+    SERVER_PORT
+)
+from .semantic_search import SemanticSearch
+
+SEARCH_MODES = ("keyword", "bm25", "semantic", "chunked")
+
+
+class SearchEngines:
+    """The keyword index and both embedding indexes, loaded once and shared by every request.
+
+    A reload builds a new instance and swaps it in, so in-flight requests finish
+    on the indexes they started with.
+    """
+
+    def __init__(self, model=None, encode_scheduler: Optional[EncodeScheduler] = None) -> None:
+        documents = load_doc_store()
+
+        self.keyword = InvertedIndex()
+        self.keyword.load()
+
+        # One model instance serves both embedding indexes, loaded now rather than by the first query,
+        # and one scheduler batches the query encodes of both. Both outlive reloads
+        self.semantic = SemanticSearch()
+        self.model = model = model if model is not None else self.semantic.model
+        # Bound to the model alone, a scheduler bound to an engine would keep old indexes alive
+        self.encode_scheduler = encode_scheduler or EncodeScheduler(lambda: model)
+        self.chunked = ChunkedSemanticSearch()
+
+        for engine in (self.semantic, self.chunked):
+            engine.model = self.model
+            engine.encode_scheduler = self.encode_scheduler
+            engine.load_or_create_embeddings(documents)
+
+        self.num_documents = len(documents)
+        self.loaded_at = time.time()
+
+    def search(self, mode: str, query: str, limit: int, exact: bool = False, nprobe: int = ANN_NPROBE) -> list:
+        match mode:
+            case "keyword":
+                return self.keyword.search(query, limit)
+            case "bm25":
+                # JSON object keys are strings, so the ID -> result mapping travels as pairs
+                return [[doc_id, {**result, "score": float(result["score"])}] for doc_id, result in self.keyword.bm25_search(query, limit).items()]
+            case "semantic":
+                return self.semantic.search(query, limit, exact, nprobe)
+            case "chunked":
+                return self.chunked.search_chunks(query, limit, exact, nprobe)
+            case _:
+                raise ValueError(f"Unknown search mode '{mode}', expected one of {', '.join(SEARCH_MODES)}")
+
+
+class SearchServer(ThreadingHTTPServer):
+    """Local HTTP server answering searches from indexes loaded once, one thread per request."""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = SERVER_HOST, port: int = SERVER_PORT, verbose: bool = False) -> None:
+        self.engines = SearchEngines()
+        self.verbose = verbose
+        self.requests_served = 0
+        self._reload_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        super().__init__((host, port), SearchRequestHandler)
+
+    def search(self, request: dict) -> list:
+        query = request["query"]
+        if not isinstance(query, str):
+            raise ValueError("query must be a string")
+
+        results = self.engines.search(
+            request.get("mode", "keyword"),
+            query,
+            int(request.get("limit", DEFAULT_SEARCH_LIMIT)),
+            bool(request.get("exact", False)),
+            int(request.get("nprobe", ANN_NPROBE)),
+        )
+        with self._stats_lock:
+            self.requests_served += 1
+        return results
+
+    def reload(self) -> dict:
+        """Load the indexes again, e.g. after an incremental update, keeping the loaded model."""
+        with self._reload_lock:
+            self.engines = SearchEngines(self.engines.model, self.engines.encode_scheduler)
+        return self.status()
+
+    def status(self) -> dict:
+        host, port = self.server_address[:2]
+        return {
+            "host": host,
+            "port": port,
+            "pid": os.getpid(),
+            "documents": self.engines.num_documents,
+            "loaded_at": self.engines.loaded_at,
+            "requests_served": self.requests_served,
+        }
+
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    server: SearchServer
+
+    def do_GET(self) -> None:
+        if self.path == "/health":
+            self.__send(200, self.server.status())
+        else:
+            self.__send(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self) -> None:
+        try:
+            request = self.__read_json()
+            match self.path:
+                case "/search":
+                    self.__send(200, {"results": self.server.search(request)})
+                case "/reload":
+                    self.__send(200, self.server.reload())
+                case "/shutdown":
+                    self.__send(200, {"stopping": True})
+                    # shutdown() waits for serve_forever() to return, which runs in another thread
+                    threading.Thread(target=self.server.shutdown).start()
+                case _:
+                    self.__send(404, {"error": f"Unknown path {self.path}"})
+        except (KeyError, TypeError, ValueError) as e:
+            self.__send(400, {"error": f"Bad request: {e}"})
+        except Exception as e:
+            # Report the failure instead of dropping the connection, the server keeps running
+            self.__send(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def __read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        if length == 0:
+            return {}
+
+        request = json.loads(self.rfile.read(length))
+        if not isinstance(request, dict):
+            raise ValueError("request body must be a JSON object")
+        return request
+
+    def __send(self, status: int, payload: Any) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def serve_command(host: str = SERVER_HOST, port: int = SERVER_PORT, verbose: bool = False, on_ready: Optional[Callable[[dict], None]] = None) -> None:
+    """Load the indexes and serve until stopped, advertising the address in SERVER_INFO_PATH meanwhile."""
+    server = SearchServer(host, port, verbose)
+    info = server.status()
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f"{SERVER_INFO_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"host": info["host"], "port": info["port"], "pid": info["pid"]}, f)
+    os.replace(tmp_path, SERVER_INFO_PATH)
+
+    try:
+        if on_ready is not None:
+            on_ready(info)
+        server.serve_forever()
+    finally:
+        server.server_close()
+        # Only remove the file if a newer server has not replaced it
+        try:
+            with open(SERVER_INFO_PATH, "r") as f:
+                if json.load(f).get("pid") == info["pid"]:
+                    os.remove(SERVER_INFO_PATH)
+        except (OSError, ValueError):
+            pass
@@ -1,6 +1,8 @@
 import json
 import os
 
+from .profiling import current_profile
+
 # BM25 search parameters
 
 # Saturation parameter for the term frequency
@@ -11,6 +13,15 @@ BM25_K1 = 1.5
 # b = 1 -> full length normalization
 BM25_B = 0.75
 
+# Skip documents that cannot reach the top results (MaxScore), using the largest impact
+# of every term stored in the index. Results are identical either way
+BM25_PRUNING = True
+
+# Store posting lists as blocks of variable-byte encoded row deltas and term frequencies,
+# a fraction of the size of the plain arrays, decoded a block at a time while searching
+COMPRESS_POSTINGS = False
+POSTING_BLOCK_SIZE = 128
+
 
 DEFAULT_SEARCH_LIMIT = 5
 DEFAULT_CHUNK_SIZE = 200
@@ -18,16 +29,99 @@ DEFAULT_MAX_CHUNK_SIZE = 4
 
 SCORE_PRECISION = 4
 
+# Hybrid search: weight of the BM25 score in weighted search, the k constant of
+# reciprocal rank fusion, and how many candidates per result each leg retrieves.
+# More candidates let documents ranked low by one leg still be fused, but every
+# leg gets slower and BM25 pruning and ANN probing skip less work
+HYBRID_ALPHA = 0.5
+RRF_K = 60
+HYBRID_CANDIDATE_MULTIPLIER = 10
+
+# Storage type of the cached embedding matrices
+EMBEDDING_DTYPE = "float32"
+EMBEDDING_DTYPES = ("float32", "float16")
+
+# Optional compact codes of the embedding matrices, scanned first: int8 (per-dimension scale)
+# or binary (sign bits, Hamming distance). The best RESCORE_MULTIPLIER candidates per
+# requested result are then rescored with the memory-mapped stored vectors
+EMBEDDING_QUANTIZATIONS = ("int8", "binary")
+RESCORE_MULTIPLIER = 10
+
+# Embedding rows upcast at a time when scoring a float16 matrix
+SCORE_BLOCK_SIZE = 16384
+
+# Queries read and answered together by the batch commands, and the largest
+# (queries x rows) score matrix they compute in one matrix product
+DEFAULT_QUERY_BATCH_SIZE = 256
+BATCH_SCORE_ELEMENTS = 1 << 25
+
+# Query embeddings kept in memory per process, and whether they are also cached on disk across processes
+QUERY_CACHE_SIZE = 1024
+QUERY_DISK_CACHE = True
+
+# Full search results kept in memory per process and search mode, for at most RESULT_CACHE_TTL
+# seconds (None keeps them until the index changes), and whether they are also cached on disk
+RESULT_CACHE_SIZE = 256
+RESULT_CACHE_TTL = 3600
+RESULT_DISK_CACHE = True
+
+# Concurrent query encodes are coalesced into batches of up to ENCODE_MAX_BATCH texts,
+# waiting at most ENCODE_MAX_WAIT_MS for more texts to join a batch
+ENCODE_MAX_BATCH = 32
+ENCODE_MAX_WAIT_MS = 1.0
+
+# Approximate nearest-neighbour (IVF) search: smaller embedding matrices are always scanned exactly
+ANN_MIN_ROWS = 10000
+# Lists scanned per query, higher is slower but closer to the exact results
+ANN_NPROBE = 16
+ANN_KMEANS_ITERATIONS = 10
+ANN_TRAINING_POINTS_PER_LIST = 64
+
+# Document ID marking deleted or replaced rows until they are compacted away
+TOMBSTONE_ID = -1
+
+# Documents per task of the parallel index build
+DEFAULT_BUILD_BATCH_SIZE = 1000
+
+# Chunk embedding builds stream fixed-size batches of chunks from a chunking thread
+# (or EMBED_CHUNK_WORKERS worker processes) to the encoder, with at most
+# EMBED_QUEUE_BATCHES batches waiting between them
+EMBED_BATCH_SIZE = 256
+EMBED_CHUNK_WORKERS = 1
+EMBED_QUEUE_BATCHES = 4
+
+# Sharded indexes split the documents by ID, every shard is searched by a worker process of its own
+DEFAULT_NUM_SHARDS = 4
+
+# Maximum number of memoized word -> stem entries per tokenizer
+STEM_CACHE_SIZE = 65536
+
+# Search server, only reachable from this machine
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
+# Seconds a CLI waits on the server before searching locally instead
+SERVER_TIMEOUT = 30
+
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
 DATA_PATH = os.path.join(PROJECT_ROOT, "data", "movies.json")
 STOP_WORDS_PATH = os.path.join(PROJECT_ROOT, "data", "stopwords.txt")
 CACHE_DIR = os.path.join(PROJECT_ROOT, "cache")
+SHARDS_DIR = os.path.join(CACHE_DIR, "shards")
+# Address of the running search server, present only while it runs
+SERVER_INFO_PATH = os.path.join(CACHE_DIR, "server.json")
 
 def load_movies() -> list[dict]:
-    with open(DATA_PATH, "r") as f:
+    with current_profile().stage("load_movies"), open(DATA_PATH, "r") as f:
         data = json.load(f)
     return data.get("movies", [])
 
+def save_movies(movies: list[dict]) -> None:
+    """Atomically replace the movies dataset."""
+    tmp_path = f"{DATA_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"movies": movies}, f, indent=2)
+    os.replace(tmp_path, DATA_PATH)
+
 def load_stop_words() -> list[str]:
     """Load stop words from file and return as a list of strings."""
     with open(STOP_WORDS_PATH, "r", encoding="utf-8") as f:
@@ -1,114 +1,575 @@
+import json
 import os
-import re
-from unittest import result
+import threading
+import time
 import numpy as np
 
-from typing import Any
-from sentence_transformers import SentenceTransformer
-
+from collections import Counter
+from itertools import batched
+from typing import Any, Callable, Iterable, Optional
+
+from lib.ann_index import IVFIndex
+from lib.batch_search import stream_batch_results
+from lib.doc_store import doc_store_fingerprint, document_map, load_doc_store
+from lib.embedding_pipeline import CheckpointedEmbeddings, build_fingerprint
+from lib.embedding_store import EmbeddingStore, format_store_stats, text_keys
+from lib.encode_scheduler import EncodeScheduler
+from lib.index_format import append_rows, save_array
+from lib.profiling import current_profile
+from lib.quantization import QuantizedEmbeddings, load_or_build_quantized, remove_quantized
+from lib.query_cache import QueryEmbeddingCache, format_query_cache_stats
+from lib.result_cache import format_result_cache_stats, result_cache
 from lib.search_utils import (
+    ANN_MIN_ROWS,
+    ANN_NPROBE,
+    BATCH_SCORE_ELEMENTS,
     CACHE_DIR, 
-    load_movies
+    DEFAULT_QUERY_BATCH_SIZE,
+    EMBED_BATCH_SIZE,
+    EMBEDDING_DTYPE,
+    EMBEDDING_DTYPES,
+    EMBEDDING_QUANTIZATIONS,
+    QUERY_DISK_CACHE,
+    RESCORE_MULTIPLIER,
+    SCORE_BLOCK_SIZE,
+    TOMBSTONE_ID
 )
+from lib.text_chunking import chunk_text_command, semantic_chunk_command, validate_search_inputs
 
 class SemanticSearch:
-    def __init__(self, model_name="all-MiniLM-L6-v2"):
-        self.model = SentenceTransformer(model_name)
+    def __init__(
+        self,
+        model_name="all-MiniLM-L6-v2",
+        embedding_dtype: Optional[str] = None,
+        query_disk_cache: bool = QUERY_DISK_CACHE,
+        cache_dir: str = CACHE_DIR,
+        quantization: Optional[str] = None,
+        encode_batch_size: int = EMBED_BATCH_SIZE,
+    ):
+        if embedding_dtype is not None and embedding_dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"Unsupported embedding dtype '{embedding_dtype}', expected one of {', '.join(EMBEDDING_DTYPES)}")
+        if quantization is not None and quantization not in EMBEDDING_QUANTIZATIONS:
+            raise ValueError(f"Unsupported quantization '{quantization}', expected one of {', '.join(EMBEDDING_QUANTIZATIONS)}")
+
+        # Loaded on first encode, commands that never encode skip the model import and load
+        self._model = None
+        self._model_lock = threading.Lock()
+        self.model_name = model_name
+
+        # Embeddings are stored L2-normalized, so cosine similarity is a dot product. Unless a
+        # dtype is given, cached embeddings keep theirs and new ones use EMBEDDING_DTYPE
+        self.embedding_dtype = np.dtype(embedding_dtype) if embedding_dtype else None
         self.embeddings = None
         self.documents = None
         self.document_map = {}
 
-        self.embeddings_path = os.path.join(CACHE_DIR, "movie_embeddings.npy")
+        # Maps embedding rows -> document IDs (TOMBSTONE_ID for deleted or replaced documents)
+        self.embedding_ids = None
 
-    def build_embeddings(self, documents: list[dict]) -> list[Any]:
-        self.documents = documents
+        # Content key of the text each row was encoded from, to detect edited documents
+        self.embedding_keys = None
+
+        # Bumped on disk every time the cached embeddings change, results cached from another generation are stale
+        self.embeddings_generation = 0
+
+        # Embeddings of every text encoded so far, so rebuilds only encode new or changed texts
+        self.embedding_store = EmbeddingStore(model_name, cache_dir)
+
+        # Texts encoded per batch by builds, and the rows and seconds per stage of the last build
+        self.encode_batch_size = encode_batch_size
+        self.last_build_stats: Optional[dict] = None
+
+        # Batches query encodes from concurrent callers into one model call
+        self.encode_scheduler = EncodeScheduler(self.load_model)
+
+        # Embeddings of recent queries, repeated queries skip the model
+        self.query_cache = QueryEmbeddingCache(model_name, disk_cache=query_disk_cache, cache_dir=cache_dir)
 
-        movies_to_embed = []
-        for doc in documents:
-            self.document_map[doc['id']] = doc
-            movies_to_embed.append(f"{doc['title']}: {doc['description']}")
+        # Approximate nearest-neighbour index, None for matrices small enough to always scan
+        self.ann_index: Optional[IVFIndex] = None
 
-        self.embeddings = self.model.encode(movies_to_embed, show_progress_bar=True)
+        # Compact codes scanned before rescoring with the memory-mapped embeddings, None to scan the embeddings
+        self.quantization = quantization
+        self.quantized: Optional[QuantizedEmbeddings] = None
+
+        self.cache_dir = cache_dir
+        self.embeddings_path = os.path.join(cache_dir, "movie_embeddings.npy")
+        self.embedding_ids_path = os.path.join(cache_dir, "movie_embedding_ids.npy")
+        self.embedding_keys_path = os.path.join(cache_dir, "movie_embedding_keys.npy")
+        self.embeddings_info_path = os.path.join(cache_dir, "movie_embeddings.json")
+        self.ann_index_path = os.path.join(cache_dir, "movie_ivf.npz")
+
+    @property
+    def model(self):
+        return self.load_model()
+
+    @model.setter
+    def model(self, model) -> None:
+        # Lets engines in one process share a loaded model
+        self._model = model
+
+    def load_model(self):
+        """The sentence transformer, constructed on first use."""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+
+                    self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    def build_embeddings(self, documents: list[dict]) -> list[Any]:
+        self.documents = documents
 
-        # Save embeddings to a file
-        np.save(self.embeddings_path, self.embeddings)
+        self.document_map = document_map(documents)
+        movies_to_embed = [embedding_text(doc) for doc in documents]
+
+        self.embedding_ids = np.array([doc['id'] for doc in documents], dtype=np.int64)
+        self.embedding_keys = text_keys(self.model_name, movies_to_embed)
+        dtype = self.embedding_dtype or EMBEDDING_DTYPE
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Written and checkpointed a batch at a time, an interrupted build of the same texts resumes after its last batch
+        start_time = time.perf_counter()
+        output = CheckpointedEmbeddings(
+            self.embeddings_path, len(documents), dtype, build_fingerprint(self.embedding_ids, self.embedding_keys)
+        )
+        resumed = output.rows_done
+        batches = (list(batch) for batch in batched(movies_to_embed[resumed:], self.encode_batch_size))
+        timings = encode_into(self.embedding_store, self.load_model, batches, output, dtype)
+        self.embeddings = output.finish()
+        self.last_build_stats = {**timings, "seconds": time.perf_counter() - start_time, "resumed": resumed}
+
+        # The row IDs are written last
+        save_array(self.embedding_keys_path, self.embedding_keys)
+        save_array(self.embedding_ids_path, self.embedding_ids)
+        self.__save_embeddings_info(doc_store_fingerprint(documents))
+        self.ann_index = load_or_build_ann_index(self.ann_index_path, self.embeddings, rebuild=True)
+        remove_quantized(self.embeddings_path)
+        if self.quantization is not None:
+            self.quantized = load_or_build_quantized(self.embeddings_path, self.embeddings, self.quantization)
 
         return self.embeddings
 
+    def __load_embeddings_info(self) -> dict:
+        """Model and layout of the cached embeddings, empty for caches written by older versions."""
+        if not os.path.exists(self.embeddings_info_path):
+            return {}
+
+        with open(self.embeddings_info_path, 'r') as f:
+            return json.load(f)
+
+    def __save_embeddings_info(self, documents_fingerprint: Optional[str] = None) -> None:
+        """Record the model and layout of the cached embeddings, and the doc store version their rows match.
+
+        Every call starts a new generation of the embeddings.
+        """
+        self.embeddings_generation = self.__load_embeddings_info().get("generation", 0) + 1
+        info = {"model": self.model_name, "normalized": True, "generation": self.embeddings_generation}
+        if documents_fingerprint is not None:
+            info["documents"] = documents_fingerprint
+        tmp_path = f"{self.embeddings_info_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(info, f)
+        os.replace(tmp_path, self.embeddings_info_path)
+
+    def __normalize_cached_embeddings(self) -> None:
+        """Rewrite cached raw embeddings (older versions) or embeddings stored in another dtype.
+
+        Normalizing and casting the stored vectors is enough, nothing is re-encoded.
+        """
+        embeddings = np.load(self.embeddings_path, 'r')
+        dtype = self.embedding_dtype or embeddings.dtype
+        if self.__load_embeddings_info().get("normalized") and embeddings.dtype == dtype:
+            return
+
+        save_array(self.embeddings_path, normalize_embeddings(embeddings, dtype))
+        self.__save_embeddings_info()
+
+    def __load_cached_embeddings(self, documents: list[dict]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Memory-map the cached embeddings and load the document ID and content key of each row."""
+        self.__normalize_cached_embeddings()
+        embeddings = np.load(self.embeddings_path, 'r')
+
+        if os.path.exists(self.embedding_ids_path):
+            embedding_ids = np.load(self.embedding_ids_path)
+        elif len(embeddings) == len(documents):
+            # Caches written before row IDs existed follow the document order
+            embedding_ids = np.array([doc['id'] for doc in documents], dtype=np.int64)
+        else:
+            embedding_ids = np.full(len(embeddings), TOMBSTONE_ID, dtype=np.int64)
+
+        if len(embedding_ids) > len(embeddings):
+            # Interrupted write, treat every row as stale
+            embedding_ids = np.full(len(embeddings), TOMBSTONE_ID, dtype=np.int64)
+
+        if os.path.exists(self.embedding_keys_path):
+            embedding_keys = np.load(self.embedding_keys_path)[:len(embedding_ids)]
+            # Rows whose key was not written never match a document
+            embedding_keys = np.pad(embedding_keys, (0, len(embedding_ids) - len(embedding_keys)))
+        else:
+            # Caches written before content keys existed are assumed to match the documents
+            documents_keys = dict(zip(
+                (doc['id'] for doc in documents),
+                text_keys(self.model_name, [embedding_text(doc) for doc in documents]).tolist(),
+            ))
+            embedding_keys = np.array([documents_keys.get(doc_id, 0) for doc_id in embedding_ids.tolist()], dtype=np.uint64)
+            save_array(self.embedding_keys_path, embedding_keys)
+
+        # Rows appended after the IDs were last written are not published yet
+        return embeddings[:len(embedding_ids)], embedding_ids, embedding_keys
+
     def generate_embedding(self, text: str):
         text = text.strip()
 
         if text == "":
             raise ValueError("Text cannot be empty.")
 
-        embedding = self.model.encode([text])[0]
+        embedding = self.query_cache.get_or_encode(self.encode_scheduler.encode, text)
 
         return embedding
 
+    def generate_embeddings(self, texts: list[str]) -> np.ndarray:
+        """Embeddings of many queries, with every cache miss encoded in one model call."""
+        texts = [text.strip() for text in texts]
+        if any(text == "" for text in texts):
+            raise ValueError("Text cannot be empty.")
+
+        return self.query_cache.get_or_encode_many(lambda misses: self.load_model().encode(misses), texts)
+
     def load_or_create_embeddings(self, documents: list[dict]) -> list[Any]:
         self.documents = documents
-        self.document_map = {doc['id']: doc for doc in documents}
-
-        # If embeddings are cached, load and return them
-        if os.path.exists(self.embeddings_path):
-            self.embeddings = np.load(self.embeddings_path, 'r')
-            if len(self.embeddings) == len(documents):
+        self.document_map = document_map(documents)
+
+        # If embeddings of this model are cached and match the current text of exactly these
+        # documents, load and return them
+        profile = current_profile()
+        info = self.__load_embeddings_info()
+        self.embeddings_generation = info.get("generation", 0)
+        cached_model = info.get("model", self.model_name)
+        if os.path.exists(self.embeddings_path) and cached_model == self.model_name:
+            with profile.stage("load_embeddings"):
+                self.embeddings, self.embedding_ids, self.embedding_keys = self.__load_cached_embeddings(documents)
+
+            with profile.stage("check_embeddings"):
+                # Rows known to match this doc store version are not compared text by text
+                fingerprint = doc_store_fingerprint(documents)
+                up_to_date = fingerprint is not None and info.get("documents") == fingerprint
+                if not up_to_date:
+                    documents_keys = text_keys(self.model_name, [embedding_text(doc) for doc in documents])
+                    up_to_date = rows_match_documents(self.embedding_ids, self.embedding_keys, [doc['id'] for doc in documents], documents_keys)
+                    if up_to_date and fingerprint is not None:
+                        self.__save_embeddings_info(fingerprint)
+
+            if up_to_date:
+                with profile.stage("load_ann_index"):
+                    self.ann_index = load_or_build_ann_index(self.ann_index_path, self.embeddings)
+                if self.quantization is not None:
+                    with profile.stage("load_quantized"):
+                        self.quantized = load_or_build_quantized(self.embeddings_path, self.embeddings, self.quantization)
                 return self.embeddings
 
-        # Build embeddings for the given documents and cache them
+            # Rows of unchanged texts are reused by the rebuild
+            if self.embeddings.dtype == np.float32:
+                live = (self.embedding_ids != TOMBSTONE_ID) & (self.embedding_keys != 0)
+                self.embedding_store.add(self.embedding_keys[live], self.embeddings[live])
+
+        # Build embeddings for the given documents and cache them, only new or changed texts are encoded
         return self.build_embeddings(documents)
 
-    def search(self, query: str, limit: int) -> list[dict]:
+    def search(self, query: str, limit: int, exact: bool = False, nprobe: int = ANN_NPROBE) -> list[dict]:
         # Check if embeddings are loaded
         if self.embeddings is None:
             raise ValueError("No embeddings loaded. Call `load_or_create_embeddings` first.")
 
         # Generate embedding for given query
-        query_embedding = self.generate_embedding(text=query)
-
-        # Calculate cosine similarity between query embedding and each document embedding
-        scores = []
-        for i, embedding in enumerate(self.embeddings):
-            similarity_score = cosine_similarity(query_embedding, embedding)
-            scores.append((similarity_score, self.documents[i]))
-
-        # Sort by similarity score
-        scores.sort(key=lambda x:x[0], reverse=True)
-
-        return [
-            {"title": doc['title'], "description": doc['description'], "score": score} 
-            for score, doc in scores[:limit]
-        ]
-
-
-def validate_search_inputs(chunk_size: int, overlap: int) -> None:
-    # Validate inputs
-    if chunk_size <= 0:
-        raise ValueError("chunk_size must be greater than 0")
-    
-    if overlap < 0:
-        raise ValueError("overlap cannot be negative")
-    
-    if overlap >= chunk_size:
-        raise ValueError(f"overlap ({overlap}) must be less than chunk_size ({chunk_size})")
-
-
-def chunk_text_command(text: str, chunk_size: int, overlap: int) -> list[str]:
-    validate_search_inputs(chunk_size, overlap)
-    
-    words = text.split()
-    chunks = []
-    
-    # Calculate step size: when overlap > 0, each chunk should overlap by 'overlap' words
-    step_size = chunk_size - overlap if overlap > 0 else chunk_size
-    
-    # Create chunks with proper overlap
-    for i in range(0, len(words), step_size):
-        chunk = " ".join(words[i:i + chunk_size])
-        if chunk:
-            chunks.append(chunk)
-    
-    return chunks
+        query_embedding = normalize_embeddings(self.generate_embedding(text=query))
+
+        return self.search_by_embedding(query_embedding, limit, exact, nprobe)
+
+    def search_by_embedding(
+        self,
+        query_embedding: np.ndarray,
+        limit: int,
+        exact: bool = False,
+        nprobe: int = ANN_NPROBE,
+    ) -> list[dict]:
+        """Search with an already normalized query embedding."""
+        # Score the rows of the probed IVF lists, or every row for an exact search
+        scores, rows = scan_embeddings(
+            self.embeddings, query_embedding, self.ann_index, exact, nprobe, self.quantized, limit * RESCORE_MULTIPLIER
+        )
+
+        with current_profile().stage("top_k"):
+            return self.__top_documents(scores, rows, limit)
+
+    def search_batch(self, queries: list[str], limit: int, exact: bool = False, nprobe: int = ANN_NPROBE) -> list[list[dict]]:
+        """Results of many queries, encoded in one batch and, when every row is scanned, scored with matrix products."""
+        if self.embeddings is None:
+            raise ValueError("No embeddings loaded. Call `load_or_create_embeddings` first.")
+
+        query_embeddings = normalize_embeddings(self.generate_embeddings(queries))
+        if (not exact and self.ann_index is not None) or self.quantized is not None:
+            # Every query probes its own lists or rescores its own candidates, so they are scored one at a time
+            return [self.search_by_embedding(query_embedding, limit, exact, nprobe) for query_embedding in query_embeddings]
+
+        rows = np.arange(len(self.embeddings))
+        results = []
+        for batch in score_batches(len(self.embeddings), len(queries)):
+            scores = score_embeddings(self.embeddings, query_embeddings[batch])
+            results.extend(self.__top_documents(query_scores, rows, limit) for query_scores in scores)
+        return results
+
+    def __top_documents(self, scores: np.ndarray, rows: np.ndarray, limit: int) -> list[dict]:
+        # Rows of deleted or replaced documents never match
+        scores[self.embedding_ids[rows] == TOMBSTONE_ID] = -np.inf
+
+        results = []
+        for i in top_k_indices(scores, limit):
+            if scores[i] == -np.inf:
+                break
+            doc = self.document_map[int(self.embedding_ids[rows[i]])]
+            results.append({"id": doc['id'], "title": doc['title'], "description": doc['description'], "score": float(scores[i])})
+
+        return results
+
+    def apply_delta(self, previous_documents: list[dict], upserts: list[dict], deletes: list[int]) -> Optional[dict]:
+        """Encode only added or changed documents and append them to the cached embeddings in place.
+
+        Rows of replaced or deleted documents are tombstoned until compact() drops them.
+        Returns None if there are no cached embeddings to update.
+        """
+        if not os.path.exists(self.embeddings_path):
+            return None
+
+        embeddings, embedding_ids, embedding_keys = self.__load_cached_embeddings(previous_documents)
+        # Rows are about to change, they no longer match any doc store version
+        self.__save_embeddings_info()
+        if len(embeddings) != len(np.load(self.embeddings_path, 'r')):
+            # Drop unpublished rows so appended rows line up with their IDs
+            save_array(self.embeddings_path, np.array(embeddings))
+
+        upserts_by_id = {doc['id']: doc for doc in upserts}
+        removed = np.isin(embedding_ids, list(set(deletes) | set(upserts_by_id)))
+        embedding_ids = np.where(removed, TOMBSTONE_ID, embedding_ids)
+
+        if upserts_by_id:
+            texts = [embedding_text(doc) for doc in upserts_by_id.values()]
+            vectors = self.embedding_store.encode(self.load_model, texts, show_progress_bar=True)
+            append_rows(self.embeddings_path, normalize_embeddings(vectors))
+            embedding_ids = np.concatenate([embedding_ids, list(upserts_by_id)]).astype(np.int64)
+            embedding_keys = np.concatenate([embedding_keys, text_keys(self.model_name, texts)])
+
+        # Publishing the IDs makes the appended rows and the tombstones visible
+        save_array(self.embedding_keys_path, embedding_keys)
+        save_array(self.embedding_ids_path, embedding_ids)
+        self.__save_embeddings_info()
+
+        return {"encoded": len(upserts_by_id), "tombstoned": int(removed.sum())}
+
+    def compact(self) -> bool:
+        """Drop tombstoned rows from the cached embeddings. Returns False if there was nothing to drop."""
+        if not os.path.exists(self.embeddings_path) or not os.path.exists(self.embedding_ids_path):
+            return False
+
+        embeddings = np.load(self.embeddings_path, 'r')
+        embedding_ids = np.load(self.embedding_ids_path)
+        live = embedding_ids != TOMBSTONE_ID
+        if live.all() and len(embeddings) == len(embedding_ids):
+            return False
+
+        save_array(self.embeddings_path, embeddings[:len(embedding_ids)][live])
+        if os.path.exists(self.embedding_keys_path):
+            embedding_keys = np.load(self.embedding_keys_path)[:len(embedding_ids)]
+            embedding_keys = np.pad(embedding_keys, (0, len(embedding_ids) - len(embedding_keys)))
+            save_array(self.embedding_keys_path, embedding_keys[live])
+        save_array(self.embedding_ids_path, embedding_ids[live])
+        self.__save_embeddings_info()
+
+        # Rows moved, the ANN index and the quantized codes are rebuilt on the next load
+        if os.path.exists(self.ann_index_path):
+            os.remove(self.ann_index_path)
+        remove_quantized(self.embeddings_path)
+        return True
+
+
+def embedding_text(doc: dict) -> str:
+    return f"{doc['title']}: {doc['description']}"
+
+
+def rows_match_documents(row_ids: np.ndarray, row_keys: np.ndarray, doc_ids, doc_keys: np.ndarray) -> bool:
+    """Whether the live rows cover exactly the given documents, each encoded from its current content.
+
+    A document may own several rows (chunks), all of them carrying its key.
+    """
+    live = row_ids != TOMBSTONE_ID
+    row_ids, row_keys = row_ids[live], row_keys[live]
+
+    doc_ids = np.asarray(doc_ids, dtype=np.int64)
+    order = np.argsort(doc_ids)
+    sorted_ids = doc_ids[order]
+    if not np.array_equal(np.unique(row_ids), sorted_ids):
+        return False
+
+    positions = np.searchsorted(sorted_ids, row_ids)
+    return np.array_equal(row_keys, np.asarray(doc_keys)[order][positions])
+
+
+def normalize_embeddings(embeddings, dtype=np.float32) -> np.ndarray:
+    """L2-normalize embeddings (one per row) so cosine similarity becomes a dot product."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+
+    # Zero vectors stay zero and score 0, like in cosine_similarity
+    return (embeddings / np.where(norms == 0, 1, norms)).astype(dtype)
+
+
+def encode_into(
+    store: EmbeddingStore,
+    load_model: Callable[[], Any],
+    text_batches: Iterable[list[str]],
+    output: CheckpointedEmbeddings,
+    dtype,
+) -> dict:
+    """Encode batches of texts through the embedding store and write their normalized embeddings to output.
+
+    The store publishes the keys of new texts once, after the last batch, and its
+    last_stats then cover every batch. Returns the seconds spent encoding and writing.
+    """
+    store_stats: Counter = Counter()
+    timings = {"encode_seconds": 0.0, "write_seconds": 0.0}
+    for texts in text_batches:
+        start = time.perf_counter()
+        vectors = normalize_embeddings(store.encode(load_model, texts, publish=False), dtype)
+        store_stats.update(store.last_stats)
+        encoded = time.perf_counter()
+        output.write(vectors)
+        timings["encode_seconds"] += encoded - start
+        timings["write_seconds"] += time.perf_counter() - encoded
+
+    store.publish()
+    store.last_stats = dict(store_stats) if store_stats else None
+    return timings
+
+
+def load_or_build_ann_index(path: str, embeddings: np.ndarray, rebuild: bool = False) -> Optional[IVFIndex]:
+    """Load the ANN index of an embedding matrix, building it first if it is missing or stale.
+
+    Returns None for matrices below ANN_MIN_ROWS, which are always scanned exactly.
+    """
+    if len(embeddings) < ANN_MIN_ROWS:
+        return None
+
+    ann_index = None if rebuild else IVFIndex.load(path)
+    if ann_index is None or not ann_index.is_valid_for(len(embeddings)):
+        ann_index = IVFIndex.build(embeddings)
+        ann_index.save(path)
+    return ann_index
+
+
+def scan_embeddings(
+    embeddings: np.ndarray,
+    query_embedding: np.ndarray,
+    ann_index: Optional[IVFIndex],
+    exact: bool = False,
+    nprobe: int = ANN_NPROBE,
+    quantized: Optional[QuantizedEmbeddings] = None,
+    num_candidates: int = 0,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Score the rows of the IVF lists probed for the query, or every row for an exact search or without an index.
+
+    With quantized codes, the codes of those rows are scanned instead and only the
+    best `num_candidates` rows are rescored with the embeddings, so just these rows
+    of a memory-mapped matrix are read.
+    """
+    profile = current_profile()
+
+    rows = None
+    if not exact and ann_index is not None:
+        with profile.stage("ann_probe"):
+            rows = ann_index.candidates(query_embedding, nprobe, len(embeddings))
+
+    if quantized is None:
+        with profile.stage("scan"):
+            scores, rows = score_rows(embeddings, query_embedding, rows)
+        profile.count("vectors_scored", len(rows))
+        return scores, rows
+
+    with profile.stage("scan_codes"):
+        code_scores = quantized.score(query_embedding, rows)
+        candidates = top_k_indices(code_scores, num_candidates)
+        # Sorted rows read the memory-mapped matrix front to back
+        rows = np.sort(candidates if rows is None else rows[candidates])
+    profile.count("codes_scored", len(code_scores))
+
+    with profile.stage("rescore"):
+        scores, rows = score_rows(embeddings, query_embedding, rows)
+    profile.count("vectors_scored", len(rows))
+    return scores, rows
+
+
+def score_rows(
+    embeddings: np.ndarray,
+    query_embedding: np.ndarray,
+    rows: Optional[np.ndarray] = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Score the given rows (all rows if None) against the query, returning (scores, rows)."""
+    if rows is None:
+        return score_embeddings(embeddings, query_embedding), np.arange(len(embeddings))
+    return score_embeddings(embeddings[rows], query_embedding), rows
+
+
+def score_embeddings(embeddings: np.ndarray, query_embedding: np.ndarray) -> np.ndarray:
+    """Dot product of every embedding row with the query embedding, computed in float32.
+
+    A (num_queries, dim) matrix of queries is scored with one matrix product and
+    gives one row of scores per query.
+    """
+    query_embedding = np.asarray(query_embedding, dtype=np.float32)
+    if query_embedding.ndim == 2:
+        return score_embeddings_matrix(embeddings, query_embedding)
+
+    if embeddings.dtype == np.float32:
+        return embeddings @ query_embedding
+
+    # Upcast a block at a time instead of copying the whole matrix
+    scores = np.empty(len(embeddings), dtype=np.float32)
+    for start in range(0, len(embeddings), SCORE_BLOCK_SIZE):
+        block = embeddings[start:start + SCORE_BLOCK_SIZE]
+        scores[start:start + len(block)] = block.astype(np.float32) @ query_embedding
+    return scores
+
+
+def score_embeddings_matrix(embeddings: np.ndarray, query_embeddings: np.ndarray) -> np.ndarray:
+    if embeddings.dtype == np.float32:
+        return query_embeddings @ embeddings.T
+
+    scores = np.empty((len(query_embeddings), len(embeddings)), dtype=np.float32)
+    for start in range(0, len(embeddings), SCORE_BLOCK_SIZE):
+        block = embeddings[start:start + SCORE_BLOCK_SIZE]
+        scores[:, start:start + len(block)] = query_embeddings @ block.astype(np.float32).T
+    return scores
+
+
+def score_batches(num_rows: int, num_queries: int) -> list[slice]:
+    """Slices of the queries to score per matrix product, so a score matrix never exceeds BATCH_SCORE_ELEMENTS."""
+    step = max(1, BATCH_SCORE_ELEMENTS // max(1, num_rows))
+    return [slice(start, start + step) for start in range(0, num_queries, step)]
+
+
+def top_k_indices(scores: np.ndarray, limit: int) -> np.ndarray:
+    """Indices of the `limit` highest scores, sorted by score (descending) and then by index."""
+    if limit <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    candidates = np.arange(len(scores))
+    if len(scores) > limit:
+        # Keep everything tied with the k-th best score so ties are broken deterministically
+        kth = np.argpartition(-scores, limit - 1)[limit - 1]
+        candidates = np.flatnonzero(scores >= scores[kth])
+
+    order = np.lexsort((candidates, -scores[candidates]))[:limit]
+    return candidates[order]
 
 
 def cosine_similarity(vec1, vec2):
@@ -139,58 +600,71 @@ def embed_text_command(text: str):
     print(f"Dimensions: {embedding.shape[0]}")
 
 
-def search_command(query: str, limit: int) -> list[dict]:
-    search = SemanticSearch()
-    docs = load_movies()
-    search.load_or_create_embeddings(docs)
-
-    return search.search(query, limit)
-
+def search_command(
+    query: str,
+    limit: int,
+    embedding_dtype: Optional[str] = None,
+    exact: bool = False,
+    nprobe: int = ANN_NPROBE,
+    show_cache_stats: bool = False,
+    quantization: Optional[str] = None,
+) -> list[dict]:
+    search = SemanticSearch(embedding_dtype=embedding_dtype, quantization=quantization)
+    search.load_or_create_embeddings(load_doc_store())
+
+    cache = result_cache("semantic")
+    results = cache.get_or_search(
+        lambda: search.search(query, limit, exact, nprobe),
+        search.embeddings_generation,
+        doc_store_fingerprint(search.documents),
+        query,
+        limit,
+        model=search.model_name,
+        dtype=str(search.embeddings.dtype),
+        exact=exact,
+        nprobe=nprobe,
+        quantization=quantization,
+    )
+    if show_cache_stats:
+        print(format_query_cache_stats(search.query_cache.stats()))
+        print(format_result_cache_stats(cache.stats()))
+
+    return results
+
+
+def batch_search_command(
+    queries_path: str,
+    limit: int,
+    exact: bool = False,
+    nprobe: int = ANN_NPROBE,
+    output_path: str = "-",
+    batch_size: int = DEFAULT_QUERY_BATCH_SIZE,
+    quantization: Optional[str] = None,
+) -> dict:
+    """Search every query of a file against the loaded embeddings, streaming JSONL results."""
+    search = SemanticSearch(quantization=quantization)
+    search.load_or_create_embeddings(load_doc_store())
+
+    return stream_batch_results(
+        lambda queries: search.search_batch(queries, limit, exact, nprobe),
+        queries_path,
+        output_path,
+        batch_size,
+    )
 
-def semantic_chunk_command(text: str, max_chunk_size: int, overlap: int) -> list[str]:
-    validate_search_inputs(max_chunk_size, overlap)
-    
-    text = text.strip()
-    if not text:
-        return []
 
-    # Split text into individual sentences
-    sentences = re.split(
-        pattern=r"(?<=[.!?])\s+",
-        string=text
-    )
-    
-    # Strip whitespace from each sentence
-    sentences = [sentence for sentence in sentences if sentence.strip()]
-    
-    # Filter out empty sentences
-    sentences = [sentence for sentence in sentences if sentence]
-    
-    # After splitting sentences, if there's only one sentence and it doesn't end with 
-    # punctuation mark like ., !, or ?, treat the whole text as one sentence
-    if len(sentences) == 1 and not sentences[0].endswith(('.', '!', '?')):
-        sentences = [text.strip()]
-
-    # Calculate step size: when overlap > 0, each chunk should overlap by 'overlap' sentences
-    step_size = max_chunk_size - overlap if overlap > 0 else max_chunk_size
-    chunks = []
-    
-    # Create chunks with proper overlap
-    for i in range(0, len(sentences), step_size):
-        chunk = " ".join(sentences[i:i + max_chunk_size]).strip()
-        if chunk:
-            chunks.append(chunk)
-    
-    return chunks
-
-
-def verify_embeddings_command():
-    search = SemanticSearch()
-    documents = load_movies()
+def verify_embeddings_command(embedding_dtype: Optional[str] = None):
+    search = SemanticSearch(embedding_dtype=embedding_dtype)
+    documents = load_doc_store()
     embeddings = search.load_or_create_embeddings(documents)
 
     print(f"Number of docs: {len(documents)}")
     print(f"Embeddings shape: {embeddings.shape[0]} vectors in {embeddings.shape[1]} dimensions")
+    print(f"Embeddings dtype: {embeddings.dtype} ({embeddings.nbytes / 1024 / 1024:.1f} MB)")
+    if search.last_build_stats is not None and search.last_build_stats["resumed"]:
+        print(f"Resumed an interrupted build after {search.last_build_stats['resumed']} embeddings")
+    if search.embedding_store.last_stats is not None:
+        print(format_store_stats(search.embedding_store.last_stats))
 
 
 def verify_model_command():
@@ -0,0 +1,283 @@
+import json
+import os
+import shutil
+import time
+from typing import Any, Optional, Union
+
+from .chunked_semantic_search import ChunkedSemanticSearch
+from .doc_store import DocStore, load_doc_store
+from .embedding_store import EmbeddingStore
+from .keyword_search import InvertedIndex, use_shared_statistics
+from .profiling import current_profile
+from .search_utils import (
+    ANN_NPROBE,
+    CACHE_DIR,
+    DEFAULT_NUM_SHARDS,
+    DEFAULT_SEARCH_LIMIT,
+    SHARDS_DIR
+)
+from .semantic_search import SemanticSearch, normalize_embeddings
+
+SHARDS_MANIFEST = "shards.json"
+SHARD_PREFIX = "shard-"
+SHARD_SEARCH_MODES = ("bm25", "semantic", "chunked")
+
+# Directory of the shard served by this worker process, and its engines once loaded
+_worker_shard_dir: Optional[str] = None
+_worker_shard: Optional["Shard"] = None
+
+
+def shard_of(doc_id: int, num_shards: int) -> int:
+    return doc_id % num_shards
+
+
+def shard_path(shards_dir: str, shard: int) -> str:
+    return os.path.join(shards_dir, f"{SHARD_PREFIX}{shard:02d}")
+
+
+def partition_documents(documents: Union[DocStore, list[dict]], num_shards: int) -> list[list[dict]]:
+    """Split documents by ID, keeping their order within every shard."""
+    shards: list[list[dict]] = [[] for _ in range(num_shards)]
+    for document in documents:
+        shards[shard_of(document['id'], num_shards)].append(document)
+    return shards
+
+
+def read_shards_manifest(shards_dir: str = SHARDS_DIR) -> dict:
+    try:
+        with open(os.path.join(shards_dir, SHARDS_MANIFEST), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise FileNotFoundError("Shards don't exist. Please run the build command.")
+
+
+def build_shards(
+    documents: Union[DocStore, list[dict]],
+    num_shards: int = DEFAULT_NUM_SHARDS,
+    shards_dir: str = SHARDS_DIR,
+    cache_dir: str = CACHE_DIR,
+    semantic: bool = True,
+    model=None,
+) -> dict:
+    """Split documents into shards and build the keyword index, and the movie and chunk embeddings, of each.
+
+    The keyword indexes are scored with the statistics of the whole corpus, so BM25
+    scores match the unsharded index. Embeddings are encoded through the embedding
+    store of `cache_dir`, texts the unsharded engines already encoded are reused.
+    """
+    if num_shards < 1:
+        raise ValueError(f"Number of shards ({num_shards}) must be at least 1")
+
+    start_time = time.perf_counter()
+    parts = partition_documents(documents, num_shards)
+
+    # Readers see no shards until the manifest of the new ones is published
+    manifest_path = os.path.join(shards_dir, SHARDS_MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    for name in os.listdir(shards_dir) if os.path.isdir(shards_dir) else []:
+        if name.startswith(SHARD_PREFIX):
+            shutil.rmtree(os.path.join(shards_dir, name))
+
+    indexes = []
+    for shard, shard_documents in enumerate(parts):
+        index = InvertedIndex(shard_path(shards_dir, shard))
+        index.build(shard_documents)
+        indexes.append(index)
+    use_shared_statistics(indexes)
+    for index in indexes:
+        index.save()
+
+    if semantic:
+        store = None
+        for shard, shard_documents in enumerate(parts):
+            # IDs can leave a shard without documents, it has no embeddings and is never searched
+            if not shard_documents:
+                continue
+            semantic_search = SemanticSearch(cache_dir=shard_path(shards_dir, shard))
+            chunked_search = ChunkedSemanticSearch(cache_dir=shard_path(shards_dir, shard))
+
+            # One embedding store and one model serve every shard
+            store = store or EmbeddingStore(semantic_search.model_name, cache_dir)
+            model = model if model is not None else semantic_search.load_model()
+            for engine in (semantic_search, chunked_search):
+                engine.embedding_store = store
+                engine.model = model
+
+            semantic_search.build_embeddings(shard_documents)
+            chunked_search.build_chunk_embeddings(shard_documents)
+
+    manifest = {
+        "num_shards": num_shards,
+        "docs_per_shard": [len(shard_documents) for shard_documents in parts],
+        "semantic": semantic,
+    }
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+    return {**manifest, "docs": len(documents), "seconds": time.perf_counter() - start_time}
+
+
+class Shard:
+    """Engines of one shard, memory-mapped from its directory on first use."""
+
+    def __init__(self, directory: str) -> None:
+        self.index = InvertedIndex(directory)
+        self.index.load()
+        self.directory = directory
+        self.semantic: Optional[SemanticSearch] = None
+        self.chunked: Optional[ChunkedSemanticSearch] = None
+
+    def load_embeddings(self) -> None:
+        """Memory-map the movie and chunk embeddings of the shard."""
+        if self.semantic is not None:
+            return
+
+        documents = self.index.doc_store()
+        # Queries arrive encoded, so neither the model nor the query cache is used here
+        semantic = SemanticSearch(cache_dir=self.directory, query_disk_cache=False)
+        chunked = ChunkedSemanticSearch(cache_dir=self.directory, query_disk_cache=False)
+        for engine in (semantic, chunked):
+            engine.load_or_create_embeddings(documents)
+        self.semantic, self.chunked = semantic, chunked
+
+    def search(self, mode: str, query: Any, limit: int, exact: bool, nprobe: int) -> list[dict]:
+        if len(self.index.doc_store()) == 0:
+            # An empty shard was built without embeddings, and its index statistics are the whole corpus's
+            return []
+        if mode != "bm25":
+            self.load_embeddings()
+
+        match mode:
+            case "bm25":
+                return [{"id": doc_id, **result} for doc_id, result in self.index.bm25_search(query, limit).items()]
+            case "semantic":
+                return self.semantic.search_by_embedding(query, limit, exact, nprobe)
+            case "chunked":
+                return self.chunked.search_chunks_by_embedding(query, limit, exact, nprobe)
+            case _:
+                raise ValueError(f"Unknown search mode '{mode}', expected one of {', '.join(SHARD_SEARCH_MODES)}")
+
+
+def _init_shard_worker(directory: str) -> None:
+    global _worker_shard_dir
+    _worker_shard_dir = directory
+
+
+def _load_shard(embeddings: bool) -> None:
+    global _worker_shard
+    if _worker_shard is None:
+        _worker_shard = Shard(_worker_shard_dir)
+    if embeddings:
+        _worker_shard.load_embeddings()
+
+
+def _search_shard(mode: str, query: Any, limit: int, exact: bool, nprobe: int) -> tuple[list[dict], float]:
+    """Search the shard of this worker, returning its top results and the milliseconds spent."""
+    start = time.perf_counter()
+    _load_shard(False)
+    results = _worker_shard.search(mode, query, limit, exact, nprobe)
+    return results, (time.perf_counter() - start) * 1000
+
+
+class ShardedSearch:
+    """Fans every query out to one worker process per shard and merges their top results.
+
+    A worker memory-maps the files of its shard on its first query and keeps them
+    loaded, pages are shared with every other process mapping them. Semantic queries
+    are encoded once here and the embedding is sent to the workers.
+    """
+
+    def __init__(self, shards_dir: str = SHARDS_DIR, cache_dir: str = CACHE_DIR) -> None:
+        # Imported here, like the parallel build, so importing the module stays cheap
+        from concurrent.futures import ProcessPoolExecutor
+
+        manifest = read_shards_manifest(shards_dir)
+        self.num_shards = manifest["num_shards"]
+        self.semantic = manifest["semantic"]
+
+        # Empty shards have nothing to return, only shards with documents get a worker
+        self.searched_shards = [shard for shard, docs in enumerate(manifest["docs_per_shard"]) if docs]
+        self._executors = [
+            ProcessPoolExecutor(max_workers=1, initializer=_init_shard_worker, initargs=(shard_path(shards_dir, shard),))
+            for shard in self.searched_shards
+        ]
+
+        # Encodes queries with the model and query cache of the unsharded engines
+        self.query_encoder = SemanticSearch(cache_dir=cache_dir)
+
+        # Milliseconds spent by each shard and by the whole last search
+        self.last_timings: dict = {}
+
+    def warm_up(self, embeddings: bool = False) -> None:
+        """Load every shard in its worker before the first query."""
+        for future in [executor.submit(_load_shard, embeddings) for executor in self._executors]:
+            future.result()
+
+    def search(
+        self,
+        mode: str,
+        query: str,
+        limit: int = DEFAULT_SEARCH_LIMIT,
+        exact: bool = False,
+        nprobe: int = ANN_NPROBE,
+    ) -> list[dict]:
+        if mode not in SHARD_SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{mode}', expected one of {', '.join(SHARD_SEARCH_MODES)}")
+        if mode != "bm25" and not self.semantic:
+            raise ValueError("Shards were built without embeddings. Please build them with embeddings.")
+
+        profile = current_profile()
+        start = time.perf_counter()
+        payload: Any = query
+        if mode != "bm25":
+            # Records its own query_cache and encode stages
+            payload = normalize_embeddings(self.query_encoder.generate_embedding(query))
+
+        with profile.stage("fan_out"):
+            futures = [executor.submit(_search_shard, mode, payload, limit, exact, nprobe) for executor in self._executors]
+            shard_results = [future.result() for future in futures]
+
+        with profile.stage("merge"):
+            results = merge_top_k([results for results, _ in shard_results], limit)
+
+        self.last_timings = {
+            "shard_ms": [ms for _, ms in shard_results],
+            "total_ms": (time.perf_counter() - start) * 1000,
+        }
+        return results
+
+    def close(self) -> None:
+        for executor in self._executors:
+            executor.shutdown()
+
+
+def merge_top_k(shard_results: list[list[dict]], limit: int) -> list[dict]:
+    """Global top results from the top results of every shard, ties broken by document ID."""
+    results = [result for results in shard_results for result in results]
+    return sorted(results, key=lambda result: (-result["score"], result["id"]))[:limit]
+
+
+def build_shards_command(num_shards: int = DEFAULT_NUM_SHARDS, semantic: bool = True) -> dict:
+    return build_shards(load_doc_store(), num_shards, semantic=semantic)
+
+
+def search_command(
+    mode: str,
+    query: str,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    exact: bool = False,
+    nprobe: int = ANN_NPROBE,
+) -> tuple[list[dict], dict]:
+    search = ShardedSearch()
+    try:
+        results = search.search(mode, query, limit, exact, nprobe)
+        return results, search.last_timings
+    finally:
+        search.close()
+
+
+def shards_info_command() -> dict:
+    return read_shards_manifest()
@@ -0,0 +1,103 @@
+import json
+import os
+from typing import Iterator
+
+import numpy as np
+
+# Frequent English words lead the vocabulary, so stop word removal has work to do as in real descriptions
+COMMON_WORDS = ["the", "a", "of", "and", "to", "in", "with", "his", "her", "their", "on", "for"]
+SYLLABLES = [
+    "ka", "lo", "mi", "ren", "tor", "vi", "sa", "dun", "el", "qua",
+    "zor", "bi", "nex", "ul", "fen", "gar", "ho", "tri", "pel", "os",
+    "mar", "cy", "dra", "ion", "vek", "sul", "ith", "bro", "ne", "ax",
+]
+VOCABULARY_SIZE = 20000
+
+# Word frequencies follow a Zipf law with this exponent, like natural text
+ZIPF_EXPONENT = 1.1
+
+# Words and documents drawn from the generator at a time
+WORD_BLOCK_SIZE = 1 << 20
+DOC_BLOCK_SIZE = 10000
+
+
+def make_vocabulary(size: int = VOCABULARY_SIZE, seed: int = 0) -> list[str]:
+    """Distinct pronounceable pseudo-words, most frequent first."""
+    rng = np.random.default_rng(seed)
+    words = list(COMMON_WORDS)
+    seen = set(words)
+    while len(words) < size:
+        word = "".join(SYLLABLES[i] for i in rng.integers(len(SYLLABLES), size=rng.integers(2, 5)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words[:size]
+
+
+class WordSampler:
+    """Draws Zipf-distributed words, a block of random draws at a time."""
+
+    def __init__(self, vocabulary: list[str], rng: np.random.Generator) -> None:
+        self.vocabulary = vocabulary
+        self.rng = rng
+        weights = 1 / np.arange(1, len(vocabulary) + 1) ** ZIPF_EXPONENT
+        self.probabilities = weights / weights.sum()
+        self.block: list[int] = []
+        self.position = 0
+
+    def words(self, count: int) -> list[str]:
+        if self.position + count > len(self.block):
+            self.block = self.rng.choice(len(self.vocabulary), size=max(count, WORD_BLOCK_SIZE), p=self.probabilities).tolist()
+            self.position = 0
+
+        ids = self.block[self.position:self.position + count]
+        self.position += count
+        return [self.vocabulary[i] for i in ids]
+
+
+def generate_movies(num_docs: int, seed: int = 0, vocabulary_size: int = VOCABULARY_SIZE) -> Iterator[dict]:
+    """Stream `num_docs` deterministic movies in the movies.json schema.
+
+    Descriptions have 2-6 sentences of 6-14 words ending in ., ! or ?, so both
+    the fixed-size and the sentence chunkers split them. A smaller corpus of the
+    same seed is a prefix of a larger one.
+    """
+    rng = np.random.default_rng(seed)
+    sampler = WordSampler(make_vocabulary(vocabulary_size, seed), rng)
+
+    for start in range(0, num_docs, DOC_BLOCK_SIZE):
+        # Shapes of a whole block of documents, drawn together even for the last block
+        title_lengths = rng.integers(1, 5, size=DOC_BLOCK_SIZE).tolist()
+        sentence_counts = rng.integers(2, 7, size=DOC_BLOCK_SIZE).tolist()
+        sentence_lengths = iter(rng.integers(6, 15, size=sum(sentence_counts)).tolist())
+        endings = iter(rng.integers(3, size=sum(sentence_counts)).tolist())
+
+        block_size = min(DOC_BLOCK_SIZE, num_docs - start)
+
+        for i in range(block_size):
+            title = " ".join(word.capitalize() for word in sampler.words(title_lengths[i]))
+            sentences = [
+                " ".join(sampler.words(next(sentence_lengths))).capitalize() + ".!?"[next(endings)]
+                for _ in range(sentence_counts[i])
+            ]
+            yield {"id": start + i + 1, "title": title, "description": " ".join(sentences)}
+
+
+def generate_queries(num_queries: int, seed: int = 0, vocabulary_size: int = VOCABULARY_SIZE) -> list[str]:
+    """Short queries of 1-4 words drawn from the same vocabulary as generate_movies(seed), without the common words."""
+    # The corpus seed picks the vocabulary, a second stream picks the words
+    rng = np.random.default_rng([seed, 1])
+    sampler = WordSampler(make_vocabulary(vocabulary_size, seed)[len(COMMON_WORDS):], rng)
+    return [" ".join(sampler.words(int(rng.integers(1, 5)))) for _ in range(num_queries)]
+
+
+def write_corpus(path: str, num_docs: int, seed: int = 0) -> None:
+    """Write a synthetic corpus as a movies.json file, one document at a time."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write('{"movies": [\n')
+        for i, movie in enumerate(generate_movies(num_docs, seed)):
+            f.write((",\n" if i else "") + json.dumps(movie))
+        f.write("\n]}\n")
+    os.replace(tmp_path, path)
@@ -0,0 +1,68 @@
+import re
+
+# Sentence boundaries: whitespace after a ., ! or ?
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+
+def validate_search_inputs(chunk_size: int, overlap: int) -> None:
+    # Validate inputs
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be greater than 0")
+    
+    if overlap < 0:
+        raise ValueError("overlap cannot be negative")
+    
+    if overlap >= chunk_size:
+        raise ValueError(f"overlap ({overlap}) must be less than chunk_size ({chunk_size})")
+
+
+def chunk_text_command(text: str, chunk_size: int, overlap: int) -> list[str]:
+    validate_search_inputs(chunk_size, overlap)
+    
+    words = text.split()
+    chunks = []
+    
+    # Calculate step size: when overlap > 0, each chunk should overlap by 'overlap' words
+    step_size = chunk_size - overlap if overlap > 0 else chunk_size
+    
+    # Create chunks with proper overlap
+    for i in range(0, len(words), step_size):
+        chunk = " ".join(words[i:i + chunk_size])
+        if chunk:
+            chunks.append(chunk)
+    
+    return chunks
+
+
+def semantic_chunk_command(text: str, max_chunk_size: int, overlap: int) -> list[str]:
+    validate_search_inputs(max_chunk_size, overlap)
+    
+    text = text.strip()
+    if not text:
+        return []
+
+    # Split text into individual sentences
+    sentences = SENTENCE_BOUNDARY.split(text)
+    
+    # Strip whitespace from each sentence
+    sentences = [sentence for sentence in sentences if sentence.strip()]
+    
+    # Filter out empty sentences
+    sentences = [sentence for sentence in sentences if sentence]
+    
+    # After splitting sentences, if there's only one sentence and it doesn't end with 
+    # punctuation mark like ., !, or ?, treat the whole text as one sentence
+    if len(sentences) == 1 and not sentences[0].endswith(('.', '!', '?')):
+        sentences = [text.strip()]
+
+    # Calculate step size: when overlap > 0, each chunk should overlap by 'overlap' sentences
+    step_size = max_chunk_size - overlap if overlap > 0 else max_chunk_size
+    chunks = []
+    
+    # Create chunks with proper overlap
+    for i in range(0, len(sentences), step_size):
+        chunk = " ".join(sentences[i:i + max_chunk_size]).strip()
+        if chunk:
+            chunks.append(chunk)
+    
+    return chunks
@@ -0,0 +1,118 @@
+import os
+import string
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from .index_format import StringTable
+from .profiling import current_profile
+from .search_utils import STEM_CACHE_SIZE, load_stop_words
+
+# Maps all punctuation to None (removes them)
+PUNCTUATION_TRANSLATOR = str.maketrans('', '', string.punctuation)
+
+
+class StemMap:
+    """Persisted raw word -> stem vocabulary, stored as two aligned string tables."""
+
+    def __init__(self, words: StringTable, stems: StringTable) -> None:
+        # Sorted raw words and the stem of each word at the same position
+        self.words = words
+        self.stems = stems
+
+    @classmethod
+    def from_dict(cls, vocabulary: dict[str, str]) -> "StemMap":
+        words = sorted(vocabulary)
+        return cls(
+            StringTable.from_strings(words),
+            StringTable.from_strings([vocabulary[word] for word in words]),
+        )
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def get(self, word: str) -> Optional[str]:
+        i = self.words.find(word)
+        return self.stems[i] if i >= 0 else None
+
+    def save(self, directory: str) -> None:
+        self.words.save(directory, "stem_words")
+        self.stems.save(directory, "stem_values")
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["StemMap"]:
+        """Load the stem map stored in a directory, or None if there is none."""
+        if not os.path.exists(os.path.join(directory, "stem_words.npy")):
+            return None
+
+        return cls(
+            StringTable.load(directory, "stem_words"),
+            StringTable.load(directory, "stem_values"),
+        )
+
+
+class Tokenizer:
+    """Lowercases, strips punctuation, drops stopwords and stems text.
+
+    Stopwords are loaded once, stems are memoized in a bounded LRU cache and can
+    be served from persisted stem maps, in which case NLTK is only imported for
+    words that none of the maps know.
+    """
+
+    def __init__(
+        self,
+        stop_words: Optional[Iterable[str]] = None,
+        stem_maps: Optional[list[StemMap]] = None,
+        record_vocabulary: bool = False,
+        cache_size: int = STEM_CACHE_SIZE,
+    ) -> None:
+        with current_profile().stage("load_stopwords"):
+            self.stop_words = frozenset(load_stop_words() if stop_words is None else stop_words)
+        self.stem_maps = stem_maps or []
+
+        # Maps every raw word seen -> stem, recorded at build time so it can be persisted
+        self.vocabulary: Optional[dict[str, str]] = {} if record_vocabulary else None
+
+        self._stemmer = None
+        self.stem = lru_cache(maxsize=cache_size)(self.__stem)
+
+    def __stem(self, word: str) -> str:
+        for stem_map in self.stem_maps:
+            stem = stem_map.get(word)
+            if stem is not None:
+                return stem
+
+        if self._stemmer is None:
+            # Imported lazily, query-time tokenization usually never gets here
+            from nltk.stem import PorterStemmer
+            self._stemmer = PorterStemmer()
+
+        stem = self._stemmer.stem(word)
+        if self.vocabulary is not None:
+            self.vocabulary[word] = stem
+        return stem
+
+    def tokenize(self, text: str) -> list[str]:
+        """Split text and convert it into word-based tokens, filtering out stopwords."""
+        stop_words = self.stop_words
+        stem = self.stem
+        return [stem(word) for word in preprocess_text(text).split() if word not in stop_words]
+
+    def tokenize_many(self, texts: Iterable[str]) -> list[list[str]]:
+        """Tokenize a batch of texts, e.g. every document of a corpus at build time."""
+        tokenize = self.tokenize
+        return [tokenize(text) for text in texts]
+
+    def cache_info(self):
+        return self.stem.cache_info()
+
+
+def preprocess_text(text: str) -> str:
+    """Preprocess text for text matching."""
+    # Convert to lowercase and remove all punctuation
+    return text.lower().translate(PUNCTUATION_TRANSLATOR)
+
+
+@lru_cache(maxsize=1)
+def get_default_tokenizer() -> Tokenizer:
+    """Return a process-wide tokenizer without a stem map."""
+    return Tokenizer()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import argparse
+
+from lib.profiling import add_profile_argument, enable_profiling
+from lib.search_utils import SERVER_HOST, SERVER_PORT
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Search Server CLI")
+    subparsers = parser.add_subparsers(dest="command", help="Available commands")
+
+    serve_parser = subparsers.add_parser("serve", help="Load the indexes and the model once and answer searches until stopped")
+    serve_parser.add_argument("--host", type=str, default=SERVER_HOST, help="Address to listen on (Optional)")
+    serve_parser.add_argument("--port", type=int, default=SERVER_PORT, help="Port to listen on, 0 picks a free one (Optional)")
+    serve_parser.add_argument("--verbose", action="store_true", help="Log every request (Optional)")
+
+    subparsers.add_parser("status", help="Show whether a search server is running")
+    subparsers.add_parser("reload", help="Make the running server load the indexes again")
+    subparsers.add_parser("stop", help="Stop the running search server")
+
+    add_profile_argument(subparsers)
+    args = parser.parse_args()
+    if getattr(args, "profile", None):
+        enable_profiling(args.profile)
+
+    match args.command:
+        case "serve":
+            from lib.search_server import serve_command
+
+            print("Loading indexes...")
+            try:
+                serve_command(
+                    args.host,
+                    args.port,
+                    args.verbose,
+                    on_ready=lambda info: print(f"Serving on http://{info['host']}:{info['port']} (pid {info['pid']}, {info['documents']} documents)", flush=True),
+                )
+            except KeyboardInterrupt:
+                pass
+            print("Search server stopped.")
+
+        case "status":
+            from lib.search_client import server_status
+
+            status = server_status()
+            if status is None:
+                print("No search server running.")
+            else:
+                print(f"Search server running on http://{status['host']}:{status['port']} (pid {status['pid']})")
+                print(f"{status['documents']} documents, {status['requests_served']} searches served")
+
+        case "reload":
+            from lib.search_client import reload_server
+
+            status = reload_server()
+            print("No search server running." if status is None else f"Reloaded {status['documents']} documents.")
+
+        case "stop":
+            from lib.search_client import stop_server
+
+            print("Search server stopping." if stop_server() else "No search server running.")
+
+        case _:
+            parser.exit(2, parser.format_help())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,25 @@
 #!/usr/bin/env python3
 
 import argparse
+import sys
 
+from lib.profiling import add_profile_argument, enable_profiling
 from lib.search_utils import (
+    ANN_NPROBE,
     DEFAULT_MAX_CHUNK_SIZE,
+    DEFAULT_QUERY_BATCH_SIZE,
     DEFAULT_SEARCH_LIMIT,
-    DEFAULT_CHUNK_SIZE
-)
-from lib.semantic_search import (
-    chunk_text_command,
-    embed_query_text_command,
-    embed_text_command,
-    search_command,
-    semantic_chunk_command,
-    verify_embeddings_command,
-    verify_model_command
-)
-from lib.chunked_semantic_search import (
-    embed_chunks_command,
-    search_chunked_command
+    DEFAULT_CHUNK_SIZE,
+    EMBED_BATCH_SIZE,
+    EMBED_CHUNK_WORKERS,
+    EMBEDDING_DTYPES,
+    EMBEDDING_QUANTIZATIONS
 )
+from lib.text_chunking import chunk_text_command, semantic_chunk_command
+
+# The embedding commands import NumPy and the model libraries inside their case,
+# so text-only commands, --help and searches answered by a running search server
+# start without them
 
 def main():
     parser = argparse.ArgumentParser(description="Semantic Search CLI")
@@ -33,7 +33,8 @@ def main():
     embed_parser.add_argument("text", type=str, help="Single text")
 
     # Verify embeddings
-    subparsers.add_parser("verify_embeddings", help="Verify movie dataset embeddings")
+    verify_embeddings_parser = subparsers.add_parser("verify_embeddings", help="Verify movie dataset embeddings")
+    verify_embeddings_parser.add_argument("--dtype", type=str, choices=EMBEDDING_DTYPES, default=None, help="Storage type of the embedding matrix, converts the cached one; defaults to the cached type or float32 (Optional)")
 
     # Generate query embedding
     embed_query_parser = subparsers.add_parser("embed_query", help="Generate query embedding")
@@ -43,6 +44,11 @@ def main():
     search_parser = subparsers.add_parser("search", help="Search movies by Semantic Search scoring")
     search_parser.add_argument("query", type=str, help="Search query")
     search_parser.add_argument("--limit", type=int, default=DEFAULT_SEARCH_LIMIT, help="Search results limit (Optional)")
+    search_parser.add_argument("--dtype", type=str, choices=EMBEDDING_DTYPES, default=None, help="Storage type of the embedding matrix, converts the cached one; defaults to the cached type or float32 (Optional)")
+    search_parser.add_argument("--exact", action="store_true", help="Scan every embedding instead of using the ANN index (Optional)")
+    search_parser.add_argument("--nprobe", type=int, default=ANN_NPROBE, help="ANN lists scanned per query (Optional)")
+    search_parser.add_argument("--cache-stats", action="store_true", help="Print query embedding and result cache hits and misses (Optional)")
+    search_parser.add_argument("--quantization", type=str, choices=EMBEDDING_QUANTIZATIONS, default=None, help="Scan int8 or binary codes, then rescore the best candidates with the stored embeddings (Optional)")
 
     # Text chunk
     chunk_parser = subparsers.add_parser("chunk", help="Splits long text into smaller text of given chunk size")
@@ -58,15 +64,65 @@ def main():
 
     # Embed chunks
     embed_chunk = subparsers.add_parser("embed_chunks", help="Build chunk embeddings for the movies dataset")
+    embed_chunk.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="Chunks encoded per batch (Optional)")
+    embed_chunk.add_argument("--workers", type=int, default=EMBED_CHUNK_WORKERS, help="Processes chunking the movies while batches are encoded (Optional)")
 
     # Chunked Semantic Search
     search_chunked = subparsers.add_parser("search_chunked", help="")
     search_chunked.add_argument("query", type=str, help="Search query")
     search_chunked.add_argument("--limit", type=int, default=DEFAULT_SEARCH_LIMIT, help="Search results limit (Optional)")
-
+    search_chunked.add_argument("--exact", action="store_true", help="Scan every chunk embedding instead of using the ANN index (Optional)")
+    search_chunked.add_argument("--nprobe", type=int, default=ANN_NPROBE, help="ANN lists scanned per query (Optional)")
+    search_chunked.add_argument("--cache-stats", action="store_true", help="Print query embedding and result cache hits and misses (Optional)")
+    search_chunked.add_argument("--quantization", type=str, choices=EMBEDDING_QUANTIZATIONS, default=None, help="Scan int8 or binary codes, then rescore the best candidates with the stored embeddings (Optional)")
+
+    # Batch search
+    batch_parser = subparsers.add_parser("batch", help="Search every query of a file with batched encoding and scoring, writing JSONL results")
+    batch_parser.add_argument("queries", type=str, help='File with one query per line (text or JSON with a "query" key), - for stdin')
+    batch_parser.add_argument("--limit", type=int, default=DEFAULT_SEARCH_LIMIT, help="Search results limit per query (Optional)")
+    batch_parser.add_argument("--chunked", action="store_true", help="Search the chunk embeddings instead of the movie embeddings (Optional)")
+    batch_parser.add_argument("--exact", action="store_true", help="Scan every embedding instead of using the ANN index (Optional)")
+    batch_parser.add_argument("--nprobe", type=int, default=ANN_NPROBE, help="ANN lists scanned per query (Optional)")
+    batch_parser.add_argument("--output", type=str, default="-", help="JSONL output file, - for stdout (Optional)")
+    batch_parser.add_argument("--batch-size", type=int, default=DEFAULT_QUERY_BATCH_SIZE, help="Queries encoded and scored at a time (Optional)")
+    batch_parser.add_argument("--quantization", type=str, choices=EMBEDDING_QUANTIZATIONS, default=None, help="Scan int8 or binary codes, then rescore the best candidates with the stored embeddings (Optional)")
+
+    # ANN recall vs latency
+    ann_report = subparsers.add_parser("ann_report", help="Report recall@k and latency of the ANN indexes against exact search")
+    ann_report.add_argument("--limit", type=int, default=10, help="k of recall@k (Optional)")
+    ann_report.add_argument("--queries", type=int, default=100, help="Number of sampled queries (Optional)")
+    ann_report.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64], help="nprobe values to compare (Optional)")
+
+    # Quantized memory and recall vs float
+    quantization_report = subparsers.add_parser("quantization_report", help="Report memory saved, recall@k and latency of the int8 and binary codes against the stored embeddings")
+    quantization_report.add_argument("--limit", type=int, default=10, help="k of recall@k (Optional)")
+    quantization_report.add_argument("--queries", type=int, default=100, help="Number of sampled queries (Optional)")
+
+    add_profile_argument(subparsers)
     args = parser.parse_args()
+    if getattr(args, "profile", None):
+        enable_profiling(args.profile)
 
     match args.command:
+        case "ann_report":
+            from lib.chunked_semantic_search import ann_report_command
+
+            report = ann_report_command(args.limit, args.queries, args.nprobe)
+
+            for name, rows in report.items():
+                print(f"\n{name} (recall@{args.limit} over {args.queries} queries)")
+                print(f"{'nprobe':>8} {'recall':>8} {'mean ms':>9} {'p95 ms':>9}")
+                for row in rows:
+                    print(f"{row['nprobe']:>8} {row['recall']:>8.3f} {row['mean_ms']:>9.2f} {row['p95_ms']:>9.2f}")
+        case "batch":
+            if args.chunked:
+                from lib.chunked_semantic_search import batch_search_chunked_command as batch_command
+            else:
+                from lib.semantic_search import batch_search_command as batch_command
+
+            stats = batch_command(args.queries, args.limit, args.exact, args.nprobe, args.output, args.batch_size, args.quantization)
+            # Results go to stdout, so the summary goes to stderr
+            print(f"Answered {stats['queries']} queries in {stats['seconds']:.2f}s ({stats['queries_per_sec']:.0f} queries/sec)", file=sys.stderr)
         case "chunk":
             chunks = chunk_text_command(args.text, args.chunk_size, args.overlap)
             print(f"Chunking {len(args.text)} characters")
@@ -74,23 +130,59 @@ def main():
             for i, chunk in enumerate(chunks, start=1):
                 print(f"{i}. {chunk}")
         case "embed_chunks":
-            embed_chunks_command()
+            from lib.chunked_semantic_search import embed_chunks_command
+            from lib.search_client import reload_server
+
+            embed_chunks_command(args.batch_size, args.workers)
+            if reload_server() is not None:
+                print("Search server reloaded.")
         case "embed_query":
+            from lib.semantic_search import embed_query_text_command
+
             embed_query_text_command(args.query)
         case "embed_text":
+            from lib.semantic_search import embed_text_command
+
             embed_text_command(args.text)
         case "search":
-            results = search_command(args.query, args.limit)
+            from lib.search_client import forward_search
+
+            # The server keeps its own dtype, storage and cache, so requests for any of them are answered locally
+            results = None
+            if args.dtype is None and args.quantization is None and not args.cache_stats:
+                results = forward_search("semantic", args.query, args.limit, exact=args.exact, nprobe=args.nprobe)
+            if results is None:
+                from lib.semantic_search import search_command
+
+                results = search_command(args.query, args.limit, args.dtype, args.exact, args.nprobe, args.cache_stats, args.quantization)
 
             for i, result in enumerate(results, start=1):
                 print(f"{i}.\t{result['title']} (score: {result['score']:.2f})")
                 print(f"\t{result['description'][:200]}...")
         case "search_chunked":
-            results = search_chunked_command(args.query, args.limit)
+            from lib.search_client import forward_search
+
+            results = None
+            if args.quantization is None and not args.cache_stats:
+                results = forward_search("chunked", args.query, args.limit, exact=args.exact, nprobe=args.nprobe)
+            if results is None:
+                from lib.chunked_semantic_search import search_chunked_command
+
+                results = search_chunked_command(args.query, args.limit, args.exact, args.nprobe, args.cache_stats, args.quantization)
 
             for i, result in enumerate(results, start=1):
                 print(f"\n{i}. {result['title']} (score: {result['score']:.4f})")
                 print(f"   {result['description']}...")
+        case "quantization_report":
+            from lib.chunked_semantic_search import quantization_report_command
+
+            report = quantization_report_command(args.limit, args.queries)
+
+            for name, rows in report.items():
+                print(f"\n{name} (recall@{args.limit} over {args.queries} queries, every row scanned)")
+                print(f"{'storage':>8} {'MB':>9} {'saved':>7} {'recall':>8} {'mean ms':>9} {'p95 ms':>9}")
+                for row in rows:
+                    print(f"{row['storage']:>8} {row['mb']:>9.2f} {row['saved']:>7.1%} {row['recall']:>8.3f} {row['mean_ms']:>9.2f} {row['p95_ms']:>9.2f}")
         case "semantic_chunk":
             chunks = semantic_chunk_command(args.text, args.max_chunk_size, args.overlap)
             print(f"Semantically chunking {len(args.text)} characters")
@@ -98,9 +190,16 @@ def main():
             for i, chunk in enumerate(chunks, start=1):
                 print(f"{i}. {chunk}")
         case "verify":
+            from lib.semantic_search import verify_model_command
+
             verify_model_command()
         case "verify_embeddings":
-            verify_embeddings_command()
+            from lib.semantic_search import verify_embeddings_command
+            from lib.search_client import reload_server
+
+            verify_embeddings_command(args.dtype)
+            if reload_server() is not None:
+                print("Search server reloaded.")
         case _:
             parser.print_help()
 
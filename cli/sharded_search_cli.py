@@ -0,0 +1,64 @@
+import argparse
+
+from lib.profiling import add_profile_argument, enable_profiling
+from lib.search_utils import ANN_NPROBE, DEFAULT_NUM_SHARDS, DEFAULT_SEARCH_LIMIT
+
+SEARCH_MODES = ("bm25", "semantic", "chunked")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Sharded Search CLI")
+    subparsers = parser.add_subparsers(dest="command", help="Available commands")
+
+    build_parser = subparsers.add_parser("build", help="Split the movies into shards and build the indexes of each")
+    build_parser.add_argument("--shards", type=int, default=DEFAULT_NUM_SHARDS, help="Number of shards (Optional)")
+    build_parser.add_argument("--keyword-only", action="store_true", help="Only build the keyword indexes, not the embeddings (Optional)")
+
+    subparsers.add_parser("info", help="Show the number of shards and documents per shard")
+
+    search_parser = subparsers.add_parser("search", help="Search every shard in parallel and merge the top results")
+    search_parser.add_argument("mode", type=str, choices=SEARCH_MODES, help="Search mode")
+    search_parser.add_argument("query", type=str, help="Search query")
+    search_parser.add_argument("--limit", type=int, default=DEFAULT_SEARCH_LIMIT, help="Search results limit (Optional)")
+    search_parser.add_argument("--exact", action="store_true", help="Scan every embedding instead of using the ANN indexes (Optional)")
+    search_parser.add_argument("--nprobe", type=int, default=ANN_NPROBE, help="IVF lists scanned per query and shard (Optional)")
+    search_parser.add_argument("--timings", action="store_true", help="Print the time spent by each shard (Optional)")
+
+    add_profile_argument(subparsers)
+    args = parser.parse_args()
+    if getattr(args, "profile", None):
+        enable_profiling(args.profile)
+
+    match args.command:
+        case "build":
+            from lib.sharded_search import build_shards_command
+
+            print(f"Building {args.shards} shards...")
+            stats = build_shards_command(args.shards, not args.keyword_only)
+            print(f"Built {stats['num_shards']} shards of {stats['docs']} documents in {stats['seconds']:.2f}s")
+            print(f"Documents per shard: {', '.join(str(docs) for docs in stats['docs_per_shard'])}")
+
+        case "info":
+            from lib.sharded_search import shards_info_command
+
+            info = shards_info_command()
+            print(f"{info['num_shards']} shards, {'with' if info['semantic'] else 'without'} embeddings")
+            for shard, docs in enumerate(info["docs_per_shard"]):
+                print(f"  shard {shard}: {docs} documents")
+
+        case "search":
+            from lib.sharded_search import search_command
+
+            results, timings = search_command(args.mode, args.query, args.limit, args.exact, args.nprobe)
+            for i, result in enumerate(results, start=1):
+                print(f"{i}. ({result['id']}) {result['title']} - Score: {result['score']:.4f}")
+            if args.timings:
+                shard_timings = ", ".join(f"{ms:.1f}" for ms in timings["shard_ms"])
+                print(f"\nShards: {shard_timings} ms, Total (parallel): {timings['total_ms']:.1f} ms")
+
+        case _:
+            parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
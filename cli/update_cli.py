@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import argparse
+
+from lib.incremental_update import (
+    COMPACTION_LOG_PATH,
+    compact_command,
+    start_background_compaction,
+    update_command
+)
+from lib.profiling import add_profile_argument, enable_profiling
+from lib.search_client import reload_server
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Incremental Update CLI")
+    subparsers = parser.add_subparsers(dest="command", help="Available commands")
+
+    apply_parser = subparsers.add_parser("apply", help="Add, update and delete documents without rebuilding the indexes")
+    apply_parser.add_argument("delta", type=str, help='JSON file with "add", "update" and "delete" keys')
+    apply_parser.add_argument("--compact", action="store_true", help="Start a background compaction afterwards (Optional)")
+
+    compact_parser = subparsers.add_parser("compact", help="Merge index segments and drop deleted documents")
+    compact_parser.add_argument("--background", action="store_true", help="Run the compaction in a detached process (Optional)")
+
+    add_profile_argument(subparsers)
+    args = parser.parse_args()
+    if getattr(args, "profile", None):
+        enable_profiling(args.profile)
+
+    match args.command:
+        case "apply":
+            print(f"Applying {args.delta}...")
+            stats = update_command(args.delta)
+            if "keyword" in stats:
+                keyword = stats["keyword"]
+                print(f"Inverted index: {keyword['upserted']} documents indexed, {keyword['tombstoned']} tombstoned, {keyword['segments']} segments")
+            for name in ("semantic", "chunked"):
+                if stats[name] is not None:
+                    print(f"{name.capitalize()} embeddings: {stats[name]['encoded']} encoded, {stats[name]['tombstoned']} tombstoned")
+            if reload_server() is not None:
+                print("Search server reloaded.")
+            if args.compact:
+                pid = start_background_compaction()
+                print(f"Compaction started in the background (pid {pid}), see {COMPACTION_LOG_PATH}")
+
+        case "compact":
+            if args.background:
+                pid = start_background_compaction()
+                print(f"Compaction started in the background (pid {pid}), see {COMPACTION_LOG_PATH}")
+            else:
+                print("Compacting...")
+                stats = compact_command()
+                for name, compacted in stats.items():
+                    print(f"{name}: {'compacted' if compacted else 'nothing to compact'}")
+                if any(stats.values()) and reload_server() is not None:
+                    print("Search server reloaded.")
+
+        case _:
+            parser.exit(2, parser.format_help())
+
+
+if __name__ == "__main__":
+    main()